@@ -0,0 +1,379 @@
+"""
+伺服器熱路徑的微基準測試，與儲存的基準值比較以偵測效能退化。
+
+    python benchmarks/bench.py                       # 執行並與 benchmarks/baseline.json 比較
+    python benchmarks/bench.py --filter game_state   # 只執行名稱包含 game_state 的項目
+    python benchmarks/bench.py --update-baseline     # 以這次的結果更新基準值
+
+每個項目會先自動決定每輪的呼叫次數 (每輪至少 --min-time 秒)，再執行 --rounds 輪，
+以每次呼叫時間的中位數與基準值比較；慢超過 --threshold (預設 15%) 時以 exit code 1 結束。
+基準值只在同一台機器、同一個 Python 版本上比較才有意義，請在固定的機器上產生並提交 baseline.json。
+
+完全離線執行：房間儲存與 channel layer 使用記憶體實作，不需要 LLM 金鑰，
+WebSocket 與 channel layer 以記錄訊息的 stub 取代。
+"""
+import io
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import inspect
+import argparse
+import platform
+import statistics
+import contextlib
+from datetime import datetime, timezone
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT_DIR, 'benchmarks', 'baseline.json')
+
+# 常見的畫布大小 (寬, 高)；最大值與 DRAWING_MAX_WIDTH / DRAWING_MAX_HEIGHT 的預設值相同
+CANVAS_SIZES = [(400, 300), (800, 600), (1024, 1024)]
+PLAYER_COUNTS = [2, 4, 6, 8]
+
+
+def setup_django():
+    # 基準測試一律使用記憶體實作，不連線到 Redis 或 LLM
+    os.environ['ROOM_STORE_BACKEND'] = 'memory'
+    os.environ['CHANNEL_LAYER'] = 'memory'
+    os.environ.pop('TRACE_FILE', None)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gartic_project.settings')
+    sys.path.insert(0, ROOT_DIR)
+    import django
+    django.setup()
+    import logging
+    logging.disable(logging.CRITICAL)
+
+
+def make_drawing(width, height, seed=0):
+    """類似玩家畫作的 PNG：白底加上數十條筆畫"""
+    from PIL import Image, ImageDraw
+    rng = random.Random(seed)
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        points = [(rng.randrange(width), rng.randrange(height)) for _ in range(rng.randint(3, 12))]
+        draw.line(points, fill=tuple(rng.randrange(256) for _ in range(3)), width=rng.choice((2, 4, 8)), joint='curve')
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def make_room(num_players):
+    """與 WaitingRoomConsumer.handle_start_game 建立的結構相同的遊戲房間 (全部為真人玩家)"""
+    player_ids = [f"player_{index}" for index in range(num_players)]
+    return {
+        'room_name': 'bench',
+        'players': {
+            player_id: {
+                'id': player_id, 'name': player_id, 'isBot': False, 'isHost': index == 0,
+                'channel_name': f"bench.channel!{player_id}",
+            }
+            for index, player_id in enumerate(player_ids)
+        },
+        'host_id': player_ids[0],
+        'turn_order': player_ids,
+        'state': 'prompting',
+        'current_op_number': 0,
+        'total_ops': num_players - 1,
+        'current_display_round': 0,
+        'total_display_rounds': math.ceil((num_players - 1) / 2),
+        'books': {
+            player_id: [{'type': 'prompt', 'data': f"prompt from {player_id}", 'player': player_id, 'round': 0}]
+            for player_id in player_ids
+        },
+        'assignments': {},
+        'game_log': [],
+        'max_ai_assists_allowed': max(0, num_players // 2 - 1),
+        'ai_assist_usage': {player_id: 0 for player_id in player_ids},
+        'llm_providers': {},
+        'game_id': 'bench',
+    }
+
+
+class StubChannelLayer:
+    """只記錄訊息數量的 channel layer"""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, channel, message):
+        self.sent += 1
+
+    async def group_send(self, group, message):
+        self.sent += 1
+
+    async def group_add(self, group, channel):
+        pass
+
+    async def group_discard(self, group, channel):
+        pass
+
+
+def make_consumer(room_group_name, player_id, channel_layer):
+    from game.consumers import GameConsumer
+    consumer = GameConsumer()
+    consumer.scope = {'type': 'websocket', 'subprotocols': []}
+    consumer.channel_layer = channel_layer
+    consumer.channel_name = f"bench.channel!{player_id}"
+    consumer.room_name = 'bench'
+    consumer.room_group_name = room_group_name
+    consumer.player_id = player_id
+    consumer.trace_id = 'bench'
+    consumer.sent_bytes = 0
+
+    async def send(text_data=None, bytes_data=None, close=False):
+        consumer.sent_bytes += len(text_data if text_data is not None else bytes_data)
+    consumer.send = send
+    return consumer
+
+
+# --- 基準項目 ---
+# 每個 case 函式回傳 [(name, callable)]；callable 可以是一般函式或 coroutine 函式
+
+def case_data_urls():
+    from game.llm_client import image_bytes_to_data_url, data_url_to_image_bytes
+    cases = []
+    for width, height in CANVAS_SIZES:
+        image_bytes = make_drawing(width, height)
+        data_url = image_bytes_to_data_url(image_bytes)
+        cases.append((f"image_bytes_to_data_url[{width}x{height}]", lambda b=image_bytes: image_bytes_to_data_url(b)))
+        cases.append((f"data_url_to_image_bytes[{width}x{height}]", lambda u=data_url: data_url_to_image_bytes(u)))
+    return cases
+
+
+def case_game_state_payload():
+    cases = []
+    consumer = make_consumer('game_bench_state', 'player_0', StubChannelLayer())
+    for num_players in PLAYER_COUNTS:
+        room = make_room(num_players)
+        room['state'] = 'drawing'
+        room['current_op_number'] = 1
+        room['assignments'] = {player_id: {'type': 'draw'} for player_id in room['turn_order'][1:]}
+        cases.append((f"prepare_game_state_payload[{num_players}p]",
+                      lambda r=room: consumer.prepare_game_state_payload(r, "status")))
+    return cases
+
+
+def case_start_next_operation():
+    """start_next_operation 的書本輪轉與任務指派 (包含房間更新、指派訊息與狀態廣播)"""
+    from game import consumers
+    cases = []
+    for num_players in (4, 8):
+        key = f"game_bench_ops_{num_players}"
+        consumers.game_rooms.rooms[key] = make_room(num_players)
+        consumer = make_consumer(key, 'player_0', StubChannelLayer())
+
+        def rewind(room):
+            room['state'] = 'prompting'
+            room['current_op_number'] = 0
+            room['current_display_round'] = 0
+            room['assignments'] = {}
+
+        async def run(consumer=consumer, key=key, rewind=rewind):
+            await consumer.start_next_operation()
+            await consumer.flush_game_state()
+            await consumers.game_rooms.update(key, rewind)
+
+        cases.append((f"start_next_operation[{num_players}p]", run))
+    return cases
+
+
+def case_game_over_broadcast():
+    """game_over 的序列化：group_broadcast 編碼一次、每個 consumer 轉送，以及舊的逐一編碼路徑"""
+    from game.protocol import broadcast_event
+    cases = []
+    for num_players in (4, 8):
+        room = make_room(num_players)
+        payload = {
+            'players': {
+                player_id: {'name': data['name'], 'isBot': data['isBot'], 'isHost': data['isHost']}
+                for player_id, data in room['players'].items()
+            },
+            'turn_order': room['turn_order'],
+            'book_count': num_players,
+            'initial_book_index': 0,
+        }
+        group = [make_consumer('game_bench_over', player_id, StubChannelLayer()) for player_id in room['turn_order']]
+
+        async def encode_once(payload=payload, group=group):
+            event = broadcast_event('game_over', payload, codec_names=())  # 群組中只有 JSON 連線
+            for consumer in group:
+                await consumer.broadcast_frame(event)
+
+        async def legacy(payload=payload, group=group):
+            event = {'type': 'broadcast_message', 'message_type': 'game_over', 'payload': payload}
+            for consumer in group:
+                await consumer.broadcast_message(event)
+
+        cases.append((f"game_over.broadcast_frame[{num_players}p]", encode_once))
+        cases.append((f"game_over.broadcast_message[{num_players}p]", legacy))
+    return cases
+
+
+def case_submit_drawing():
+    """handle_submit_drawing：data URL 解碼、畫作正規化、存入 blob store、更新房間與廣播"""
+    from game import consumers
+    from game.llm_client import image_bytes_to_data_url
+    cases = []
+    for width, height in CANVAS_SIZES[:2]:
+        key = f"game_bench_submit_{width}x{height}"
+        room = make_room(4)
+        room['state'] = 'drawing'
+        room['current_op_number'] = 1
+        room['current_display_round'] = 1
+        assignment = {
+            'type': 'draw', 'assignment_id': '1-bench', 'original_player_id': 'player_3',
+            'ui_round': 1, 'prompt_or_guess': 'prompt from player_3',
+        }
+        room['assignments'] = {'player_0': dict(assignment), 'player_1': dict(assignment, original_player_id='player_0')}
+        consumers.game_rooms.rooms[key] = room
+        consumer = make_consumer(key, 'player_0', StubChannelLayer())
+        data_url = image_bytes_to_data_url(make_drawing(width, height, seed=1))
+
+        def rewind(room, assignment=assignment):
+            room['assignments']['player_0'] = dict(assignment)
+            room['books']['player_3'].pop()
+
+        async def run(consumer=consumer, key=key, data_url=data_url, rewind=rewind):
+            await consumer.handle_submit_drawing(data_url, '1-bench')
+            await consumer.flush_game_state()
+            await consumers.game_rooms.update(key, rewind)
+
+        cases.append((f"handle_submit_drawing[{width}x{height}]", run))
+    return cases
+
+
+CASES = [case_data_urls, case_game_state_payload, case_start_next_operation, case_game_over_broadcast, case_submit_drawing]
+
+
+# --- 執行 ---
+async def measure(func, min_time, rounds):
+    """回傳每次呼叫的秒數 (每輪一個值)"""
+    is_async = inspect.iscoroutinefunction(func)
+
+    async def run_batch(number):
+        started = time.perf_counter()
+        if is_async:
+            for _ in range(number):
+                await func()
+        else:
+            for _ in range(number):
+                func()
+        return time.perf_counter() - started
+
+    await run_batch(1)  # 暖機
+    number = 1
+    while True:
+        elapsed = await run_batch(number)
+        if elapsed >= min_time:
+            break
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)))
+    return [await run_batch(number) / number for _ in range(rounds)]
+
+
+async def run_cases(name_filter, min_time, rounds):
+    from game import consumers
+    results = {}
+    for case in CASES:
+        for name, func in case():
+            if name_filter and name_filter not in name:
+                continue
+            timings = await measure(func, min_time, rounds)
+            results[name] = {'median': statistics.median(timings), 'min': min(timings)}
+            print(f"  {name:<45} {format_time(results[name]['median']):>10}  (min {format_time(results[name]['min'])})",
+                  file=sys.stderr)
+    # start_next_operation 設定的階段期限
+    for key in [key for key in consumers.phase_timers.timers if key.startswith('game_bench')]:
+        consumers.phase_timers.cancel(key)
+    return results
+
+
+def format_time(seconds):
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f}ms"
+    return f"{seconds * 1e6:.1f}us"
+
+
+def machine_info():
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+    }
+
+
+def load_baseline(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def compare(results, baseline, threshold):
+    """回傳退化的項目數"""
+    regressions = 0
+    print(f"{'benchmark':<45} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, result in results.items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print(f"{name:<45} {'-':>10} {format_time(result['median']):>10} {'new':>8}")
+            continue
+        change = result['median'] / base['median'] - 1
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f"{name:<45} {format_time(base['median']):>10} {format_time(result['median']):>10} {change:>+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmarks for the server hot paths.')
+    parser.add_argument('--filter', help='only run benchmarks whose name contains this text')
+    parser.add_argument('--rounds', type=int, default=7, help='timed rounds per benchmark (default: 7)')
+    parser.add_argument('--min-time', type=float, default=0.1, help='minimum seconds per round (default: 0.1)')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='fail when the median is this much slower than the baseline (default: 0.15)')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline file (default: benchmarks/baseline.json)')
+    parser.add_argument('--update-baseline', action='store_true', help='store these results as the new baseline')
+    args = parser.parse_args()
+
+    setup_django()
+    # 遊戲程式中的 print 不輸出到終端 (進度顯示在 stderr)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results = asyncio.run(run_cases(args.filter, args.min_time, args.rounds))
+
+    if args.update_baseline:
+        baseline = load_baseline(args.baseline) or {'results': {}}
+        baseline['machine'] = machine_info()
+        baseline['updated'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        baseline['results'].update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline written to {args.baseline} ({len(results)} benchmarks).")
+        return
+
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one.")
+        for name, result in results.items():
+            print(f"{name:<45} {format_time(result['median']):>10}")
+        return
+    if baseline.get('machine') != machine_info():
+        print(f"Warning: baseline was recorded on a different machine or Python ({baseline.get('machine')}).",
+              file=sys.stderr)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"{regressions} benchmark(s) regressed by more than {args.threshold:.0%}.")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
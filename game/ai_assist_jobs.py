@@ -0,0 +1,69 @@
+import uuid
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AIAssistJob:
+    def __init__(self, job_id, room_group_name, player_id):
+        self.job_id = job_id
+        self.room_group_name = room_group_name
+        self.player_id = player_id
+        self.task = None
+        self.cancel_reason = None  # 'phase_ended', 'disconnect', 'player', 'room_closed'
+
+
+class AIAssistJobManager:
+    """
+    管理 AI 輔助繪畫的背景工作。
+    每個請求會立即取得 job_id，實際的 LLM 呼叫在背景 asyncio task 中執行，
+    不會阻塞 consumer 的訊息處理或其他房間。
+    """
+
+    def __init__(self):
+        self.jobs = {}  # {job_id: AIAssistJob}
+
+    def submit(self, room_group_name, player_id, job_coroutine_factory):
+        """
+        建立並啟動背景工作。
+        job_coroutine_factory 接收 AIAssistJob 並回傳要執行的 coroutine。
+        """
+        job = AIAssistJob(uuid.uuid4().hex, room_group_name, player_id)
+        self.jobs[job.job_id] = job
+        job.task = asyncio.create_task(job_coroutine_factory(job))
+        job.task.add_done_callback(lambda _task, job_id=job.job_id: self.jobs.pop(job_id, None))
+        logger.info(f"AI assist job {job.job_id} started for {player_id} in {room_group_name}")
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def has_pending(self, room_group_name, player_id):
+        return any(
+            job.room_group_name == room_group_name and job.player_id == player_id
+            for job in self.jobs.values()
+        )
+
+    def cancel(self, job_id, reason='player'):
+        job = self.jobs.get(job_id)
+        if not job or job.task.done():
+            return False
+        job.cancel_reason = reason
+        job.task.cancel()
+        logger.info(f"AI assist job {job_id} cancelled ({reason})")
+        return True
+
+    def cancel_for_player(self, room_group_name, player_id, reason='disconnect'):
+        job_ids = [
+            job.job_id for job in self.jobs.values()
+            if job.room_group_name == room_group_name and job.player_id == player_id
+        ]
+        return sum(1 for job_id in job_ids if self.cancel(job_id, reason))
+
+    def cancel_for_room(self, room_group_name, reason='phase_ended'):
+        job_ids = [job.job_id for job in self.jobs.values() if job.room_group_name == room_group_name]
+        return sum(1 for job_id in job_ids if self.cancel(job_id, reason))
+
+
+ai_assist_jobs = AIAssistJobManager()
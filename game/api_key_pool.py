@@ -0,0 +1,181 @@
+import time
+import asyncio
+import logging
+import threading
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class KeyPoolExhausted(Exception):
+    """Raised when no key became available before the acquire timeout."""
+
+    # Treated like a quota error so callers fail over instead of waiting on benched keys
+    code = 429
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, now):
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def time_until_available(self, now):
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class APIKey:
+    def __init__(self, index, key, client, bucket, max_concurrency):
+        self.index = index
+        self.key = key
+        self.client = client
+        self.bucket = bucket
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.benched_until = 0.0
+        self.consecutive_failures = 0
+        # Usage counters
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.failovers = 0
+
+    @property
+    def label(self):
+        return f"key{self.index}(...{self.key[-4:]})"
+
+
+class APIKeyPool:
+    """
+    Spreads LLM calls across all configured API keys.
+
+    Each key has its own token bucket (requests per minute) and concurrency limit.
+    A key that returns a quota (429) or server (5xx) error is benched with
+    exponential backoff and the call is retried on another key.
+    """
+
+    def __init__(self, keys, client_factory, requests_per_minute=15, max_concurrency=4,
+                 base_backoff=5.0, max_backoff=300.0):
+        if not keys:
+            raise ValueError("APIKeyPool needs at least one API key.")
+        rate = requests_per_minute / 60.0
+        self.keys = [
+            APIKey(i, key, client_factory(key), TokenBucket(rate, max(1, max_concurrency)), max_concurrency)
+            for i, key in enumerate(keys)
+        ]
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _try_pick(self):
+        """Returns (key, 0) if a key was reserved, else (None, seconds to wait)."""
+        now = time.monotonic()
+        with self.lock:
+            candidates = [
+                k for k in self.keys
+                if k.benched_until <= now and k.in_flight < k.max_concurrency
+            ]
+            # Prefer the least loaded key, then the least used one
+            for k in sorted(candidates, key=lambda k: (k.in_flight, k.requests)):
+                if k.bucket.try_acquire(now):
+                    k.in_flight += 1
+                    k.requests += 1
+                    metrics.llm_key_requests.inc(key_index=k.index)
+                    metrics.llm_key_in_flight.set(k.in_flight, key_index=k.index)
+                    return k, 0.0
+
+            waits = []
+            for k in self.keys:
+                if k.benched_until > now:
+                    waits.append(k.benched_until - now)
+                elif k.in_flight < k.max_concurrency:
+                    waits.append(k.bucket.time_until_available(now))
+            # If every key is at its concurrency limit, poll until a call finishes
+            return None, max(0.05, min(waits) if waits else 0.1)
+
+    async def acquire(self, timeout=None):
+        """Waits for a key; raises KeyPoolExhausted after `timeout` seconds (None waits forever)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            key, wait = self._try_pick()
+            if key:
+                return key
+            await asyncio.sleep(self._wait_before_deadline(wait, deadline))
+
+    def acquire_sync(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            key, wait = self._try_pick()
+            if key:
+                return key
+            time.sleep(self._wait_before_deadline(wait, deadline))
+
+    def _wait_before_deadline(self, wait, deadline):
+        if deadline is None:
+            return wait
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or wait > remaining:
+            # The next key frees up too late (e.g. every key is benched); give up now
+            raise KeyPoolExhausted(f"No API key available within the acquire timeout ({len(self.keys)} keys)")
+        return wait
+
+    def release(self, key, error=None):
+        with self.lock:
+            key.in_flight -= 1
+            metrics.llm_key_in_flight.set(key.in_flight, key_index=key.index)
+            if error is None:
+                key.successes += 1
+                key.consecutive_failures = 0
+                return
+            key.failures += 1
+            metrics.llm_key_errors.inc(key_index=key.index)
+            if self.is_failover_error(error):
+                key.consecutive_failures += 1
+                key.failovers += 1
+                metrics.llm_key_benches.inc(key_index=key.index)
+                backoff = min(self.max_backoff, self.base_backoff * 2 ** (key.consecutive_failures - 1))
+                key.benched_until = time.monotonic() + backoff
+                logger.warning(f"APIKeyPool: {key.label} benched for {backoff:.0f}s after error: {error}")
+
+    @staticmethod
+    def is_failover_error(error):
+        """Quota and server-side errors are worth retrying on another key."""
+        code = getattr(error, 'code', None)
+        return isinstance(code, int) and (code == 429 or code >= 500)
+
+    def stats(self):
+        now = time.monotonic()
+        with self.lock:
+            return [
+                {
+                    'key': k.label,
+                    'requests': k.requests,
+                    'successes': k.successes,
+                    'failures': k.failures,
+                    'failovers': k.failovers,
+                    'in_flight': k.in_flight,
+                    'benched_for': max(0.0, k.benched_until - now),
+                }
+                for k in self.keys
+            ]
@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+
+
+class GameConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'game'
+
+    def ready(self):
+        # 使用者名稱索引隨 User 的 signal 同步；索引本身在 ASGI 啟動時 (或第一次查詢時) 才載入，
+        # 避免在 app 初始化期間存取資料庫
+        from .user_registry import user_registry
+        user_registry.connect_signals()
@@ -0,0 +1,59 @@
+import json
+import struct
+
+# 二進位上傳訊息格式 (所有整數為 big-endian)：
+#   byte 0     : FRAME_MAGIC
+#   byte 1     : FRAME_VERSION
+#   byte 2     : 訊息類型代碼 (見 FRAME_TYPES)
+#   byte 3-4   : header 長度 (uint16)
+#   header     : UTF-8 JSON，例如 {"assignment_id": "...", "mime": "image/png"}
+#   其餘位元組 : 原始圖片內容 (PNG / WebP / JPEG)
+# 客戶端的實作在 static/js/room_game.js 的 sendBinaryMessage()
+FRAME_MAGIC = 0xC1
+FRAME_VERSION = 1
+FRAME_TYPES = {
+    'submit_drawing': 1,
+    'ai_assist_drawing': 2,
+}
+FRAME_TYPE_NAMES = {code: name for name, code in FRAME_TYPES.items()}
+
+UPLOAD_MIME_TYPES = ('image/png', 'image/webp', 'image/jpeg')
+
+_PREFIX = struct.Struct('>BBBH')
+
+
+class BinaryFrameError(ValueError):
+    """無法解析的二進位訊息"""
+
+
+def encode_frame(message_type, meta, body):
+    header = json.dumps(meta, separators=(',', ':')).encode('utf-8')
+    return _PREFIX.pack(FRAME_MAGIC, FRAME_VERSION, FRAME_TYPES[message_type], len(header)) + header + body
+
+
+def decode_frame(data):
+    """回傳 (message_type, meta, body)"""
+    if len(data) < _PREFIX.size:
+        raise BinaryFrameError("Frame too short")
+    magic, version, type_code, header_length = _PREFIX.unpack_from(data)
+    if magic != FRAME_MAGIC or version != FRAME_VERSION:
+        raise BinaryFrameError(f"Unsupported frame (magic={magic:#x}, version={version})")
+    message_type = FRAME_TYPE_NAMES.get(type_code)
+    if message_type is None:
+        raise BinaryFrameError(f"Unknown frame type {type_code}")
+
+    header_end = _PREFIX.size + header_length
+    if len(data) < header_end:
+        raise BinaryFrameError("Truncated frame header")
+    try:
+        meta = json.loads(bytes(data[_PREFIX.size:header_end]).decode('utf-8'))
+    except (UnicodeDecodeError, ValueError) as e:
+        raise BinaryFrameError(f"Invalid frame header: {e}")
+    if not isinstance(meta, dict):
+        raise BinaryFrameError("Frame header must be a JSON object")
+
+    mime_type = meta.get('mime', 'image/png')
+    if mime_type not in UPLOAD_MIME_TYPES:
+        raise BinaryFrameError(f"Unsupported image type {mime_type}")
+    meta['mime'] = mime_type
+    return message_type, meta, bytes(data[header_end:])
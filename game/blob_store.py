@@ -0,0 +1,322 @@
+import os
+import re
+import time
+import base64
+import asyncio
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# 畫作在房間狀態與訊息中以此路徑引用，由 views.blob 提供下載
+BLOB_URL_PREFIX = '/game/blobs/'
+
+MIME_EXTENSIONS = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/webp': 'webp',
+    'image/gif': 'gif',
+    'image/svg+xml': 'svg',
+}
+EXTENSION_MIMES = {ext: mime for mime, ext in MIME_EXTENSIONS.items()}
+
+_BLOB_KEY_PATTERN = re.compile(r'^[0-9a-f]{64}\.[a-z]+$')
+_DATA_URL_PATTERN = re.compile(r'^data:(image/[a-zA-Z+]+);base64,')
+
+
+def is_blob_key(key):
+    return bool(_BLOB_KEY_PATTERN.match(key or ''))
+
+
+def is_blob_url(value):
+    return isinstance(value, str) and value.startswith(BLOB_URL_PREFIX)
+
+
+def blob_url(key):
+    return f"{BLOB_URL_PREFIX}{key}/"
+
+
+def blob_key_from_url(url):
+    key = url[len(BLOB_URL_PREFIX):].strip('/')
+    return key if is_blob_key(key) else None
+
+
+def mime_type_for_key(key):
+    return EXTENSION_MIMES.get(key.rsplit('.', 1)[-1], 'application/octet-stream')
+
+
+class BlobStore:
+    """
+    以內容雜湊 (sha256) 為鍵的畫作儲存。
+    相同的圖片只會存一份；房間狀態與 WebSocket 訊息只需攜帶 blob URL。
+
+    記憶體層是以位元組數為上限的 LRU，超出上限的 blob 會移到磁碟層 (spill_dir)，
+    之後讀取時再提升回記憶體。write_through=True 時每個 blob 都會立即寫入磁碟，
+    讓共用同一個目錄的多個 worker 都能讀到其他 worker 存入的畫作。
+
+    磁碟層由 prune_disk() 清理：超過 disk_ttl 秒沒有寫入或讀取的檔案會被刪除，
+    總大小超過 disk_budget 時再從最久沒有使用的檔案開始刪除。
+    """
+
+    def __init__(self, memory_budget=64 * 1024 * 1024, spill_dir=None, write_through=False,
+                 disk_budget=1024 * 1024 * 1024, disk_ttl=24 * 3600, prune_interval=300):
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir or os.path.join(tempfile.gettempdir(), 'gartic_blobs')
+        self.write_through = write_through
+        self.disk_budget = disk_budget
+        self.disk_ttl = disk_ttl
+        self.prune_interval = prune_interval
+        self.last_pruned = 0.0
+        self.disk_bytes = 0
+        self.entries = OrderedDict()  # {key: bytes}
+        self.memory_bytes = 0
+        self.lock = threading.Lock()
+
+        self.puts = 0
+        self.dedup_hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.spilled = 0
+        self.pruned = 0
+
+        os.makedirs(self.spill_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(data, mime_type):
+        return f"{hashlib.sha256(data).hexdigest()}.{MIME_EXTENSIONS.get(mime_type, 'bin')}"
+
+    def _disk_path(self, key):
+        # 以雜湊前兩碼分目錄，避免單一目錄檔案過多
+        return os.path.join(self.spill_dir, key[:2], key)
+
+    # --- 磁碟層 ---
+    def _disk_write(self, key, data):
+        path = self._disk_path(key)
+        if os.path.exists(path):
+            # 更新修改時間，避免仍在使用的 blob 被 prune_disk() 當成過期
+            os.utime(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _disk_read(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def prune_disk(self, keep=frozenset()):
+        """
+        刪除磁碟層中過期 (超過 disk_ttl) 的 blob，總大小仍超過 disk_budget 時從最舊的開始刪除。
+        keep 中的 blob (例如仍被房間引用的) 不會被刪除。回傳刪除的檔案數。
+        """
+        files = []
+        total = 0
+        for directory, _, names in os.walk(self.spill_dir):
+            for name in names:
+                if not is_blob_key(name):
+                    continue  # 寫入中的暫存檔
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                total += stat.st_size
+                if name not in keep:
+                    files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+
+        now = time.time()
+        removed = 0
+        for mtime, size, path in files:
+            if now - mtime <= self.disk_ttl and total <= self.disk_budget:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"BlobStore: failed to remove {path}: {e}")
+                continue
+            total -= size
+            removed += 1
+        self.disk_bytes = total
+        self.pruned += removed
+        if removed:
+            logger.info(f"BlobStore: pruned {removed} blobs from {self.spill_dir} ({total} bytes left)")
+        return removed
+
+    def maybe_prune_disk(self, keep=frozenset()):
+        """距離上次清理超過 prune_interval 秒時執行 prune_disk()"""
+        now = time.monotonic()
+        if now - self.last_pruned < self.prune_interval:
+            return 0
+        self.last_pruned = now
+        return self.prune_disk(keep)
+
+    # --- 記憶體層 ---
+    def _memory_put(self, key, data):
+        """放入記憶體並回傳需要寫到磁碟的 (key, data) 清單"""
+        spill = []
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return spill
+            self.entries[key] = data
+            self.memory_bytes += len(data)
+            while self.memory_bytes > self.memory_budget and len(self.entries) > 1:
+                old_key, old_data = self.entries.popitem(last=False)
+                self.memory_bytes -= len(old_data)
+                spill.append((old_key, old_data))
+        return spill
+
+    def _memory_get(self, key):
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+            return data
+
+    # --- 公開 API ---
+    def put(self, data, mime_type):
+        """存入圖片並回傳 blob key；相同內容只存一次"""
+        key = self.make_key(data, mime_type)
+        self.puts += 1
+        if self._memory_get(key) is not None:
+            self.dedup_hits += 1
+            return key
+        spill = self._memory_put(key, data)
+        if self.write_through:
+            spill.append((key, data))
+        for spill_key, spill_data in spill:
+            try:
+                self._disk_write(spill_key, spill_data)
+                if spill_key != key:
+                    self.spilled += 1
+            except OSError as e:
+                logger.error(f"BlobStore: failed to write {spill_key} to {self.spill_dir}: {e}")
+        return key
+
+    def get(self, key):
+        """回傳 blob 內容，不存在時回傳 None"""
+        if not is_blob_key(key):
+            return None
+        data = self._memory_get(key)
+        if data is not None:
+            self.memory_hits += 1
+            return data
+        data = self._disk_read(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self.disk_hits += 1
+        for spill_key, spill_data in self._memory_put(key, data):
+            try:
+                self._disk_write(spill_key, spill_data)
+            except OSError as e:
+                logger.error(f"BlobStore: failed to write {spill_key} to {self.spill_dir}: {e}")
+        return data
+
+    async def aput(self, data, mime_type):
+        # 寫入磁碟的部分 (spill / write-through) 不在 event loop 上執行
+        return await asyncio.to_thread(self.put, data, mime_type)
+
+    async def aget(self, key):
+        data = self._memory_get(key) if is_blob_key(key) else None
+        if data is not None:
+            self.memory_hits += 1
+            return data
+        return await asyncio.to_thread(self.get, key)
+
+    def resident_size(self, key):
+        """blob 在記憶體層佔用的位元組數 (只在磁碟層時為 0)"""
+        with self.lock:
+            data = self.entries.get(key)
+        return len(data) if data is not None else 0
+
+    def evict(self, key):
+        """將 blob 移出記憶體層 (寫到磁碟層，之後仍可讀取)，例如引用它的房間都已關閉時"""
+        with self.lock:
+            data = self.entries.pop(key, None)
+            if data is not None:
+                self.memory_bytes -= len(data)
+        if data is None:
+            return False
+        try:
+            self._disk_write(key, data)
+        except OSError as e:
+            logger.error(f"BlobStore: failed to write {key} to {self.spill_dir}: {e}")
+        self.spilled += 1
+        return True
+
+    # --- 與 data URL 之間的轉換 ---
+    async def store_data_url(self, data_url):
+        """將 data URL 存入並回傳 blob URL；已是 blob URL 則原樣回傳，無法解析時回傳 None"""
+        if is_blob_url(data_url):
+            return data_url if blob_key_from_url(data_url) else None
+        match = _DATA_URL_PATTERN.match(data_url or '')
+        if not match:
+            return None
+        try:
+            data = base64.b64decode(data_url[match.end():], validate=True)
+        except ValueError:
+            return None
+        return blob_url(await self.aput(data, match.group(1)))
+
+    async def store_bytes(self, data, mime_type):
+        return blob_url(await self.aput(data, mime_type))
+
+    async def load(self, ref):
+        """讀取 blob URL (或舊的 data URL) 所指的圖片，回傳 (bytes, mime_type)，失敗時回傳 (None, None)"""
+        if is_blob_url(ref):
+            key = blob_key_from_url(ref)
+            data = await self.aget(key) if key else None
+            return (data, mime_type_for_key(key)) if data is not None else (None, None)
+        match = _DATA_URL_PATTERN.match(ref or '')
+        if not match:
+            return None, None
+        try:
+            return base64.b64decode(ref[match.end():]), match.group(1)
+        except ValueError:
+            return None, None
+
+    def stats(self):
+        return {
+            'memory_entries': len(self.entries),
+            'memory_bytes': self.memory_bytes,
+            'memory_budget': self.memory_budget,
+            'puts': self.puts,
+            'dedup_hits': self.dedup_hits,
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'spilled': self.spilled,
+            'disk_bytes': self.disk_bytes,
+            'disk_budget': self.disk_budget,
+            'pruned': self.pruned,
+        }
+
+
+def _create_default_store():
+    from django.conf import settings
+    return BlobStore(
+        memory_budget=getattr(settings, 'BLOB_STORE_MEMORY_BYTES', 64 * 1024 * 1024),
+        spill_dir=getattr(settings, 'BLOB_STORE_DIR', None),
+        write_through=getattr(settings, 'BLOB_STORE_WRITE_THROUGH', False),
+        disk_budget=getattr(settings, 'BLOB_STORE_DISK_BYTES', 1024 * 1024 * 1024),
+        disk_ttl=getattr(settings, 'BLOB_STORE_DISK_TTL', 24 * 3600),
+    )
+
+
+blob_store = _create_default_store()
@@ -1,22 +1,158 @@
-import json
+import time
 import asyncio
+import uuid
 import hashlib
 import logging
 from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.layers import get_channel_layer
 from collections import defaultdict, deque
 import random
-from asgiref.sync import sync_to_async
-from .views import active_guest_ids  # 導入全局集合
+from django.conf import settings
 import math # Add math import for ceil
-from .llm_client import LLMClient, image_bytes_to_data_url, data_url_to_image_bytes # Added
+from .llm_client import LLMClient # Added
+from .ai_assist_jobs import ai_assist_jobs
+from .prompt_pool import PromptPool
+from .llm_providers import ProviderRegistry, GeminiProvider, LocalProvider, CALL_TYPES
+from .room_store import get_room_store, DELETE_ROOM, DeferredLog
+from .blob_store import blob_store
+from .binary_frames import decode_frame, BinaryFrameError, FRAME_MAGIC
+from .image_ingest import ImageIngestor, ImageRejected
+from .image_workers import ImageWorkerPool
+from .protocol import BroadcastMixin, ProtocolError, group_broadcast_event
+from .guest_leases import GuestLeaseMixin
+from .outbound import OutboundScheduler
+from .timer_wheel import TimerWheel
+from .room_lifecycle import RoomLifecycleManager
+from . import metrics
+from . import tracing
 
 # 添加基本日誌設置
 logger = logging.getLogger(__name__)
 
-# 簡易的記憶體內儲存來管理房間狀態
-# 注意：這在多個伺服器實例下無法運作，生產環境需要更健壯的方案 (例如 Redis, 資料庫)
-game_rooms = {}
-waiting_rooms = {}
+# 房間狀態儲存 (預設為記憶體；設定 ROOM_STORE_BACKEND=redis 讓多個 worker 共享房間)
+# 所有修改都必須透過 update() 原子地進行；get() 在 Redis 實作下回傳的是快照
+ROOM_STORE_BACKEND = getattr(settings, 'ROOM_STORE_BACKEND', 'memory')
+REDIS_URL = getattr(settings, 'REDIS_URL', None)
+game_rooms = get_room_store('game', ROOM_STORE_BACKEND, REDIS_URL)
+waiting_rooms = get_room_store('waiting', ROOM_STORE_BACKEND, REDIS_URL)
+
+# 二進位上傳 (畫作、AI 輔助) 的大小上限
+MAX_UPLOAD_BYTES = getattr(settings, 'MAX_UPLOAD_BYTES', 5 * 1024 * 1024)
+
+# 圖片的 CPU 工作 (data URL 編解碼、畫作正規化) 在 worker process 中執行，不阻塞 event loop
+image_workers = ImageWorkerPool(
+    processes=getattr(settings, 'IMAGE_WORKER_PROCESSES', None),
+    shared_memory_threshold=getattr(settings, 'IMAGE_WORKER_SHM_THRESHOLD', 256 * 1024),
+)
+
+# 提交畫作的正規化 (尺寸上限、重新壓縮)
+image_ingestor = ImageIngestor(
+    max_width=getattr(settings, 'DRAWING_MAX_WIDTH', 1024),
+    max_height=getattr(settings, 'DRAWING_MAX_HEIGHT', 1024),
+    max_input_bytes=MAX_UPLOAD_BYTES,
+    max_output_bytes=getattr(settings, 'DRAWING_MAX_BYTES', 512 * 1024),
+    workers=image_workers,
+)
+
+# 遊戲結果逐本傳送：目前的書本立即送出，其餘書本在背景每隔一段時間預先送出一本
+RESULTS_PREFETCH_INTERVAL = getattr(settings, 'RESULTS_PREFETCH_INTERVAL', 0.25)
+results_prefetch_tasks = {}
+results_delivered_books = defaultdict(set)  # {room_group_name: {book_index}}，僅記錄本 process 送出的書本
+
+# 狀態廣播的合併：短時間內的多次 broadcast_game_state 只送出一則差異
+outbound_scheduler = OutboundScheduler(window=getattr(settings, 'BROADCAST_COALESCE_WINDOW', 0.05))
+
+# 各階段的時限 (秒)，0 表示不限時；所有房間的期限共用同一個時間輪
+PHASE_TIMEOUTS = {
+    'prompting': getattr(settings, 'PROMPT_TIMEOUT', 120),
+    'drawing': getattr(settings, 'DRAW_TIMEOUT', 180),
+    'guessing': getattr(settings, 'GUESS_TIMEOUT', 90),
+}
+phase_timers = TimerWheel(tick=getattr(settings, 'PHASE_TIMER_TICK', 1.0))
+
+# 每個房間同時進行的機器人 LLM 呼叫上限
+BOT_CONCURRENCY_PER_ROOM = getattr(settings, 'BOT_CONCURRENCY_PER_ROOM', 4)
+room_bot_semaphores = {}
+
+# LLM 失敗時機器人使用的預設內容
+BOT_FALLBACK_PROMPTS = [
+    "一隻太空貓在月球上釣魚", "一個害羞的機器人送花", "魔法森林裡的秘密派對",
+    "沉睡火山上的冰淇淋店", "會飛的豬在雲中賽跑", "水下城市的爵士樂隊",
+    "時間旅行者遺失了他的手錶", "一隻愛讀書的龍", "隱形人在玩捉迷藏"
+]
+BOT_FALLBACK_DRAWINGS = [
+    "data:image/svg+xml;base64,PHN2ZyB4bWxucz0iaHR0cDovL3d3dy53My5vcmcvMjAwMC9zdmciIHdpZHRoPSIyMDAiIGhlaWdodD0iMTUwIj48cmVjdCB3aWR0aD0iMTAwJSIgaGVpZ2h0PSIxMDAlIiBmaWxsPSIjZjBlNmYyIi8+PHRleHQgeD0iNTAlIiB5PSI1MCUiIGRvbWluYW50LWJhc2VsaW5lPSJtaWRkbGUiIHRleHQtYW5jaG9yPSJtaWRkbGUiIGZvbnQtZmFtaWx5PSJhcmlhbCIgZm9udC1zaXplPSIxNiIgZmlsbD0iIzU1NSI+Qm90J3MgQXJ0PC90ZXh0Pjwvc3ZnPg==",
+    "data:image/svg+xml;base64,PHN2ZyB4bWxucz0iaHR0cDovL3d3dy53My5vcmcvMjAwMC9zdmciIHdpZHRoPSIyMDAiIGhlaWdodD0iMTUwIj48cmVjdCB3aWR0aD0iMTAwJSIgaGVpZ2h0PSIxMDAlIiBmaWxsPSIjZDJmMmVhIi8+PGNpcmNsZSBjeD0iMTAwIiBjeT0iNzUiIHI9IjQwIiBmaWxsPSIjZmZjMzMzIi8+PHRleHQgeD0iNTAlIiB5PSI1MCUiIGRvbWluYW50LWJhc2VsaW5lPSJtaWRkbGUiIHRleHQtYW5jaG9yPSJtaWRkbGUiIGZvbnQtZmFtaWx5PSJhcmlhbCIgZm9udC1zaXplPSIxMiIgZmlsbD0iIzMzMyI+Um9ib3QtRGF2aW5jaTwvdGV4dD48L3N2Zz4=",
+    "data:image/svg+xml;base64,PHN2ZyB4bWxucz0iaHR0cDovL3d3dy53My5vcmcvMjAwMC9zdmciIHdpZHRoPSIyMDAiIGhlaWdodD0iMTUwIj48cmVjdCB3aWR0aD0iMTAwJSIgaGVpZ2h0PSIxMDAlIiBmaWxsPSIjZThlMWY2Ii8+PHBhdGggZD0iTTUwIDMwIEwxNTAgMzAgTDEwMCAxMjAgWiIgZmlsbD0iI2FmY2RmNSIvPjx0ZXh0IHg9IjUwJSIgeT0iNzAlIiBkb21pbmFudC1JYXNlbGluZT0ibWlkZGxlIiB0ZXh0LWFuY2hvcj0ibWlkZGxlIiBmb250LWZhbWlseT0iY291cmllciIgZm9udC1zaXplPSIxNCIgZmlsbD0iIzY2Njg3YiI+QklPIC1SVEZMT1c8L3RleHQ+PC9zdmc+"
+]
+BOT_FALLBACK_GUESSES = [
+    "一隻貓在彈吉他", "一個快樂的太陽", "跳舞的機器人", "飛碟綁架了一頭牛",
+    "巫師在施法", "一條龍在噴火", "太空人在月球漫步", "一個巨大的甜甜圈",
+    "唱歌的胡蘿蔔", "戴著帽子的蛇"
+]
+
+
+def get_bot_semaphore(room_group_name):
+    """取得房間的機器人併發限制 (每個房間一個 Semaphore)"""
+    semaphore = room_bot_semaphores.get(room_group_name)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(BOT_CONCURRENCY_PER_ROOM)
+        room_bot_semaphores[room_group_name] = semaphore
+    return semaphore
+
+
+def release_game_room_resources(room_group_name):
+    """遊戲房間被刪除後，清理本 process 中與該房間相關的資源"""
+    room_bot_semaphores.pop(room_group_name, None)
+    prefetch_task = results_prefetch_tasks.pop(room_group_name, None)
+    if prefetch_task:
+        prefetch_task.cancel()
+    results_delivered_books.pop(room_group_name, None)
+    outbound_scheduler.discard(room_group_name)
+    phase_timers.cancel(room_group_name)
+    ai_assist_jobs.cancel_for_room(room_group_name, reason='room_closed')
+
+
+async def on_room_evicted(store_name, room_group_name, reason):
+    """房間因過期或記憶體預算被清除：清理資源並通知仍連線的玩家"""
+    if store_name == 'game':
+        release_game_room_resources(room_group_name)
+    channel_layer = get_channel_layer()
+    if channel_layer:
+        message = '遊戲已結束，房間已關閉。' if reason == 'finished' else '房間因閒置過久已關閉，請重新建立房間。'
+        await channel_layer.group_send(room_group_name, await group_broadcast_event(room_group_name, 'error', {'message': message}))
+
+
+async def collect_room_metrics():
+    """/metrics 輸出前讀取各房間儲存依狀態維護的計數 (不讀取房間內容)"""
+    counts = {}
+    for store_name, store in (('game', game_rooms), ('waiting', waiting_rooms)):
+        for state, count in (await store.count_by_state()).items():
+            counts[(store_name, state)] = count
+    metrics.rooms.set_all(counts)
+
+
+metrics.registry.add_collector(collect_room_metrics)
+
+# 每個遊戲的追蹤 span (trace_id = game_id)，未設定 TRACE_FILE 時不記錄
+if getattr(settings, 'TRACE_FILE', None):
+    tracing.configure(
+        settings.TRACE_FILE,
+        max_bytes=getattr(settings, 'TRACE_MAX_BYTES', 10 * 1024 * 1024),
+        backup_count=getattr(settings, 'TRACE_BACKUP_COUNT', 5),
+    )
+
+
+# 房間生命週期：清除已結束、閒置或超出記憶體預算的房間
+room_lifecycle = RoomLifecycleManager(
+    stores={'game': game_rooms, 'waiting': waiting_rooms},
+    memory_budget=getattr(settings, 'ROOM_MEMORY_BUDGET_BYTES', 256 * 1024 * 1024),
+    finished_ttl=getattr(settings, 'FINISHED_ROOM_TTL', 600),
+    idle_ttl=getattr(settings, 'IDLE_ROOM_TTL', 1800),
+    sweep_interval=getattr(settings, 'ROOM_SWEEP_INTERVAL', 30),
+    archive_dir=getattr(settings, 'ROOM_ARCHIVE_DIR', None),
+    on_evict=on_room_evicted,
+)
 
 # Create an instance of the LLMClient
 # This will load API keys and prompts when the Django application starts.
@@ -29,8 +165,33 @@ except Exception as e:
     logger.error(f"An unexpected error occurred during LLMClient initialization: {e}")
     llm_client = None
 
-
-class WaitingRoomConsumer(AsyncWebsocketConsumer):
+# 預先產生的機器人題目池，機器人出題時優先從池中取用
+prompt_pool = PromptPool(
+    llm_client.agenerate_text_from_text,
+    capacity=getattr(settings, 'PROMPT_POOL_SIZE', 32),
+    low_watermark=getattr(settings, 'PROMPT_POOL_LOW_WATERMARK', 8),
+    persist_path=getattr(settings, 'PROMPT_POOL_PATH', None),
+    max_age=getattr(settings, 'PROMPT_POOL_MAX_AGE', 3 * 24 * 3600),
+) if llm_client else None
+
+# 機器人與 AI 輔助使用的 provider (可依房間或呼叫類型選擇)；本機 provider 不需網路，永遠可用
+llm_providers = ProviderRegistry(
+    default=getattr(settings, 'LLM_PROVIDER', 'gemini'),
+    per_call_type=getattr(settings, 'LLM_PROVIDER_BY_CALL_TYPE', {}),
+)
+llm_providers.register(LocalProvider(corpus=BOT_FALLBACK_PROMPTS))
+if llm_client:
+    llm_providers.register(GeminiProvider(llm_client))
+
+
+def learn_llm_prompt(prompt):
+    """讓本機 provider 的 n-gram 模型學習 LLM 產生的題目 (玩家輸入的題目不會被學習，避免出現在其他房間)"""
+    local_provider = llm_providers.get('local')
+    if local_provider:
+        local_provider.learn(prompt)
+
+
+class WaitingRoomConsumer(BroadcastMixin, GuestLeaseMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.room_name = self.scope['url_route']['kwargs'].get('room_name', 'default')
         room_name_hash = hashlib.md5(self.room_name.encode('utf-8')).hexdigest()
@@ -43,36 +204,43 @@ class WaitingRoomConsumer(AsyncWebsocketConsumer):
             self.user_id = params.get('userid')
             self.player_id = self.user_id
         
+        # 玩家在等待室時就開始預熱機器人題目池
+        if prompt_pool:
+            prompt_pool.ensure_started()
+
         # 初始化等待房間狀態 (如果不存在)
-        if self.room_group_name not in waiting_rooms:
-            waiting_rooms[self.room_group_name] = {
-                'original_room_name': self.room_name,  # 保存原始房間名稱以供顯示
-                'players': {},  # {player_id: {'name': 'PlayerName', 'isBot': False, 'isHost': False}}
-                'host_id': self.player_id,  # 第一個加入的玩家為房主
-            }
+        await waiting_rooms.create(self.room_group_name, {
+            'original_room_name': self.room_name,  # 保存原始房間名稱以供顯示
+            'players': {},  # {player_id: {'name': 'PlayerName', 'isBot': False, 'isHost': False}}
+            'host_id': self.player_id,  # 第一個加入的玩家為房主
+        })
 
         # 加入房間群組
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        await self.accept()
+        await self.accept_with_codec()
+        await self.hold_guest_lease()
 
         # 添加玩家到房間狀態
-        room = waiting_rooms[self.room_group_name]
-        
-        # 判斷是否為房主
-        is_host = room['host_id'] == self.player_id or not room['players']
-        if is_host and not room['players']:
-            room['host_id'] = self.player_id  # 確保有房主
-        
-        # 加入玩家
-        room['players'][self.player_id] = {
-            'id': self.player_id,
-            'name': self.player_id,
-            'isBot': False,
-            'isHost': is_host
-        }
+        def add_player(room):
+            # 判斷是否為房主
+            is_host = room['host_id'] == self.player_id or not room['players']
+            if is_host and not room['players']:
+                room['host_id'] = self.player_id  # 確保有房主
+            
+            # 加入玩家
+            room['players'][self.player_id] = {
+                'id': self.player_id,
+                'name': self.player_id,
+                'isBot': False,
+                'isHost': is_host
+            }
+
+        await waiting_rooms.update(self.room_group_name, add_player)
+        room_lifecycle.touch('waiting', self.room_group_name)
+        room_lifecycle.ensure_started()
         
         logger.info(f"WaitingRoomConsumer: 玩家 {self.player_id} 已加入房間 {self.room_name}")
         
@@ -81,40 +249,44 @@ class WaitingRoomConsumer(AsyncWebsocketConsumer):
 
     async def disconnect(self, close_code):
         logger.info(f"WaitingRoomConsumer: 玩家 {self.player_id} 斷開連接 - 房間: {self.room_name}")
-        room = waiting_rooms.get(self.room_group_name)
-        if room:
+        def remove_player(room):
             # 從房間移除玩家
-            if self.player_id in room['players']:
-                # 檢查是否為房主
-                was_host = room['players'][self.player_id]['isHost']
-                # 移除玩家
-                del room['players'][self.player_id]
-                # 如果房主離開，將房主轉讓給其他人
-                if was_host and room['players']:
-                    # 選擇第一個非機器人玩家作為新房主
-                    for pid, player in room['players'].items():
-                        if not player['isBot']:
-                            room['host_id'] = pid
-                            room['players'][pid]['isHost'] = True
-                            break
-                
-                # 如果房間空了，清理房間狀態
-                if not room['players']:
-                    del waiting_rooms[self.room_group_name]
-                else:
-                    # 檢查是否還有真實玩家
-                    has_real_player = False
-                    for player in room['players'].values():
-                        if not player.get('isBot', False):
-                            has_real_player = True
-                            break
-                    
-                    # 如果沒有真實玩家，移除所有機器人和房間
-                    if not has_real_player:
-                        del waiting_rooms[self.room_group_name]
-                    else:
-                        # 向剩餘玩家廣播狀態
-                        await self.broadcast_room_state("玩家離開")
+            if self.player_id not in room['players']:
+                return False
+            # 檢查是否為房主
+            was_host = room['players'][self.player_id]['isHost']
+            # 移除玩家
+            del room['players'][self.player_id]
+            # 如果房主離開，將房主轉讓給其他人
+            if was_host and room['players']:
+                # 選擇第一個非機器人玩家作為新房主
+                for pid, player in room['players'].items():
+                    if not player['isBot']:
+                        room['host_id'] = pid
+                        room['players'][pid]['isHost'] = True
+                        break
+            
+            # 如果房間空了，清理房間狀態
+            if not room['players']:
+                return DELETE_ROOM
+            # 檢查是否還有真實玩家
+            has_real_player = False
+            for player in room['players'].values():
+                if not player.get('isBot', False):
+                    has_real_player = True
+                    break
+            
+            # 如果沒有真實玩家，移除所有機器人和房間
+            if not has_real_player:
+                return DELETE_ROOM
+            return True
+
+        removed = await waiting_rooms.update(self.room_group_name, remove_player)
+        if removed is DELETE_ROOM:
+            room_lifecycle.forget('waiting', self.room_group_name)
+        elif removed is True:
+            # 向剩餘玩家廣播狀態
+            await self.broadcast_room_state("玩家離開")
 
         # 離開房間群組
         await self.channel_layer.group_discard(
@@ -122,19 +294,18 @@ class WaitingRoomConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
         
-        # 檢查用戶ID
-        user_id = getattr(self, 'user_id', None)
-        if user_id:
-            await self.remove_user_id(user_id)
+        # 釋放訪客ID的租約
+        await self.release_guest_lease()
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
+        room_lifecycle.touch('waiting', self.room_group_name)
+        await self.renew_guest_lease()
         try:
-            data = json.loads(text_data)
-            message_type = data.get('type')
-            payload = data.get('payload', {})
+            message_type, payload = self.decode_message(text_data, bytes_data)
+            if message_type == 'heartbeat':
+                return
             
-            room = waiting_rooms.get(self.room_group_name)
-            if not room:
+            if not await waiting_rooms.exists(self.room_group_name):
                 return
 
             if message_type == 'chat_message':
@@ -145,8 +316,10 @@ class WaitingRoomConsumer(AsyncWebsocketConsumer):
                 await self.handle_remove_bot()
             elif message_type == 'start_game':
                 await self.handle_start_game()
-        except json.JSONDecodeError:
-            print(f"Error decoding JSON: {text_data}")
+            elif message_type == 'set_llm_provider':
+                await self.handle_set_llm_provider(payload)
+        except ProtocolError as e:
+            print(f"Error decoding message: {e}")
         except Exception as e:
             print(f"Error processing message: {e}")
             import traceback
@@ -154,118 +327,125 @@ class WaitingRoomConsumer(AsyncWebsocketConsumer):
 
     async def handle_chat_message(self, message):
         if message:
-            room = waiting_rooms[self.room_group_name]
+            room = await waiting_rooms.get(self.room_group_name)
+            if not room:
+                return
             player_name = room['players'].get(self.player_id, {}).get('name', '未知玩家')
             
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'broadcast_message',
-                    'message_type': 'chat',
-                    'payload': {
-                        'sender': player_name,
-                        'text': message
-                    }
-                }
-            )
+            await self.group_broadcast('chat', {
+                'sender': player_name,
+                'text': message
+            })
 
     async def handle_add_bot(self):
-        room = waiting_rooms[self.room_group_name]
-        
-        # 檢查是否為房主
-        if room['host_id'] != self.player_id:
-            await self.send(text_data=json.dumps({
-                'type': 'error',
-                'payload': {'message': '只有房主可以添加機器人'}
-            }))
+        def add_bot(room):
+            # 檢查是否為房主
+            if room['host_id'] != self.player_id:
+                return None, '只有房主可以添加機器人'
+            # 檢查房間是否已滿
+            if len(room['players']) >= 8:
+                return None, '房間已滿'
+
+            # 計算當前機器人數量用於生成新機器人ID
+            bot_count = sum(1 for player in room['players'].values() if player.get('isBot', False))
+
+            # 添加機器人
+            bot_id = f"bot_{bot_count + 1}" # Ensure unique bot IDs if bots are removed and re-added
+            bot_name = "畫畫機器人" + str(bot_count + 1)
+            room['players'][bot_id] = {
+                'id': bot_id,
+                'name': bot_name,
+                'isBot': True,
+                'isHost': False
+            }
+            return bot_name, None
+
+        result = await waiting_rooms.update(self.room_group_name, add_bot)
+        if result is None:
             return
-            
-        # 檢查房間是否已滿
-        if len(room['players']) >= 8:
-            await self.send(text_data=json.dumps({
-                'type': 'error',
-                'payload': {'message': '房間已滿'}
-            }))
+        bot_name, error = result
+        if error:
+            await self.send_payload('error', {'message': error})
             return
-            
-        # 計算當前機器人數量用於生成新機器人ID
-        bot_count = sum(1 for player in room['players'].values() if player.get('isBot', False))
-            
-        # 添加機器人
-        bot_id = f"bot_{bot_count + 1}" # Ensure unique bot IDs if bots are removed and re-added
-        bot_name = "畫畫機器人" + str(bot_count + 1)
-        room['players'][bot_id] = {
-            'id': bot_id,
-            'name': bot_name,
-            'isBot': True,
-            'isHost': False
-        }
         
         # 向所有玩家廣播更新後的狀態
         await self.broadcast_room_state("已添加機器人")
         
         # 發送通知
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'broadcast_message',
-                'message_type': 'notification',
-                'payload': {
-                    'message': f"已添加機器人玩家：{bot_name}",
-                    'level': 'success'
-                }
-            }
-        )
+        await self.group_broadcast('notification', {
+            'message': f"已添加機器人玩家：{bot_name}",
+            'level': 'success'
+        })
 
     async def handle_remove_bot(self):
-        room = waiting_rooms[self.room_group_name]
-        
-        # 檢查是否為房主
-        if room['host_id'] != self.player_id:
-            await self.send(text_data=json.dumps({
-                'type': 'error',
-                'payload': {'message': '只有房主可以移除機器人'}
-            }))
+        def remove_bot(room):
+            # 檢查是否為房主
+            if room['host_id'] != self.player_id:
+                return None, '只有房主可以移除機器人'
+            # 檢查是否有機器人可移除
+            bot_players = [player_id for player_id, player in room['players'].items() if player.get('isBot', False)]
+            if not bot_players:
+                return None, '沒有機器人可以移除'
+            # 移除最後一個機器人
+            bot_to_remove = bot_players[-1]
+            bot_name = room['players'][bot_to_remove]['name']
+            del room['players'][bot_to_remove]
+            return bot_name, None
+
+        result = await waiting_rooms.update(self.room_group_name, remove_bot)
+        if result is None:
             return
-            
-        # 檢查是否有機器人可移除
-        bot_players = [player_id for player_id, player in room['players'].items() if player.get('isBot', False)]
-        if not bot_players:
-            await self.send(text_data=json.dumps({
-                'type': 'error',
-                'payload': {'message': '沒有機器人可以移除'}
-            }))
+        bot_name, error = result
+        if error:
+            await self.send_payload('error', {'message': error})
             return
-            
-        # 移除最後一個機器人
-        bot_to_remove = bot_players[-1]
-        bot_name = room['players'][bot_to_remove]['name']
-        del room['players'][bot_to_remove]
         
         # 向所有玩家廣播更新後的狀態
         await self.broadcast_room_state("已移除機器人")
         
         # 發送通知
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'broadcast_message',
-                'message_type': 'notification',
-                'payload': {
-                    'message': f"已移除機器人玩家：{bot_name}",
-                    'level': 'info'
-                }
-            }
-        )
+        await self.group_broadcast('notification', {
+            'message': f"已移除機器人玩家：{bot_name}",
+            'level': 'info'
+        })
+
+    async def handle_set_llm_provider(self, payload):
+        """房主設定機器人使用的 AI provider (可針對單一呼叫類型)"""
+        room = await waiting_rooms.get(self.room_group_name)
+        if not room:
+            return
+
+        if room['host_id'] != self.player_id:
+            await self.send_payload('error', {'message': '只有房主可以變更機器人設定'})
+            return
+
+        provider_name = payload.get('provider', 'auto')
+        call_type = payload.get('call_type', 'all')
+        if call_type != 'all' and call_type not in CALL_TYPES:
+            return
+        if provider_name != 'auto' and provider_name not in llm_providers.available():
+            await self.send_payload('error', {'message': f'無法使用的 AI 模式：{provider_name}'})
+            return
+
+        def set_provider(room):
+            choices = room.setdefault('llm_providers', {})
+            if call_type == 'all':
+                choices.clear()
+            if provider_name == 'auto':
+                choices.pop(call_type, None)
+            else:
+                choices[call_type] = provider_name
+
+        await waiting_rooms.update(self.room_group_name, set_provider)
+        await self.broadcast_room_state("已更新機器人設定")
 
     async def handle_start_game(self):
-        room = waiting_rooms[self.room_group_name]
+        room = await waiting_rooms.get(self.room_group_name)
+        if not room:
+            return
         
         if room['host_id'] != self.player_id:
-            await self.send(text_data=json.dumps({
-                'type': 'error',
-                'payload': {'message': '只有房主可以開始遊戲'}
-            }))
+            await self.send_payload('error', {'message': '只有房主可以開始遊戲'})
             return
             
         num_actual_players = len([p for p in room['players'].values() if not p.get('isBot', False)])
@@ -296,7 +476,7 @@ class WaitingRoomConsumer(AsyncWebsocketConsumer):
         }
 
         # 創建遊戲房間實例
-        game_rooms[game_room_key] = {
+        game_room = {
             'room_name': self.room_name,
             'players': dict(room['players']), # 複製玩家資訊
             'host_id': room['host_id'],
@@ -310,31 +490,39 @@ class WaitingRoomConsumer(AsyncWebsocketConsumer):
             'assignments': {},
             'game_log': [],
             'max_ai_assists_allowed': max_ai_assists_allowed, # 新增：最大AI輔助次數
-            'ai_assist_usage': ai_assist_usage             # 新增：AI輔助使用記錄
+            'ai_assist_usage': ai_assist_usage,            # 新增：AI輔助使用記錄
+            'llm_providers': dict(room.get('llm_providers', {})), # 房主選擇的機器人 AI provider
+            'game_id': uuid.uuid4().hex # 追蹤 (tracing) 用的 trace id
         }
+        if not await game_rooms.create(game_room_key, game_room):
+            existing_room = await game_rooms.get(game_room_key)
+            if existing_room and existing_room.get('state') != 'finished':
+                # 遊戲已經建立 (例如房主重複點擊開始)，不覆蓋進行中的遊戲
+                logger.warning(f"Game room {game_room_key} already exists (state: {existing_room.get('state')}). Ignoring duplicate start_game.")
+                return
+            # 上一局已結束，以新遊戲取代
+            await game_rooms.delete(game_room_key)
+            release_game_room_resources(game_room_key)
+            room_lifecycle.forget('game', game_room_key)
+            if not await game_rooms.create(game_room_key, game_room):
+                return
         print(f"Game room {game_room_key} created with players: {all_player_ids_in_order}")
-        print(f"Total ops: {game_rooms[game_room_key]['total_ops']}, Total display rounds: {game_rooms[game_room_key]['total_display_rounds']}")
+        print(f"Total ops: {game_room['total_ops']}, Total display rounds: {game_room['total_display_rounds']}")
 
 
         # 通知所有玩家遊戲開始，並傳遞遊戲房間的 key (room_name)
-        await self.channel_layer.group_send(
-            self.room_group_name, # 仍然發送到 waiting_room group
-            {
-                'type': 'broadcast_message', # WaitingRoomConsumer 需要有 broadcast_message 方法
-                'message_type': 'game_started',
-                'payload': {
-                    'room_name': self.room_name, # 前端將使用此 room_name 導航到 /room/<room_name>
-                    'player_ids': all_player_ids_in_order # 可選，前端可能不需要
-                }
-            }
-        )
+        await self.group_broadcast('game_started', {
+            'room_name': self.room_name, # 前端將使用此 room_name 導航到 /room/<room_name>
+            'player_ids': all_player_ids_in_order # 可選，前端可能不需要
+        })
         
-        # 清理等待室 (可選，或者讓其自然過期)
-        # del waiting_rooms[self.room_group_name]
+        # 玩家已轉往遊戲房間，清理等待室 (之後回到等待室的玩家會重新建立)
+        await waiting_rooms.delete(self.room_group_name)
+        room_lifecycle.forget('waiting', self.room_group_name)
 
     async def broadcast_room_state(self, status_message=""):
         """向房間內所有玩家廣播當前的房間狀態"""
-        room = waiting_rooms.get(self.room_group_name)
+        room = await waiting_rooms.get(self.room_group_name)
         if not room:
             return
 
@@ -355,39 +543,18 @@ class WaitingRoomConsumer(AsyncWebsocketConsumer):
             'players': players_list,
             'bot_count': bot_count,  # 保留bot_count以向後兼容，但現在是從players計算出來的
             'status_message': status_message,
+            'llm_providers': room.get('llm_providers', {}),
+            'available_llm_providers': llm_providers.available(),
         }
 
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'broadcast_message',
-                'message_type': 'room_update',
-                'payload': state_payload
-            }
-        )
+        await self.group_broadcast('room_update', state_payload)
 
     async def broadcast_message(self, event):
-        """處理來自 group_send 的廣播請求"""
-        message_type = event['message_type']
-        payload = event['payload']
-        
-        await self.send(text_data=json.dumps({
-            'type': message_type,
-            'payload': payload
-        }))
-
-    @sync_to_async
-    def remove_user_id(self, user_id):
-        """從活躍用戶集合中移除用戶ID"""
-        if user_id in active_guest_ids:
-            active_guest_ids.remove(user_id)
-    
-    @sync_to_async
-    def add_user_id(self, user_id):
-        """添加用戶ID到活躍集合"""
-        active_guest_ids.add(user_id)
-
-class GameConsumer(AsyncWebsocketConsumer):
+        """處理來自 group_send 的廣播請求 (舊格式；新的廣播使用 group_broadcast 預先編碼)"""
+        await self.send_payload(event['message_type'], event['payload'])
+
+
+class GameConsumer(BroadcastMixin, GuestLeaseMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.room_name = self.scope['url_route']['kwargs'].get('room_name', 'default')
         room_name_hash = hashlib.md5(self.room_name.encode('utf-8')).hexdigest()
@@ -401,27 +568,34 @@ class GameConsumer(AsyncWebsocketConsumer):
             self.player_id = self.user_id
 
         # 檢查遊戲房間是否存在 (由 WaitingRoomConsumer 創建)
-        if self.room_group_name not in game_rooms:
+        room = await game_rooms.get(self.room_group_name)
+        if not room:
             print(f"Game room {self.room_group_name} not found. Disconnecting.")
             await self.close()
             return
-
-        room = game_rooms[self.room_group_name]
         
         # 確保玩家是該房間的一員
         if self.player_id not in room['players']:
             print(f"Player {self.player_id} not in room {self.room_group_name}. Disconnecting.")
             await self.close()
             return
+        self.trace_id = room.get('game_id') or self.room_group_name
 
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        await self.accept()
+        await self.accept_with_codec()
+        await self.hold_guest_lease()
         
         # 更新玩家的 channel_name，用於私訊
-        room['players'][self.player_id]['channel_name'] = self.channel_name
+        def set_channel_name(room):
+            if self.player_id in room['players']:
+                room['players'][self.player_id]['channel_name'] = self.channel_name
+
+        await game_rooms.update(self.room_group_name, set_channel_name)
+        room_lifecycle.touch('game', self.room_group_name)
+        room_lifecycle.ensure_started()
         
         print(f"Player {self.player_id} connected to game room {self.room_name} (channel: {self.channel_name})")
 
@@ -435,22 +609,31 @@ class GameConsumer(AsyncWebsocketConsumer):
 
     async def disconnect(self, close_code):
         logger.info(f"GameConsumer: WebSocket斷開連接 - player_id: {self.player_id}, user_id: {getattr(self, 'user_id', None)}")
-        room = game_rooms.get(self.room_group_name)
-        if room:
+        # 取消此玩家尚未完成的 AI 輔助工作
+        ai_assist_jobs.cancel_for_player(self.room_group_name, self.player_id, reason='disconnect')
+        deferred = DeferredLog(logger)
+        def remove_player(room):
             # 標記玩家為斷線或直接移除
             if self.player_id in room['players']:
                 # room['players'][self.player_id]['connected'] = False
                 del room['players'][self.player_id] # 簡單起見，直接移除
-                print(f"Player {self.player_id} disconnected from {self.room_group_name}. Remaining players: {room['players']}")
+                deferred.info(f"Player {self.player_id} disconnected from {self.room_group_name}. Remaining players: {room['players']}")
 
             # 如果房間空了，可以考慮清理房間狀態
             if not room['players']:
-                del game_rooms[self.room_group_name]
-                print(f"Room {self.room_group_name} closed.")
-            else:
-                 # 向剩餘玩家廣播狀態
-                 # TODO: 需要處理遊戲進行中玩家離開的情況
-                 await self.broadcast_game_state("玩家離開")
+                return DELETE_ROOM
+            return True
+
+        removed = await game_rooms.update(self.room_group_name, deferred.wrap(remove_player))
+        deferred.flush()
+        if removed is DELETE_ROOM:
+            release_game_room_resources(self.room_group_name)
+            room_lifecycle.forget('game', self.room_group_name)
+            print(f"Room {self.room_group_name} closed.")
+        elif removed:
+            # 向剩餘玩家廣播狀態
+            # TODO: 需要處理遊戲進行中玩家離開的情況
+            await self.broadcast_game_state("玩家離開")
 
         # 離開房間群組
         await self.channel_layer.group_discard(
@@ -458,19 +641,22 @@ class GameConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
         
-        # 使用更健壯的方式檢查用戶ID
-        user_id = getattr(self, 'user_id', None)
-        if user_id:
-            await self.remove_user_id(user_id)
-
-    async def receive(self, text_data):
+        # 釋放訪客ID的租約
+        await self.release_guest_lease()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        room_lifecycle.touch('game', self.room_group_name)
+        await self.renew_guest_lease()
+        if bytes_data is not None and bytes_data[:1] == bytes([FRAME_MAGIC]):
+            # 圖片上傳訊息 (0xC1 在 MessagePack 中不會出現，不會與協定訊息混淆)
+            await self.receive_binary(bytes_data)
+            return
         try:
-            data = json.loads(text_data)
-            message_type = data.get('type')
-            payload = data.get('payload', {})
+            message_type, payload = self.decode_message(text_data, bytes_data)
+            if message_type == 'heartbeat':
+                return
 
-            room = game_rooms.get(self.room_group_name)
-            if not room:
+            if not await game_rooms.exists(self.room_group_name):
                 logger.warning(f"GameConsumer: 房間 {self.room_group_name} 不存在，但收到訊息類型 {message_type} from {self.player_id}")
                 return
 
@@ -483,41 +669,80 @@ class GameConsumer(AsyncWebsocketConsumer):
             elif message_type == 'submit_prompt':
                 await self.handle_submit_prompt(payload.get('prompt'))
             elif message_type == 'submit_drawing':
-                await self.handle_submit_drawing(payload.get('drawing'))
+                await self.handle_submit_drawing(payload.get('drawing'), payload.get('assignment_id'))
             elif message_type == 'submit_guess':
                 await self.handle_submit_guess(payload.get('guess'))
             elif message_type == 'clear_canvas':
                 await self.handle_clear_canvas()
             elif message_type == 'ai_assist_drawing':
                 await self.handle_ai_assist_drawing(payload)
+            elif message_type == 'cancel_ai_assist':
+                await self.handle_cancel_ai_assist(payload)
             elif message_type == 'navigate_book': # 新增：處理書本導覽請求
                 await self.handle_navigate_book(payload)
-        except json.JSONDecodeError:
-            print(f"Error decoding JSON: {text_data}")
+            elif message_type == 'request_results_book':
+                await self.handle_request_results_book(payload)
+            elif message_type == 'sync_state':
+                await self.handle_sync_state(payload)
+        except ProtocolError as e:
+            print(f"Error decoding message: {e}")
         except Exception as e:
             print(f"Error processing message: {e}")
             import traceback
             traceback.print_exc()
 
+    async def receive_binary(self, bytes_data):
+        """處理二進位上傳訊息 (見 binary_frames.py)：圖片以原始位元組傳送，不需 base64 與 JSON 解析"""
+        try:
+            if len(bytes_data) > MAX_UPLOAD_BYTES:
+                await self.send_error("上傳的圖片太大。")
+                return
+            message_type, meta, image_bytes = decode_frame(bytes_data)
+            metrics.record_message('in', message_type, len(bytes_data))
+
+            if not await game_rooms.exists(self.room_group_name):
+                logger.warning(f"GameConsumer: 房間 {self.room_group_name} 不存在，但收到二進位訊息類型 {message_type} from {self.player_id}")
+                return
+
+            logger.debug(f"GameConsumer: Received binary {message_type} ({len(image_bytes)} bytes) from {self.player_id} in {self.room_name}. Meta: {meta}")
+
+            if message_type == 'submit_drawing':
+                if not image_bytes:
+                    await self.send_error("繪畫數據不能為空。")
+                    return
+                drawing_ref = await self.ingest_drawing(image_bytes, meta['mime'])
+                if drawing_ref:
+                    await self.submit_drawing_ref(drawing_ref, meta.get('assignment_id'))
+            elif message_type == 'ai_assist_drawing':
+                await self.handle_ai_assist_drawing(meta, image_bytes=image_bytes, mime_type=meta['mime'])
+        except BinaryFrameError as e:
+            logger.warning(f"GameConsumer: Invalid binary frame from {self.player_id}: {e}")
+            await self.send_error("無法解析上傳的資料。")
+        except Exception as e:
+            print(f"Error processing binary message: {e}")
+            import traceback
+            traceback.print_exc()
+
     async def handle_start_game(self):
-        room = game_rooms.get(self.room_group_name)
-        if not room:
-            logger.warning(f"Room {self.room_group_name} not found in handle_start_game for player {self.player_id}.")
-            return
+        deferred = DeferredLog(logger)
+        def try_initiate_prompting(room):
+            deferred.info(f"Player {self.player_id} triggered handle_start_game for room {self.room_name}. Current state: {room['state']}, Prompting initiated: {room.get('prompting_initiated', False)}")
 
-        logger.info(f"Player {self.player_id} triggered handle_start_game for room {self.room_name}. Current state: {room['state']}, Prompting initiated: {room.get('prompting_initiated', False)}")
+            if room.get('prompting_initiated'):
+                return 'already_initiated'
+            if room['state'] != 'initializing':
+                return 'in_progress'
 
-        if room['state'] == 'initializing' and not room.get('prompting_initiated', False):
             all_non_bots_connected = True
             missing_players = []
             if not room.get('turn_order'):
-                logger.warning(f"Room {self.room_name}: turn_order is empty or not set. Cannot check player readiness.")
+                deferred.warning(f"Room {self.room_name}: turn_order is empty or not set. Cannot check player readiness.")
                 all_non_bots_connected = False
             else:
                 for player_id_in_order in room['turn_order']:
                     player_data = room['players'].get(player_id_in_order)
                     if not player_data:
-                        logger.warning(f"Room {self.room_name}: Player data for {player_id_in_order} not found in room['players'] during readiness check.")
+                        deferred.warning(f"Room {self.room_name}: Player data for {player_id_in_order} not found in room['players'] during readiness check.")
                         all_non_bots_connected = False
                         missing_players.append(f"{player_id_in_order} (data missing)")
                         break
@@ -525,53 +750,77 @@ class GameConsumer(AsyncWebsocketConsumer):
                     if not player_data.get('isBot', False): # It's a human player
                         if not player_data.get('channel_name'): # Check if connected to GameConsumer
                             all_non_bots_connected = False
-                            logger.info(f"Room {self.room_name}: Player {player_id_in_order} (human) not yet fully connected to GameConsumer (no channel_name). Waiting...")
+                            deferred.info(f"Room {self.room_name}: Player {player_id_in_order} (human) not yet fully connected to GameConsumer (no channel_name). Waiting...")
                             missing_players.append(player_id_in_order)
                             # Do not break here, log all missing players for better diagnostics
             
             if missing_players:
-                 logger.info(f"Room {self.room_name}: Still waiting for human players to connect: {missing_players}")
+                 deferred.info(f"Room {self.room_name}: Still waiting for human players to connect: {missing_players}")
 
-            if all_non_bots_connected:
-                logger.info(f"Room {self.room_name}: All human players detected as connected. Initiating prompting round.")
-                room['prompting_initiated'] = True # Set flag before calling
-                await self.start_prompting_round()
-            else:
-                logger.info(f"Room {self.room_name}: Not all human players are connected yet. Prompting round will not start yet.")
-        elif room.get('prompting_initiated'):
+            if not all_non_bots_connected:
+                return 'waiting'
+            # 在同一次原子更新中設定旗標，確保只有一個連線 (或 worker) 會開始出題階段
+            room['prompting_initiated'] = True
+            return 'start'
+
+        outcome = await game_rooms.update(self.room_group_name, deferred.wrap(try_initiate_prompting))
+        deferred.flush()
+        if outcome is None:
+            logger.warning(f"Room {self.room_group_name} not found in handle_start_game for player {self.player_id}.")
+            return
+
+        if outcome == 'start':
+            logger.info(f"Room {self.room_name}: All human players detected as connected. Initiating prompting round.")
+            await self.start_prompting_round()
+        elif outcome == 'waiting':
+            logger.info(f"Room {self.room_name}: Not all human players are connected yet. Prompting round will not start yet.")
+        elif outcome == 'already_initiated':
             logger.info(f"Room {self.room_name}: Prompting round already initiated or in progress. Player {self.player_id} sending 'start_game' again.")
             # Optionally, resend current game state to this player if they might have missed it
             await self.send_game_state_to_player(self.player_id, "遊戲已開始，同步狀態...")
-        elif room['state'] != 'initializing':
-            logger.info(f"Room {self.room_name}: Game is not in 'initializing' state (current: {room['state']}). Player {self.player_id} sent 'start_game'.")
+        else:
+            logger.info(f"Room {self.room_name}: Game is not in 'initializing' state. Player {self.player_id} sent 'start_game'.")
             await self.send_game_state_to_player(self.player_id, "遊戲已在進行中，同步狀態...")
 
 
+    @tracing.traced('start_prompting_round')
     async def start_prompting_round(self):
         """開始提示輸入階段"""
-        room = game_rooms.get(self.room_group_name)
-        if not room:
+        deferred = DeferredLog(logger)
+        def begin_prompting(room):
+            # Ensure this runs only once if prompting_initiated was the guard
+            # Or, if state is already 'prompting', it might be a re-entry, be careful.
+            if room['state'] != 'initializing': # Check should be against 'initializing'
+                deferred.warning(f"Room {self.room_name}: Attempted to start prompting round when not in initializing state (current: {room['state']}). Current op_number: {room.get('current_op_number')}")
+                # If already prompting, perhaps just resend state or assignments to late joiners if supported.
+                # For now, we prevent re-entry if not initializing.
+                return False
+            room['state'] = 'prompting'
+            room['current_op_number'] = 0 
+            room['current_display_round'] = 0 
+            room['assignments'] = {player_id: {'type': 'prompt'} for player_id in room['turn_order']}
+            return True
+
+        started = await game_rooms.update(self.room_group_name, deferred.wrap(begin_prompting))
+        deferred.flush()
+        if started is None:
             logger.error(f"start_prompting_round: Room {self.room_group_name} not found!")
             return
-
-        # Ensure this runs only once if prompting_initiated was the guard
-        # Or, if state is already 'prompting', it might be a re-entry, be careful.
-        if room['state'] != 'initializing': # Check should be against 'initializing'
-            logger.warning(f"Room {self.room_name}: Attempted to start prompting round when not in initializing state (current: {room['state']}). Current op_number: {room.get('current_op_number')}")
-            # If already prompting, perhaps just resend state or assignments to late joiners if supported.
-            # For now, we prevent re-entry if not initializing.
+        if not started:
             return
+        tracing.annotate(op=0, state='prompting')
+        self.schedule_phase_deadline('prompting', 0)
 
+        room = await game_rooms.get(self.room_group_name)
+        if not room:
+            return
         logger.info(f"Room {self.room_name}: Executing start_prompting_round.")
-        room['state'] = 'prompting'
-        room['current_op_number'] = 0 
-        room['current_display_round'] = 0 
-        room['assignments'] = {player_id: {'type': 'prompt'} for player_id in room['turn_order']}
-        
         logger.info(f"Room {self.room_name}: Initial assignments for prompting: {list(room['assignments'].keys())}")
         await self.broadcast_game_state("請所有玩家提交一個有趣的題目！") 
 
-        bots_processed_count = 0
+        await self.flush_game_state()
+
+        bot_player_ids = []
         for player_id in room['turn_order']: 
             player_data = room['players'].get(player_id)
             if not player_data:
@@ -579,39 +828,8 @@ class GameConsumer(AsyncWebsocketConsumer):
                 continue
 
             if player_data.get('isBot', False):
-                # Bot logic: auto-submit prompt
-                bot_prompt = None
-                if llm_client:
-                    try:
-                        logger.info(f"Room {self.room_name}: Bot {player_id} attempting to generate prompt via LLM.")
-                        generated_text = await sync_to_async(llm_client.generate_text_from_text)()
-                        if generated_text and generated_text.strip():
-                            bot_prompt = generated_text.strip()
-                            logger.info(f"Room {self.room_name}: Bot {player_id} LLM generated prompt: {bot_prompt}")
-                        else:
-                            logger.warning(f"Room {self.room_name}: Bot {player_id} LLM returned empty prompt.")
-                    except Exception as e:
-                        logger.error(f"Room {self.room_name}: Bot {player_id} error generating prompt via LLM: {e}")
-                
-                if not bot_prompt: # Fallback to predefined prompts
-                    logger.info(f"Room {self.room_name}: Bot {player_id} falling back to predefined prompt.")
-                    bot_prompts_list = [
-                        "一隻太空貓在月球上釣魚", "一個害羞的機器人送花", "魔法森林裡的秘密派對",
-                        "沉睡火山上的冰淇淋店", "會飛的豬在雲中賽跑", "水下城市的爵士樂隊",
-                        "時間旅行者遺失了他的手錶", "一隻愛讀書的龍", "隱形人在玩捉迷藏"
-                    ]
-                    bot_prompt = random.choice(bot_prompts_list)
-                
-                room['books'][player_id].append({
-                    'type': 'prompt',
-                    'data': bot_prompt,
-                    'player': player_id,
-                    'round': 0 # Initial prompt is round 0
-                })
-                if player_id in room['assignments']:
-                    del room['assignments'][player_id] 
-                logger.info(f"Room {self.room_name}: Bot {player_id} ({player_data.get('name', '')}) auto-submitted prompt: {bot_prompt}")
-                bots_processed_count += 1
+                # 機器人稍後併發出題
+                bot_player_ids.append(player_id)
             else:
                 # Real player logic
                 player_channel_name = player_data.get('channel_name')
@@ -629,302 +847,588 @@ class GameConsumer(AsyncWebsocketConsumer):
                 else:
                     logger.warning(f"Room {self.room_name}: Real player {player_id} ({player_data.get('name', '')}) HAS NO CHANNEL_NAME during start_prompting_round. Client UI should update via game_state_update if they are in waiting_on.")
 
-        if bots_processed_count > 0:
-            logger.info(f"Room {self.room_name}: Bots have processed. Remaining assignments: {list(room['assignments'].keys())}")
-            if not room['assignments']: 
-                logger.info(f"Room {self.room_name}: All prompts submitted (all bots or bots + instant human submissions). Starting first operation.")
-                # Ensure not to call start_next_operation if game already moved past prompting by a quick human
-                if room['state'] == 'prompting': # Double check state
-                    await self.start_next_operation()
-            else:
-                await self.broadcast_game_state(f"機器人已完成出題，等待 {len(room['assignments'])} 位玩家...")
-        
-        # If no bots, the first broadcast_game_state is active.
-        # Transition to next phase is handled by the last real player's submission.
-        logger.info(f"Room {self.room_name}: Finished start_prompting_round. Current assignments: {list(room['assignments'].keys())}")
+        if not bot_player_ids:
+            # If no bots, the first broadcast_game_state is active.
+            # Transition to next phase is handled by the last real player's submission.
+            logger.info(f"Room {self.room_name}: Finished start_prompting_round. Current assignments: {list(room['assignments'].keys())}")
+            return
 
-    async def handle_submit_prompt(self, prompt_text):
-        room = game_rooms[self.room_group_name]
+        # 所有機器人併發出題，完成後依 turn_order 順序寫入書本
+        bot_prompts = await self.run_bot_turns([
+            (lambda pid=player_id: self.generate_bot_prompt(pid)) for player_id in bot_player_ids
+        ])
+
+        deferred = DeferredLog(logger)
+        def record_bot_prompts(room):
+            if room['state'] != 'prompting':
+                return None
+            for player_id, bot_prompt in zip(bot_player_ids, bot_prompts):
+                if room['assignments'].pop(player_id, None) is None:
+                    continue
+                room['books'][player_id].append({
+                    'type': 'prompt',
+                    'data': bot_prompt,
+                    'player': player_id,
+                    'round': 0 # Initial prompt is round 0
+                })
+                deferred.info(f"Room {self.room_name}: Bot {player_id} ({room['players'].get(player_id, {}).get('name', '')}) auto-submitted prompt: {bot_prompt}")
+            return len(room['assignments'])
 
-        if room['state'] != 'prompting':
-            await self.send_error("現在不是提交題目的階段。")
-            return
-        if self.player_id not in room['assignments'] or room['assignments'][self.player_id]['type'] != 'prompt':
-            await self.send_error("您沒有被分配提交題目或已提交。")
+        remaining = await game_rooms.update(self.room_group_name, deferred.wrap(record_bot_prompts))
+        deferred.flush()
+        if remaining is None:
+            logger.warning(f"start_prompting_round: Room {self.room_group_name} closed or moved on while bots were generating prompts.")
             return
+
+        logger.info(f"Room {self.room_name}: Bots have processed. Remaining assignments: {remaining}")
+        if remaining == 0:
+            logger.info(f"Room {self.room_name}: All prompts submitted (all bots or bots + instant human submissions). Starting first operation.")
+            await self.start_next_operation(from_op_number=0)
+        else:
+            await self.broadcast_game_state(f"機器人已完成出題，等待 {remaining} 位玩家...")
+
+    @tracing.traced('submit_prompt')
+    async def handle_submit_prompt(self, prompt_text):
         if not prompt_text or len(prompt_text.strip()) == 0:
             await self.send_error("題目不能為空。")
             return
 
-        room['assignments'].pop(self.player_id)
-        room['books'][self.player_id].append({
-            'type': 'prompt',
-            'data': prompt_text,
-            'player': self.player_id, # 題目由自己提出
-            'round': 0 # 初始題目定義為 round 0
-        })
+        def submit_prompt(room):
+            # 檢查、移除任務與寫入書本在同一次原子更新中完成，避免重複提交或同時推進
+            if room['state'] != 'prompting':
+                return "現在不是提交題目的階段。", None
+            if self.player_id not in room['assignments'] or room['assignments'][self.player_id]['type'] != 'prompt':
+                return "您沒有被分配提交題目或已提交。", None
+
+            room['assignments'].pop(self.player_id)
+            room['books'][self.player_id].append({
+                'type': 'prompt',
+                'data': prompt_text,
+                'player': self.player_id, # 題目由自己提出
+                'round': 0 # 初始題目定義為 round 0
+            })
+            return None, (len(room['assignments']), room['current_op_number'])
+
+        result = await game_rooms.update(self.room_group_name, submit_prompt)
+        if result is None:
+            return
+        error, progress = result
+        if error:
+            await self.send_error(error)
+            return
+        remaining, op_num = progress
+        tracing.annotate(player=self.player_id, op=op_num, remaining=remaining)
+
         print(f"Player {self.player_id} submitted prompt: {prompt_text}")
 
         await self.send_notification('您的題目已提交！', 'success')
 
-        if not room['assignments']: # 所有人都提交完畢
+        if remaining == 0: # 所有人都提交完畢
             print(f"Room {self.room_name}: All prompts submitted. Starting first operation.")
-            await self.start_next_operation()
+            await self.start_next_operation(from_op_number=op_num)
         else:
-            await self.broadcast_game_state(f"等待其他 {len(room['assignments'])} 位玩家提交題目...")
+            await self.broadcast_game_state(f"等待其他 {remaining} 位玩家提交題目...")
 
-    async def start_next_operation(self):
-        room = game_rooms[self.room_group_name]
-        room['current_op_number'] += 1
-        op_num = room['current_op_number']
-        
-        num_players = len(room['turn_order'])
-
-        if op_num > room['total_ops']:
-            logger.info(f"Room {self.room_name}: Op# {op_num} exceeds total_ops {room['total_ops']}. Finishing game.")
-            await self.finish_game()
-            return
-
-        is_drawing_op = (op_num % 2 == 1)
-        room['current_display_round'] = math.ceil(op_num / 2.0)
-        
-        current_assignments = {} 
-        action_type = 'draw' if is_drawing_op else 'guess'
-        next_state = 'drawing' if is_drawing_op else 'guessing'
-        room['state'] = next_state
-
-        logger.info(f"Room {self.room_name}: Starting Op# {op_num} (Display Round {room['current_display_round']}) - Type: {next_state}")
-
-        bots_processed_this_op = False
+    @tracing.traced('start_next_operation')
+    async def start_next_operation(self, from_op_number=None):
+        """
+        推進到下一個操作 (繪畫或猜測)。
+        from_op_number 為呼叫端看到的目前操作編號；若房間已被其他請求推進，則不重複推進。
+        """
+        transition_started = time.perf_counter()
+
+        deferred = DeferredLog(logger)
+        def plan_operation(room):
+            if from_op_number is not None and room['current_op_number'] != from_op_number:
+                return None
+            previous_state = room['state']
+            room['current_op_number'] += 1
+            op_num = room['current_op_number']
+            
+            num_players = len(room['turn_order'])
 
-        for i, current_player_id in enumerate(room['turn_order']):
-            player_data = room['players'].get(current_player_id)
-            if not player_data:
-                logger.warning(f"Room {self.room_name}: Player data for {current_player_id} not found in start_next_operation. Skipping.")
-                continue
+            if op_num > room['total_ops']:
+                return {'finish': True, 'op_num': op_num, 'previous_state': previous_state}
 
-            book_owner_index = (i - op_num % num_players + num_players) % num_players
-            original_book_owner_id = room['turn_order'][book_owner_index]
+            is_drawing_op = (op_num % 2 == 1)
+            room['current_display_round'] = math.ceil(op_num / 2.0)
             
-            book_content = room['books'][original_book_owner_id]
-            if not book_content:
-                logger.error(f"Room {self.room_name}: Book for {original_book_owner_id} is empty for Op# {op_num} by {current_player_id}!")
-                continue 
-            
-            item_to_process = book_content[-1]
+            current_assignments = {} 
+            next_state = 'drawing' if is_drawing_op else 'guessing'
+            room['state'] = next_state
 
-            task_payload_for_assignment = {
-                'original_player_id': original_book_owner_id,
-                'ui_round': room['current_display_round']
-            }
-            client_message_payload = {
-                'original_player': original_book_owner_id, 
-                'round': room['current_display_round']
-            }
+            human_messages = [] # [(player_id, channel_name, client_message_type, client_message_payload)]
+            bot_tasks = [] # [(bot_id, original_book_owner_id, prompt_or_drawing)]
 
-            if is_drawing_op:
-                if item_to_process['type'] not in ['prompt', 'guess']:
-                    logger.error(f"Room {self.room_name}: Expected prompt or guess for drawing by {current_player_id}, got {item_to_process['type']}")
+            for i, current_player_id in enumerate(room['turn_order']):
+                player_data = room['players'].get(current_player_id)
+                if not player_data:
+                    deferred.warning(f"Room {self.room_name}: Player data for {current_player_id} not found in start_next_operation. Skipping.")
                     continue
-                
-                task_payload_for_assignment['type'] = 'draw'
-                task_payload_for_assignment['prompt_or_guess'] = item_to_process['data']
-                client_message_payload['prompt_or_guess'] = item_to_process['data']
-                client_message_type = 'request_drawing'
 
-                if player_data.get('isBot', False):
-                    # 機器人繪畫邏輯
-                    bot_drawing = None
-                    text_to_draw = item_to_process['data']
-                    if llm_client:
-                        try:
-                            logger.info(f"Room {self.room_name}: Bot {current_player_id} attempting to generate image for: '{text_to_draw}'")
-                            image_bytes = await sync_to_async(llm_client.generate_image_bytes_from_text)(text_to_draw)
-                            if image_bytes:
-                                # Convert image_bytes to data URL
-                                bot_drawing = await sync_to_async(image_bytes_to_data_url)(image_bytes, mime_type="image/png") # Assuming PNG
-                                if bot_drawing:
-                                    logger.info(f"Room {self.room_name}: Bot {current_player_id} LLM generated image successfully.")
-                                else:
-                                    logger.warning(f"Room {self.room_name}: Bot {current_player_id} failed to convert LLM image bytes to data URL.")
-                            else:
-                                logger.warning(f"Room {self.room_name}: Bot {current_player_id} LLM returned no image bytes.")
-                        except Exception as e:
-                            logger.error(f"Room {self.room_name}: Bot {current_player_id} error generating image via LLM: {e}")
-
-                    if not bot_drawing: # Fallback to placeholder SVG
-                        logger.info(f"Room {self.room_name}: Bot {current_player_id} falling back to placeholder drawing.")
-                        bot_drawing_placeholders = [
-                            "data:image/svg+xml;base64,PHN2ZyB4bWxucz0iaHR0cDovL3d3dy53My5vcmcvMjAwMC9zdmciIHdpZHRoPSIyMDAiIGhlaWdodD0iMTUwIj48cmVjdCB3aWR0aD0iMTAwJSIgaGVpZ2h0PSIxMDAlIiBmaWxsPSIjZjBlNmYyIi8+PHRleHQgeD0iNTAlIiB5PSI1MCUiIGRvbWluYW50LWJhc2VsaW5lPSJtaWRkbGUiIHRleHQtYW5jaG9yPSJtaWRkbGUiIGZvbnQtZmFtaWx5PSJhcmlhbCIgZm9udC1zaXplPSIxNiIgZmlsbD0iIzU1NSI+Qm90J3MgQXJ0PC90ZXh0Pjwvc3ZnPg==",
-                            "data:image/svg+xml;base64,PHN2ZyB4bWxucz0iaHR0cDovL3d3dy53My5vcmcvMjAwMC9zdmciIHdpZHRoPSIyMDAiIGhlaWdodD0iMTUwIj48cmVjdCB3aWR0aD0iMTAwJSIgaGVpZ2h0PSIxMDAlIiBmaWxsPSIjZDJmMmVhIi8+PGNpcmNsZSBjeD0iMTAwIiBjeT0iNzUiIHI9IjQwIiBmaWxsPSIjZmZjMzMzIi8+PHRleHQgeD0iNTAlIiB5PSI1MCUiIGRvbWluYW50LWJhc2VsaW5lPSJtaWRkbGUiIHRleHQtYW5jaG9yPSJtaWRkbGUiIGZvbnQtZmFtaWx5PSJhcmlhbCIgZm9udC1zaXplPSIxMiIgZmlsbD0iIzMzMyI+Um9ib3QtRGF2aW5jaTwvdGV4dD48L3N2Zz4=",
-                            "data:image/svg+xml;base64,PHN2ZyB4bWxucz0iaHR0cDovL3d3dy53My5vcmcvMjAwMC9zdmciIHdpZHRoPSIyMDAiIGhlaWdodD0iMTUwIj48cmVjdCB3aWR0aD0iMTAwJSIgaGVpZ2h0PSIxMDAlIiBmaWxsPSIjZThlMWY2Ii8+PHBhdGggZD0iTTUwIDMwIEwxNTAgMzAgTDEwMCAxMjAgWiIgZmlsbD0iI2FmY2RmNSIvPjx0ZXh0IHg9IjUwJSIgeT0iNzAlIiBkb21pbmFudC1JYXNlbGluZT0ibWlkZGxlIiB0ZXh0LWFuY2hvcj0ibWlkZGxlIiBmb250LWZhbWlseT0iY291cmllciIgZm9udC1zaXplPSIxNCIgZmlsbD0iIzY2Njg3YiI+QklPIC1SVEZMT1c8L3RleHQ+PC9zdmc+"
-                        ]
-                        bot_drawing = random.choice(bot_drawing_placeholders)
-                    
-                    room['books'][original_book_owner_id].append({
-                        'type': 'drawing',
-                        'data': bot_drawing,
-                        'player': current_player_id, 
-                        'round': room['current_display_round']
-                    })
-                    logger.info(f"Room {self.room_name}: Bot {current_player_id} ({player_data.get('name', '')}) auto-submitted drawing for book {original_book_owner_id}.")
-                    bots_processed_this_op = True
+                book_owner_index = (i - op_num % num_players + num_players) % num_players
+                original_book_owner_id = room['turn_order'][book_owner_index]
+                
+                book_content = room['books'][original_book_owner_id]
+                if not book_content:
+                    deferred.error(f"Room {self.room_name}: Book for {original_book_owner_id} is empty for Op# {op_num} by {current_player_id}!")
                     continue 
-            else: # Guessing Op
-                if item_to_process['type'] != 'drawing':
-                    logger.error(f"Room {self.room_name}: Expected drawing for guessing by {current_player_id}, got {item_to_process['type']}")
-                    continue
                 
-                task_payload_for_assignment['type'] = 'guess'
-                task_payload_for_assignment['drawing_data'] = item_to_process['data'] # For human player assignment data
-                client_message_payload['drawing_data'] = item_to_process['data'] # For client message
-                client_message_type = 'request_guess'
+                item_to_process = book_content[-1]
+
+                # assignment_id 讓客戶端的上傳 (特別是二進位訊息) 可以對應到這個任務
+                assignment_id = f"{op_num}-{uuid.uuid4().hex[:12]}"
+                task_payload_for_assignment = {
+                    'assignment_id': assignment_id,
+                    'original_player_id': original_book_owner_id,
+                    'ui_round': room['current_display_round']
+                }
+                client_message_payload = {
+                    'assignment_id': assignment_id,
+                    'original_player': original_book_owner_id, 
+                    'round': room['current_display_round']
+                }
 
-                if player_data.get('isBot', False):
-                    # 機器人猜測邏輯
-                    bot_guess = None
-                    drawing_data_url = item_to_process['data']
-                    if llm_client:
-                        try:
-                            logger.info(f"Room {self.room_name}: Bot {current_player_id} attempting to generate guess for drawing.")
-                            # Convert data URL to image bytes
-                            image_bytes, mime_type = await sync_to_async(data_url_to_image_bytes)(drawing_data_url)
-                            if image_bytes and mime_type:
-                                generated_text = await sync_to_async(llm_client.generate_text_from_image_bytes)(image_bytes, mime_type=mime_type)
-                                if generated_text and generated_text.strip():
-                                    bot_guess = generated_text.strip()
-                                    logger.info(f"Room {self.room_name}: Bot {current_player_id} LLM generated guess: {bot_guess}")
-                                else:
-                                    logger.warning(f"Room {self.room_name}: Bot {current_player_id} LLM returned empty guess.")
-                            else:
-                                logger.warning(f"Room {self.room_name}: Bot {current_player_id} failed to convert drawing data URL to bytes for LLM.")
-                        except Exception as e:
-                            logger.error(f"Room {self.room_name}: Bot {current_player_id} error generating guess via LLM: {e}")
+                if is_drawing_op:
+                    if item_to_process['type'] not in ['prompt', 'guess']:
+                        deferred.error(f"Room {self.room_name}: Expected prompt or guess for drawing by {current_player_id}, got {item_to_process['type']}")
+                        continue
                     
-                    if not bot_guess: # Fallback to predefined guesses
-                        logger.info(f"Room {self.room_name}: Bot {current_player_id} falling back to predefined guess.")
-                        bot_guess_phrases = [
-                            "一隻貓在彈吉他", "一個快樂的太陽", "跳舞的機器人", "飛碟綁架了一頭牛",
-                            "巫師在施法", "一條龍在噴火", "太空人在月球漫步", "一個巨大的甜甜圈",
-                            "唱歌的胡蘿蔔", "戴著帽子的蛇"
-                        ]
-                        bot_guess = random.choice(bot_guess_phrases)
+                    task_payload_for_assignment['type'] = 'draw'
+                    task_payload_for_assignment['prompt_or_guess'] = item_to_process['data']
+                    client_message_payload['prompt_or_guess'] = item_to_process['data']
+                    client_message_type = 'request_drawing'
+                else: # Guessing Op
+                    if item_to_process['type'] != 'drawing':
+                        deferred.error(f"Room {self.room_name}: Expected drawing for guessing by {current_player_id}, got {item_to_process['type']}")
+                        continue
                     
-                    room['books'][original_book_owner_id].append({
-                        'type': 'guess',
-                        'data': bot_guess,
-                        'player': current_player_id, # 機器人是 "猜測者"
-                        'round': room['current_display_round']
-                    })
-                    logger.info(f"Room {self.room_name}: Bot {current_player_id} ({player_data.get('name', '')}) auto-submitted guess '{bot_guess}' for book {original_book_owner_id}.")
-                    bots_processed_this_op = True
-                    continue # 機器人已完成，跳過任務分配和訊息發送
+                    task_payload_for_assignment['type'] = 'guess'
+                    task_payload_for_assignment['drawing_data'] = item_to_process['data'] # For human player assignment data
+                    client_message_payload['drawing_data'] = item_to_process['data'] # For client message
+                    client_message_type = 'request_guess'
 
-            # 對於真人玩家，或未被自動處理的機器人任務
-            current_assignments[current_player_id] = task_payload_for_assignment
-            
-            if player_data.get('channel_name'):
+                # 機器人的任務也先登記在 assignments 中，避免真人玩家在機器人完成前就推進到下一個操作
+                current_assignments[current_player_id] = task_payload_for_assignment
+                if player_data.get('isBot', False):
+                    # 機器人任務：稍後與其他機器人併發執行
+                    bot_tasks.append((current_player_id, original_book_owner_id, item_to_process['data']))
+                else:
+                    human_messages.append((current_player_id, player_data.get('channel_name'), client_message_type, client_message_payload))
+
+            room['assignments'] = current_assignments
+            return {
+                'finish': False,
+                'op_num': op_num,
+                'previous_state': previous_state,
+                'is_drawing_op': is_drawing_op,
+                'next_state': next_state,
+                'display_round': room['current_display_round'],
+                'human_messages': human_messages,
+                'bot_tasks': bot_tasks,
+            }
+
+        plan = await game_rooms.update(self.room_group_name, deferred.wrap(plan_operation))
+        deferred.flush()
+        if plan is None:
+            logger.info(f"Room {self.room_name}: Op# {from_op_number} was already advanced by another request.")
+            return
+
+        if plan['previous_state'] == 'drawing':
+            # 繪畫階段結束，取消房間內仍在進行的 AI 輔助工作
+            ai_assist_jobs.cancel_for_room(self.room_group_name, reason='phase_ended')
+
+        op_num = plan['op_num']
+        tracing.annotate(op=op_num, state='finished' if plan['finish'] else plan['next_state'])
+        if plan['finish']:
+            logger.info(f"Room {self.room_name}: Op# {op_num} exceeds total_ops. Finishing game.")
+            metrics.op_transition_duration.observe(time.perf_counter() - transition_started, state='finished')
+            await self.finish_game()
+            return
+
+        is_drawing_op = plan['is_drawing_op']
+        next_state = plan['next_state']
+        self.schedule_phase_deadline(next_state, op_num)
+        logger.info(f"Room {self.room_name}: Starting Op# {op_num} (Display Round {plan['display_round']}) - Type: {next_state}")
+
+        # 新操作的狀態連同它的狀態訊息在任務之前送出 (取代上一個操作尚未送出的狀態訊息)
+        status_msg_prefix = f"第 {plan['display_round']} 回合 - "
+        status_msg_main = "請開始繪畫！" if is_drawing_op else "請開始猜測！"
+        await self.broadcast_game_state(f"{status_msg_prefix}{status_msg_main}")
+        await self.flush_game_state()
+
+        # 對於真人玩家，直接發送任務
+        for current_player_id, channel_name, client_message_type, client_message_payload in plan['human_messages']:
+            if channel_name:
                 await self.channel_layer.send(
-                    player_data['channel_name'],
+                    channel_name,
                     {
                         'type': 'send_message',
                         'message_type': client_message_type,
                         'payload': client_message_payload
                     }
                 )
-                logger.info(f"Room {self.room_name}: Assigned task to {current_player_id}: {task_payload_for_assignment['type']} for book {original_book_owner_id} (Op# {op_num})")
+                logger.info(f"Room {self.room_name}: Assigned task to {current_player_id}: {client_message_type} for book {client_message_payload['original_player']} (Op# {op_num})")
             else:
-                if not player_data.get('isBot', False): # 只記錄真人玩家的此類警告
-                     logger.warning(f"Room {self.room_name}: Real player {current_player_id} has no channel_name. Task {task_payload_for_assignment['type']} assigned but cannot send direct message.")
+                logger.warning(f"Room {self.room_name}: Real player {current_player_id} has no channel_name. Task {client_message_type} assigned but cannot send direct message.")
 
-        room['assignments'] = current_assignments
-        
-        status_msg_prefix = f"第 {room['current_display_round']} 回合 - "
-        status_msg_main = "請開始繪畫！" if is_drawing_op else "請開始猜測！"
+        # 只計算推進本身 (規劃、指派、廣播)，不包含機器人的 LLM 工作
+        metrics.op_transition_duration.observe(time.perf_counter() - transition_started, state=next_state)
 
-        if bots_processed_this_op: 
-            current_action_description = "繪畫" if is_drawing_op else "猜測"
-            if not room['assignments']: 
-                logger.info(f"Room {self.room_name}: All {current_action_description} tasks for Op# {op_num} completed by bots or instant human submissions. Starting next operation.")
-                # 確保在正確的狀態下才推進 (drawing 或 guessing)
-                if room['state'] == next_state: 
-                     await self.start_next_operation()
-                return 
-            else:
-                await self.broadcast_game_state(f"{status_msg_prefix}機器人已完成{current_action_description}，等待 {len(room['assignments'])} 位玩家...")
+        bot_tasks = plan['bot_tasks']
+        if not bot_tasks:
+            logger.info(f"Room {self.room_name}: Finished Op# {op_num} setup.")
+            return
+
+        # 併發執行本操作所有機器人的任務，房間只需等待最慢的機器人
+        if is_drawing_op:
+            bot_jobs = [
+                (lambda pid=bot_id, text=data: self.generate_bot_drawing(pid, text))
+                for bot_id, _, data in bot_tasks
+            ]
         else:
-            await self.broadcast_game_state(f"{status_msg_prefix}{status_msg_main}")
+            bot_jobs = [
+                (lambda pid=bot_id, data_url=data: self.generate_bot_guess(pid, data_url))
+                for bot_id, _, data in bot_tasks
+            ]
+        bot_results = await self.run_bot_turns(bot_jobs)
+
+        entry_type = 'drawing' if is_drawing_op else 'guess'
+
+        deferred = DeferredLog(logger)
+        def record_bot_results(room):
+            if room['current_op_number'] != op_num:
+                return None
+            # 依 turn_order 順序寫入書本，確保結果可重現
+            for (bot_id, original_book_owner_id, _), bot_result in zip(bot_tasks, bot_results):
+                if room['assignments'].pop(bot_id, None) is None:
+                    continue
+                room['books'][original_book_owner_id].append({
+                    'type': entry_type,
+                    'data': bot_result,
+                    'player': bot_id, 
+                    'round': room['current_display_round']
+                })
+                deferred.info(f"Room {self.room_name}: Bot {bot_id} ({room['players'].get(bot_id, {}).get('name', '')}) auto-submitted {entry_type} for book {original_book_owner_id}.")
+            return len(room['assignments'])
 
-        logger.info(f"Room {self.room_name}: Finished Op# {op_num} setup. Current assignments: {list(room['assignments'].keys())}")
+        remaining = await game_rooms.update(self.room_group_name, deferred.wrap(record_bot_results))
+        deferred.flush()
+        if remaining is None:
+            logger.warning(f"Room {self.room_name}: Room closed or moved past Op# {op_num} while bots were working. Discarding bot results.")
+            return
 
-    async def handle_submit_drawing(self, drawing_data_url):
-        room = game_rooms[self.room_group_name]
+        current_action_description = "繪畫" if is_drawing_op else "猜測"
+        if remaining == 0:
+            logger.info(f"Room {self.room_name}: All {current_action_description} tasks for Op# {op_num} completed by bots or instant human submissions. Starting next operation.")
+            await self.start_next_operation(from_op_number=op_num)
+        else:
+            await self.broadcast_game_state(f"{status_msg_prefix}機器人已完成{current_action_description}，等待 {remaining} 位玩家...")
 
-        if room['state'] != 'drawing':
-            await self.send_error("現在不是繪畫階段。")
+    def schedule_phase_deadline(self, state, op_number):
+        """為目前階段設定期限 (取代房間先前的期限)"""
+        timeout = PHASE_TIMEOUTS.get(state, 0)
+        if timeout <= 0:
+            phase_timers.cancel(self.room_group_name)
             return
-        if self.player_id not in room['assignments'] or room['assignments'][self.player_id]['type'] != 'draw':
-            await self.send_error("您沒有被分配繪畫任務或已提交。")
+        phase_timers.schedule(self.room_group_name, timeout, lambda: self.handle_phase_deadline(op_number))
+
+    @tracing.traced('phase_deadline')
+    async def handle_phase_deadline(self, op_number):
+        """
+        階段逾時：為仍未提交的玩家以機器人的預設內容自動提交，讓房間可以繼續進行並結束。
+        房間已推進到其他操作時不做任何事。
+        """
+        room = await game_rooms.get(self.room_group_name)
+        if not room or room.get('current_op_number') != op_number or not room.get('assignments'):
             return
+        fallback_drawing = None
+        if room['state'] == 'drawing':
+            fallback_drawing = await blob_store.store_data_url(random.choice(BOT_FALLBACK_DRAWINGS))
+
+        def auto_submit(room):
+            if room.get('current_op_number') != op_number or room['state'] not in PHASE_TIMEOUTS:
+                return None
+            submitted = []
+            for player_id, task in list(room['assignments'].items()):
+                if task['type'] == 'prompt':
+                    room['books'][player_id].append({
+                        'type': 'prompt',
+                        'data': random.choice(BOT_FALLBACK_PROMPTS),
+                        'player': player_id,
+                        'round': 0
+                    })
+                elif task['type'] == 'draw':
+                    room['books'][task['original_player_id']].append({
+                        'type': 'drawing',
+                        'data': fallback_drawing,
+                        'player': player_id,
+                        'round': task['ui_round']
+                    })
+                elif task['type'] == 'guess':
+                    room['books'][task['original_player_id']].append({
+                        'type': 'guess',
+                        'data': random.choice(BOT_FALLBACK_GUESSES),
+                        'player': player_id,
+                        'round': task['ui_round']
+                    })
+                else:
+                    continue
+                del room['assignments'][player_id]
+                submitted.append((player_id, room['players'].get(player_id, {}).get('channel_name')))
+            return submitted
+
+        submitted = await game_rooms.update(self.room_group_name, auto_submit)
+        if not submitted:
+            return
+
+        logger.info(f"Room {self.room_name}: Op# {op_number} deadline passed. Auto-submitted for {[player_id for player_id, _ in submitted]}.")
+        fallback_kind = {'prompting': 'prompt', 'drawing': 'drawing', 'guessing': 'guess'}.get(room['state'], room['state'])
+        metrics.bot_fallbacks.inc(len(submitted), kind=fallback_kind, reason='deadline')
+        tracing.annotate(op=op_number, players=[player_id for player_id, _ in submitted])
+        for player_id, channel_name in submitted:
+            if channel_name:
+                await self.channel_layer.send(channel_name, {
+                    'type': 'send_message',
+                    'message_type': 'notification',
+                    'payload': {'message': '時間到！已為你自動提交。', 'level': 'info'}
+                })
+        await self.start_next_operation(from_op_number=op_number)
+
+    async def run_bot_turns(self, bot_jobs):
+        """
+        併發執行機器人任務 (受每個房間的併發上限限制)，並依傳入順序回傳結果。
+        bot_jobs 為一組無參數、回傳 coroutine 的函式。
+        """
+        if not bot_jobs:
+            return []
+        semaphore = get_bot_semaphore(self.room_group_name)
+
+        async def run_one(job):
+            async with semaphore:
+                return await job()
+
+        return await asyncio.gather(*(run_one(job) for job in bot_jobs))
+
+    async def call_llm_provider(self, call_type, method_name, *args, **kwargs):
+        """
+        以房間設定的 provider 執行呼叫；失敗或回傳空結果時改用本機 provider。
+        兩者都失敗時回傳 None。
+        """
+        room = await game_rooms.get(self.room_group_name)
+        provider = llm_providers.resolve(call_type, room)
+        local_provider = llm_providers.get('local')
+        candidates = [provider] if provider else []
+        if local_provider and local_provider is not provider:
+            candidates.append(local_provider)
+
+        for candidate in candidates:
+            try:
+                result = await getattr(candidate, method_name)(*args, **kwargs)
+            except Exception as e:
+                logger.error(f"Room {self.room_name}: Provider '{candidate.name}' failed on {method_name}: {e}")
+                continue
+            if isinstance(result, str):
+                result = result.strip()
+            if result:
+                if candidate is not candidates[0]:
+                    metrics.llm_provider_fallbacks.inc(call_type=call_type)
+                return result
+            logger.warning(f"Room {self.room_name}: Provider '{candidate.name}' returned an empty result for {method_name}.")
+        return None
+
+    @tracing.traced('bot_prompt')
+    async def generate_bot_prompt(self, player_id):
+        """為機器人產生題目，所有 provider 都失敗時使用預設題目"""
+        tracing.annotate(player=player_id)
+        provider = llm_providers.resolve('prompt', await game_rooms.get(self.room_group_name))
+        bot_prompt = prompt_pool.take() if prompt_pool and provider and provider.name == 'gemini' else None
+        if bot_prompt:
+            logger.info(f"Room {self.room_name}: Bot {player_id} took prompt from pool: {bot_prompt}")
+            learn_llm_prompt(bot_prompt)
+            return bot_prompt
+
+        logger.info(f"Room {self.room_name}: Bot {player_id} attempting to generate prompt via provider '{provider.name if provider else None}'.")
+        bot_prompt = await self.call_llm_provider('prompt', 'generate_text_from_text')
+        if bot_prompt:
+            if prompt_pool:
+                prompt_pool.remember(bot_prompt)
+            if provider and provider.name != 'local':
+                learn_llm_prompt(bot_prompt)
+            logger.info(f"Room {self.room_name}: Bot {player_id} generated prompt: {bot_prompt}")
+        else: # Fallback to predefined prompts
+            logger.info(f"Room {self.room_name}: Bot {player_id} falling back to predefined prompt.")
+            metrics.bot_fallbacks.inc(kind='prompt', reason='llm')
+            tracing.annotate(fallback=True)
+            bot_prompt = random.choice(BOT_FALLBACK_PROMPTS)
+        return bot_prompt
+
+    @tracing.traced('bot_drawing')
+    async def generate_bot_drawing(self, player_id, text_to_draw):
+        """為機器人根據文字產生畫作 (blob URL)，所有 provider 都失敗時使用預設 SVG"""
+        tracing.annotate(player=player_id)
+        bot_drawing = None
+        logger.info(f"Room {self.room_name}: Bot {player_id} attempting to generate image for: '{text_to_draw}'")
+        image_bytes = await self.call_llm_provider('draw', 'generate_image_bytes_from_text', text_to_draw)
+        if image_bytes:
+            # 與玩家畫作相同的正規化，再直接存入 blob store，不需轉成 base64 data URL
+            mime_type = "image/png" # Assuming PNG
+            try:
+                image_bytes, mime_type = await image_ingestor.anormalize(image_bytes, mime_type)
+            except ImageRejected as e:
+                logger.warning(f"Room {self.room_name}: Bot {player_id} image could not be normalized ({e}). Storing as-is.")
+            bot_drawing = await blob_store.store_bytes(image_bytes, mime_type)
+            logger.info(f"Room {self.room_name}: Bot {player_id} generated image successfully.")
+
+        if not bot_drawing: # Fallback to placeholder SVG
+            logger.info(f"Room {self.room_name}: Bot {player_id} falling back to placeholder drawing.")
+            metrics.bot_fallbacks.inc(kind='drawing', reason='llm')
+            tracing.annotate(fallback=True)
+            bot_drawing = await blob_store.store_data_url(random.choice(BOT_FALLBACK_DRAWINGS))
+        return bot_drawing
+
+    @tracing.traced('bot_guess')
+    async def generate_bot_guess(self, player_id, drawing_ref):
+        """為機器人根據畫作產生猜測，所有 provider 都失敗時使用預設猜測"""
+        tracing.annotate(player=player_id)
+        bot_guess = None
+        logger.info(f"Room {self.room_name}: Bot {player_id} attempting to generate guess for drawing.")
+        # 從 blob store 讀取畫作
+        image_bytes, mime_type = await blob_store.load(drawing_ref)
+        if image_bytes and mime_type:
+            bot_guess = await self.call_llm_provider('guess', 'generate_text_from_image_bytes', image_bytes, mime_type=mime_type)
+            if bot_guess:
+                logger.info(f"Room {self.room_name}: Bot {player_id} generated guess: {bot_guess}")
+        else:
+            logger.warning(f"Room {self.room_name}: Bot {player_id} failed to load drawing {drawing_ref}.")
+
+        if not bot_guess: # Fallback to predefined guesses
+            logger.info(f"Room {self.room_name}: Bot {player_id} falling back to predefined guess.")
+            metrics.bot_fallbacks.inc(kind='guess', reason='llm')
+            tracing.annotate(fallback=True)
+            bot_guess = random.choice(BOT_FALLBACK_GUESSES)
+        return bot_guess
+
+    async def handle_submit_drawing(self, drawing_data_url, assignment_id=None):
+        """舊的 JSON 上傳路徑 (data URL)；新客戶端使用二進位訊息"""
         if not drawing_data_url:
             await self.send_error("繪畫數據不能為空。")
             return
+        image_bytes, mime_type = await image_workers.decode_data_url(drawing_data_url)
+        if not image_bytes:
+            await self.send_error("繪畫數據格式錯誤。")
+            return
+        drawing_ref = await self.ingest_drawing(image_bytes, mime_type)
+        if drawing_ref:
+            await self.submit_drawing_ref(drawing_ref, assignment_id)
+
+    @tracing.traced('ingest_drawing')
+    async def ingest_drawing(self, image_bytes, mime_type):
+        """
+        正規化玩家的畫作 (驗證、縮小、重新壓縮) 並存入 blob store，回傳 blob URL。
+        畫作只在 blob store 存一份，書本與之後的訊息只攜帶 blob URL。
+        不符合限制時通知玩家並回傳 None。
+        """
+        try:
+            normalized_bytes, normalized_mime = await image_ingestor.anormalize(image_bytes, mime_type)
+        except ImageRejected as e:
+            logger.info(f"Room {self.room_name}: Rejected drawing from {self.player_id} ({len(image_bytes)} bytes): {e}")
+            await self.send_error(str(e))
+            return None
+        logger.debug(f"Room {self.room_name}: Drawing from {self.player_id} normalized {len(image_bytes)} -> {len(normalized_bytes)} bytes ({normalized_mime}).")
+        return await blob_store.store_bytes(normalized_bytes, normalized_mime)
+
+    @tracing.traced('submit_drawing')
+    async def submit_drawing_ref(self, drawing_ref, assignment_id=None):
+        def submit_drawing(room):
+            if room['state'] != 'drawing':
+                return "現在不是繪畫階段。", None
+            if self.player_id not in room['assignments'] or room['assignments'][self.player_id]['type'] != 'draw':
+                return "您沒有被分配繪畫任務或已提交。", None
+            if assignment_id and room['assignments'][self.player_id].get('assignment_id') != assignment_id:
+                # 上一個操作遺留的上傳
+                return "這份畫作屬於已結束的回合。", None
+
+            task = room['assignments'].pop(self.player_id)
+            room['books'][task['original_player_id']].append({
+                'type': 'drawing',
+                'data': drawing_ref,
+                'player': self.player_id, # Who drew it
+                'round': task['ui_round']
+            })
+            return None, (task, len(room['assignments']), room['current_op_number'])
 
-        task = room['assignments'].pop(self.player_id)
-        original_player_id = task['original_player_id']
-        ui_round = task['ui_round']
+        result = await game_rooms.update(self.room_group_name, submit_drawing)
+        if result is None:
+            return
+        error, progress = result
+        if error:
+            await self.send_error(error)
+            return
+        task, remaining, op_num = progress
+        tracing.annotate(player=self.player_id, op=op_num, remaining=remaining)
 
-        room['books'][original_player_id].append({
-            'type': 'drawing',
-            'data': drawing_data_url,
-            'player': self.player_id, # Who drew it
-            'round': ui_round
-        })
-        print(f"Player {self.player_id} submitted drawing for book {original_player_id} (UI Round {ui_round})")
+        print(f"Player {self.player_id} submitted drawing for book {task['original_player_id']} (UI Round {task['ui_round']})")
         await self.send_notification('您的繪畫已提交！', 'success')
 
-        if not room['assignments']: # All drawings for this op_num submitted
-            print(f"Room {self.room_name}: All drawings for Op# {room['current_op_number']} submitted.")
-            await self.start_next_operation()
+        if remaining == 0: # All drawings for this op_num submitted
+            print(f"Room {self.room_name}: All drawings for Op# {op_num} submitted.")
+            await self.start_next_operation(from_op_number=op_num)
         else:
-            await self.broadcast_game_state(f"等待其他 {len(room['assignments'])} 位玩家完成繪畫...")
+            await self.broadcast_game_state(f"等待其他 {remaining} 位玩家完成繪畫...")
 
+    @tracing.traced('submit_guess')
     async def handle_submit_guess(self, guess_text):
-        room = game_rooms[self.room_group_name]
-
-        if room['state'] != 'guessing':
-            await self.send_error("現在不是猜測階段。")
-            return
-        if self.player_id not in room['assignments'] or room['assignments'][self.player_id]['type'] != 'guess':
-            await self.send_error("您沒有被分配猜測任務或已提交。")
-            return
         if not guess_text or len(guess_text.strip()) == 0:
             await self.send_error("猜測內容不能為空。")
             return
-            
-        task = room['assignments'].pop(self.player_id)
-        original_player_id = task['original_player_id']
-        ui_round = task['ui_round']
-
-        room['books'][original_player_id].append({
-            'type': 'guess',
-            'data': guess_text,
-            'player': self.player_id, # Who guessed it
-            'round': ui_round
-        })
-        print(f"Player {self.player_id} submitted guess for book {original_player_id} (UI Round {ui_round})")
+
+        def submit_guess(room):
+            if room['state'] != 'guessing':
+                return "現在不是猜測階段。", None
+            if self.player_id not in room['assignments'] or room['assignments'][self.player_id]['type'] != 'guess':
+                return "您沒有被分配猜測任務或已提交。", None
+
+            task = room['assignments'].pop(self.player_id)
+            room['books'][task['original_player_id']].append({
+                'type': 'guess',
+                'data': guess_text,
+                'player': self.player_id, # Who guessed it
+                'round': task['ui_round']
+            })
+            return None, (task, len(room['assignments']), room['current_op_number'])
+
+        result = await game_rooms.update(self.room_group_name, submit_guess)
+        if result is None:
+            return
+        error, progress = result
+        if error:
+            await self.send_error(error)
+            return
+        task, remaining, op_num = progress
+        tracing.annotate(player=self.player_id, op=op_num, remaining=remaining)
+
+        print(f"Player {self.player_id} submitted guess for book {task['original_player_id']} (UI Round {task['ui_round']})")
         await self.send_notification('您的猜測已提交！', 'success')
 
-        if not room['assignments']: # All guesses for this op_num submitted
-            print(f"Room {self.room_name}: All guesses for Op# {room['current_op_number']} submitted.")
-            await self.start_next_operation()
+        if remaining == 0: # All guesses for this op_num submitted
+            print(f"Room {self.room_name}: All guesses for Op# {op_num} submitted.")
+            await self.start_next_operation(from_op_number=op_num)
         else:
-            await self.broadcast_game_state(f"等待其他 {len(room['assignments'])} 位玩家完成猜測...")
+            await self.broadcast_game_state(f"等待其他 {remaining} 位玩家完成猜測...")
 
+    @tracing.traced('finish_game')
     async def finish_game(self):
-        room = game_rooms[self.room_group_name]
-        room['state'] = 'finished'
-        room['current_results_book_index'] = 0 # 初始化結果書本索引
+        def mark_finished(room):
+            room['state'] = 'finished'
+            room['current_results_book_index'] = 0 # 初始化結果書本索引
+            room['assignments'] = {}
+            return room
+
+        room = await game_rooms.update(self.room_group_name, mark_finished)
+        if not room:
+            return
+        phase_timers.cancel(self.room_group_name)
         print(f"Room {self.room_name}: Game finished. Broadcasting results.")
 
         # Prepare payload for game_over
@@ -938,26 +1442,80 @@ class GameConsumer(AsyncWebsocketConsumer):
             for pid, pdata in room['players'].items()
         }
 
+        # game_over 只攜帶書本清單與玩家資訊，書本內容之後以 results_book 逐本送出
+        initial_book_index = room.get('current_results_book_index', 0)
         game_over_payload = {
-            'books': room['books'],
             'players': players_info_for_results, # Send simplified player info
             'turn_order': room['turn_order'], # To display books in a consistent order
-            'initial_book_index': room.get('current_results_book_index', 0) # 添加初始書本索引
+            'book_count': len(room['turn_order']),
+            'initial_book_index': initial_book_index # 添加初始書本索引
         }
         
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'broadcast_message', # Goes to broadcast_message handler
-                'message_type': 'game_over', # Client-side type
-                'payload': game_over_payload
-            }
-        )
+        await self.flush_game_state()
+        await self.group_broadcast('game_over', game_over_payload) # Client-side type
+
+        # 先送出目前顯示的書本，其餘書本在背景以較低優先度預先送出
+        results_delivered_books.pop(self.room_group_name, None)
+        await self.send_results_book(room, initial_book_index)
+        self.start_results_prefetch(initial_book_index)
         # Optionally, clean up the game room from game_rooms after a delay or mark as finished
         # For now, keep it for potential review, or until all players disconnect
 
-    def prepare_game_state_payload(self, status_message=""):
-        room = game_rooms.get(self.room_group_name)
+    @staticmethod
+    def build_results_book_payload(room, book_index):
+        owner_id = room['turn_order'][book_index]
+        return {
+            'book_index': book_index,
+            'owner': owner_id,
+            'items': room['books'].get(owner_id, []),
+        }
+
+    async def send_results_book(self, room, book_index, to_self_only=False):
+        """送出一本結果書本；預設送給整個房間，並記錄為已送出"""
+        if not room or not 0 <= book_index < len(room.get('turn_order', [])):
+            return
+        payload = self.build_results_book_payload(room, book_index)
+        if to_self_only:
+            await self.send_payload('results_book', payload)
+            return
+        results_delivered_books[self.room_group_name].add(book_index)
+        await self.group_broadcast('results_book', payload)
+
+    def start_results_prefetch(self, start_index):
+        previous_task = results_prefetch_tasks.pop(self.room_group_name, None)
+        if previous_task:
+            previous_task.cancel()
+        task = asyncio.create_task(self.prefetch_results_books(start_index))
+        results_prefetch_tasks[self.room_group_name] = task
+
+        def forget(finished_task, key=self.room_group_name):
+            if results_prefetch_tasks.get(key) is finished_task:
+                results_prefetch_tasks.pop(key, None)
+
+        task.add_done_callback(forget)
+
+    async def prefetch_results_books(self, start_index):
+        """依照接下來會被翻到的順序，在背景逐本送出尚未送出的書本"""
+        try:
+            room = await game_rooms.get(self.room_group_name)
+            if not room:
+                return
+            num_books = len(room['turn_order'])
+            for offset in range(1, num_books):
+                await asyncio.sleep(RESULTS_PREFETCH_INTERVAL)
+                book_index = (start_index + offset) % num_books
+                if book_index in results_delivered_books[self.room_group_name]:
+                    continue
+                room = await game_rooms.get(self.room_group_name)
+                if not room:
+                    return
+                await self.send_results_book(room, book_index)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Room {self.room_name}: Error while prefetching result books: {e}", exc_info=True)
+
+    def prepare_game_state_payload(self, room, status_message=""):
         if not room:
             return {}
 
@@ -981,39 +1539,62 @@ class GameConsumer(AsyncWebsocketConsumer):
             'waiting_on': list(room.get('assignments', {}).keys()),
             'turn_order': room.get('turn_order', []),
             'max_ai_assists_allowed': room.get('max_ai_assists_allowed', 0), # 新增
-            'ai_assist_usage': room.get('ai_assist_usage', {})             # 新增
+            'ai_assist_usage': room.get('ai_assist_usage', {}),            # 新增
+            'state_version': room.get('state_version', 0)
         }
 
+    def publish_game_state(self, room):
+        """
+        mutator：將目前的公開狀態與上一次發布的狀態比較，有變動時遞增 state_version。
+        回傳 (base_version, changes)，changes 只包含有變動的頂層欄位。
+        status_message 不屬於版本化的狀態，由呼叫端另外附上。
+        """
+        state = self.prepare_game_state_payload(room)
+        del state['status_message'], state['state_version']
+        published = room.get('published_state') or {}
+        changes = {key: value for key, value in state.items() if published.get(key) != value}
+        base_version = room.get('state_version', 0)
+        if changes:
+            room['state_version'] = base_version + 1
+            room['published_state'] = state
+        return base_version, changes
+
+    def game_state_snapshot(self, room, status_message=""):
+        """完整狀態 (最後一次發布的版本)，給新連線或版本不符的客戶端"""
+        snapshot = dict(room.get('published_state') or self.prepare_game_state_payload(room))
+        snapshot['status_message'] = status_message
+        snapshot['state_version'] = room.get('state_version', 0)
+        return snapshot
+
     async def broadcast_game_state(self, status_message=""):
-        room = game_rooms.get(self.room_group_name)
-        if not room:
+        # 短時間內的多次呼叫會合併，只以最後的狀態訊息送出一次
+        await outbound_scheduler.schedule(self.room_group_name, status_message, self.publish_game_state_delta)
+
+    async def flush_game_state(self):
+        """送出尚未送出的狀態廣播；在任務指派與 game_over 之前呼叫以維持訊息順序"""
+        await outbound_scheduler.flush(self.room_group_name)
+
+    @tracing.traced('broadcast_game_state')
+    async def publish_game_state_delta(self, status_message=""):
+        # 只廣播與上一版的差異；客戶端的版本不符時會以 sync_state 要求完整狀態
+        published = await game_rooms.update(self.room_group_name, self.publish_game_state)
+        if not published:
             return
+        base_version, changes = published
 
-        state_payload = self.prepare_game_state_payload(status_message)
-        
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'broadcast_message', # Goes to broadcast_message handler
-                'message_type': 'game_state_update', # Client-side type
-                'payload': state_payload
-            }
-        )
+        await self.group_broadcast('game_state_delta', {
+            'base_version': base_version,
+            'state_version': base_version + 1 if changes else base_version,
+            'changes': changes,
+            'status_message': status_message
+        })
 
     async def handle_clear_canvas(self):
          # 只廣播給同一個房間的其他玩家，不包括自己
-         await self.channel_layer.group_send(
-             self.room_group_name,
-             {
-                 'type': 'broadcast_message',
-                 'message_type': 'clear_canvas_instruction',
-                 'payload': {},
-                 'sender_channel': self.channel_name # 告訴廣播函數不要發給自己
-             }
-         )
+         await self.group_broadcast('clear_canvas_instruction', {}, exclude_channels=[self.channel_name])
 
     async def handle_navigate_book(self, payload):
-        room = game_rooms.get(self.room_group_name)
+        room = await game_rooms.get(self.room_group_name)
         if not room or room['state'] != 'finished':
             # 僅在遊戲結束狀態下允許導覽
             logger.warning(f"Navigate book attempt in non-finished state or room not found. Room: {self.room_name}, State: {room.get('state') if room else 'N/A'}")
@@ -1024,109 +1605,111 @@ class GameConsumer(AsyncWebsocketConsumer):
             return
 
         direction = payload.get('direction')
-        current_index = room.get('current_results_book_index', 0)
-        
-        # turn_order 應該在 room['books'] 的鍵中，或者直接用 room['turn_order']
-        # 假設 displayedBooksOrder (即 room['turn_order']) 是有效的
-        num_books = len(room.get('turn_order', []))
-        if num_books == 0:
-            logger.warning(f"No books to navigate in room {self.room_name}.")
-            return
 
-
-        if direction == 'next' and current_index < num_books - 1:
-            room['current_results_book_index'] += 1
-        elif direction == 'prev' and current_index > 0:
-            room['current_results_book_index'] -= 1
-        else:
-            # 無效方向或已在邊界，不執行操作或可選擇發送錯誤
-            logger.debug(f"Navigate book: Invalid direction '{direction}' or at boundary. Index: {current_index}, NumBooks: {num_books}")
+        deferred = DeferredLog(logger)
+        def navigate(room):
+            current_index = room.get('current_results_book_index', 0)
+            
+            # turn_order 應該在 room['books'] 的鍵中，或者直接用 room['turn_order']
+            # 假設 displayedBooksOrder (即 room['turn_order']) 是有效的
+            num_books = len(room.get('turn_order', []))
+            if num_books == 0:
+                deferred.warning(f"No books to navigate in room {self.room_name}.")
+                return False
+
+            if direction == 'next' and current_index < num_books - 1:
+                room['current_results_book_index'] = current_index + 1
+            elif direction == 'prev' and current_index > 0:
+                room['current_results_book_index'] = current_index - 1
+            else:
+                # 無效方向或已在邊界，不執行操作或可選擇發送錯誤
+                deferred.debug(f"Navigate book: Invalid direction '{direction}' or at boundary. Index: {current_index}, NumBooks: {num_books}")
+                return False
+            return room['current_results_book_index']
+
+        new_index = await game_rooms.update(self.room_group_name, deferred.wrap(navigate))
+        deferred.flush()
+        if new_index is None or new_index is False:
             return
 
-        logger.info(f"Room {self.room_name}: Host {self.player_id} navigated book. New index: {room['current_results_book_index']}")
+        logger.info(f"Room {self.room_name}: Host {self.player_id} navigated book. New index: {new_index}")
+
+        # 確保翻到的書本已經送出 (背景預先送出可能還沒輪到它)
+        if new_index not in results_delivered_books[self.room_group_name]:
+            await self.send_results_book(await game_rooms.get(self.room_group_name), new_index)
 
         # 向房間內所有客戶端廣播新的書本索引
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'broadcast_message', # 使用現有的 broadcast_message 處理器
-                'message_type': 'update_displayed_book', # 客戶端將監聽此類型
-                'payload': {'book_index': room['current_results_book_index']}
-            }
-        )
+        await self.group_broadcast('update_displayed_book', {'book_index': new_index}) # 客戶端將監聽此類型
 
-    async def send_game_state_to_player(self, player_id, status_message=""):
-        room = game_rooms.get(self.room_group_name)
+    async def handle_request_results_book(self, payload):
+        """客戶端缺少某本書本時 (例如遺失訊息) 單獨補送給該玩家"""
+        room = await game_rooms.get(self.room_group_name)
+        if not room or room['state'] != 'finished':
+            return
+        book_index = payload.get('book_index')
+        if isinstance(book_index, int):
+            await self.send_results_book(room, book_index, to_self_only=True)
+
+    async def handle_sync_state(self, payload):
+        """客戶端的狀態版本落後或遺失差異訊息時，重新送出完整狀態"""
+        room = await game_rooms.get(self.room_group_name)
         if not room:
             return
+        if payload.get('state_version') == room.get('state_version', 0):
+            return
+        await self.send_game_state_to_player(self.player_id)
 
-        state_payload = self.prepare_game_state_payload(status_message)
+    async def send_game_state_to_player(self, player_id, status_message=""):
+        await self.flush_game_state()
+        # 先發布尚未發布的變動 (其他玩家會收到差異)，再送出該版本的完整狀態
+        published = await game_rooms.update(self.room_group_name, self.publish_game_state)
+        if not published:
+            return
+        base_version, changes = published
+        if changes:
+            await self.group_broadcast('game_state_delta', {
+                'base_version': base_version,
+                'state_version': base_version + 1,
+                'changes': changes,
+                'status_message': ''
+            }, exclude_channels=[self.channel_name])
+
+        room = await game_rooms.get(self.room_group_name)
+        if not room:
+            return
+        state_payload = self.game_state_snapshot(room, status_message)
         state_payload['your_player_id'] = player_id # 讓客戶端知道自己的ID
 
-        await self.send(text_data=json.dumps({
-            'type': 'game_state_update',
-            'payload': state_payload
-        }))
+        await self.send_payload('game_state_update', state_payload)
 
     async def send_error(self, message):
-        await self.send(text_data=json.dumps({
-            'type': 'error',
-            'payload': {'message': message}
-        }))
+        await self.send_payload('error', {'message': message})
 
     async def send_notification(self, message, level='info'):
-        await self.send(text_data=json.dumps({
-            'type': 'notification', # Client-side type for displaying notifications
-            'payload': {'message': message, 'level': level}
-        }))
+        await self.send_payload('notification', {'message': message, 'level': level})
 
     async def send_personal_message(self, event):
         """Handles sending a personal message to this specific client."""
         message_type = event['message_type']
         payload = event.get('payload', {})
         
-        await self.send(text_data=json.dumps({
-            'type': message_type,
-            'payload': payload
-        }))
+        await self.send_payload(message_type, payload)
 
     async def broadcast_message(self, event):
         """
-        Handles messages sent to the group. It forwards them to all clients in the group.
-        This method is called by channel_layer.group_send(... {'type': 'broadcast_message'})
+        Handles messages sent to the group in the legacy format (payload encoded by each recipient).
+        New broadcasts go through group_broadcast(), which encodes once and is handled by broadcast_frame().
         """
-        message_type = event['message_type']
-        payload = event.get('payload', {})
-
-        # If this message is a game_state_update, ensure 'your_player_id' is set for each client
-        if message_type == 'game_state_update':
-            # The payload from broadcast_game_state is already prepared.
-            # We need to add 'your_player_id' for the specific recipient.
-            # This is tricky because broadcast_message is generic.
-            # A better way: send_game_state_to_player for individual updates if needed,
-            # or client infers its ID from initial connection or a separate message.
-            # For now, client should know its ID.
-            pass # Payload is already good from prepare_game_state_payload
-
-        await self.send(text_data=json.dumps({
-            'type': message_type,
-            'payload': payload
-        }))
+        if event.get('sender_channel') == self.channel_name:
+            return
+        await self.send_payload(event['message_type'], event.get('payload', {}))
 
     async def handle_clear_canvas_broadcast(self):
         """Handles a request to clear canvas for all players (e.g., if a round restarts or error)."""
-        room = game_rooms.get(self.room_group_name)
-        if not room: return
+        if not await game_rooms.exists(self.room_group_name): return
 
         # This is a broadcast to all players in the group
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'broadcast_message',
-                'message_type': 'clear_canvas_instruction', # Client-side type
-                'payload': {} 
-            }
-        )
+        await self.group_broadcast('clear_canvas_instruction', {}) # Client-side type
         print(f"Broadcast clear canvas instruction to room {self.room_name}")
 
     async def send_message(self, event):
@@ -1136,29 +1719,11 @@ class GameConsumer(AsyncWebsocketConsumer):
         """
         message_type = event['message_type']
         payload = event.get('payload', {})
-        await self.send(text_data=json.dumps({
-            'type': message_type,
-            'payload': payload,
-        }))
-
-    @sync_to_async
-    def remove_user_id(self, user_id):
-        """從活躍用戶集合中移除用戶ID"""
-        if user_id in active_guest_ids:
-            active_guest_ids.remove(user_id)
-            logger.info(f"GameConsumer: 已移除用戶ID {user_id}, 當前活躍IDs: {active_guest_ids}")
-        else:
-            logger.warning(f"GameConsumer: 嘗試移除不存在的用戶ID {user_id}, 當前活躍IDs: {active_guest_ids}")
-            
-    @sync_to_async
-    def add_user_id(self, user_id):
-        """添加用戶ID到活躍集合"""
-        active_guest_ids.add(user_id)
-        logger.info(f"GameConsumer: 已添加用戶ID {user_id}, 當前活躍IDs: {active_guest_ids}")
-
-    async def handle_ai_assist_drawing(self, payload):
-        """處理 AI 輔助繪畫請求"""
-        room = game_rooms.get(self.room_group_name)
+        await self.send_payload(message_type, payload)
+
+    async def handle_ai_assist_drawing(self, payload, image_bytes=None, mime_type=None):
+        """處理 AI 輔助繪畫請求 (畫布可以是 payload 中的 data URL，或二進位訊息帶來的 image_bytes)"""
+        room = await game_rooms.get(self.room_group_name)
         # 初始化 is_bot 以確保在所有路徑中都已定義
         is_bot = False 
         # 初始化 response_remaining_assists 的預設值
@@ -1169,16 +1734,12 @@ class GameConsumer(AsyncWebsocketConsumer):
 
         if not room:
             logger.error(f"Room {self.room_name} not found for AI assist.")
-            await self.send(text_data=json.dumps({
-                'type': 'ai_drawing_result', 'payload': {'success': False, 'error': "遊戲房間不存在。", 'remaining_ai_assists': 0}
-            }))
+            await self.send_payload('ai_drawing_result', {'success': False, 'error': "遊戲房間不存在。", 'remaining_ai_assists': 0})
             return
 
         player_data = room['players'].get(self.player_id)
         if not player_data:
-            await self.send(text_data=json.dumps({
-                'type': 'ai_drawing_result', 'payload': {'success': False, 'error': "找不到玩家資料。", 'remaining_ai_assists': 0}
-            }))
+            await self.send_payload('ai_drawing_result', {'success': False, 'error': "找不到玩家資料。", 'remaining_ai_assists': 0})
             return
 
         is_bot = player_data.get('isBot', False)
@@ -1196,80 +1757,122 @@ class GameConsumer(AsyncWebsocketConsumer):
             prompt_text = payload.get('prompt')
             drawing_data_url = payload.get('drawing')
             
-            if not prompt_text or not drawing_data_url:
-                await self.send(text_data=json.dumps({
-                    'type': 'ai_drawing_result', 
-                    'payload': {'success': False, 'error': "缺少必要的繪畫或描述資訊", 'remaining_ai_assists': response_remaining_assists}
-                }))
+            if not prompt_text or not (drawing_data_url or image_bytes):
+                await self.send_payload('ai_drawing_result', {'success': False, 'error': "缺少必要的繪畫或描述資訊", 'remaining_ai_assists': response_remaining_assists})
                 return
             
-            if not llm_client:
-                logger.error(f"Room {self.room_name}: LLM Client not initialized.")
-                await self.send(text_data=json.dumps({
-                    'type': 'ai_drawing_result', 
-                    'payload': {'success': False, 'error': "AI 服務未啟動", 'remaining_ai_assists': response_remaining_assists}
-                }))
+            if not llm_providers.resolve('assist', room):
+                logger.error(f"Room {self.room_name}: No LLM provider available for AI assist.")
+                await self.send_payload('ai_drawing_result', {'success': False, 'error': "AI 服務未啟動", 'remaining_ai_assists': response_remaining_assists})
                 return
 
             if not is_bot:
                 if current_player_usage >= max_allowed_assists:
                     logger.info(f"Room {self.room_name}: Player {self.player_id} has no AI assists remaining (used {current_player_usage}/{max_allowed_assists}).")
-                    await self.send(text_data=json.dumps({
-                        'type': 'ai_drawing_result',
-                        'payload': {'success': False, 'error': '已達 AI 輔助次數上限', 'remaining_ai_assists': max(0, response_remaining_assists)}
-                    }))
+                    await self.send_payload('ai_drawing_result', {'success': False, 'error': '已達 AI 輔助次數上限', 'remaining_ai_assists': max(0, response_remaining_assists)})
                     return
             
-            logger.info(f"Room {self.room_name}: Processing AI assist for {self.player_id}. Human assists before this use: {response_remaining_assists if not is_bot else 'N/A (Bot)'}")
-            
-            image_bytes, mime_type = data_url_to_image_bytes(drawing_data_url)
-            if not image_bytes:
-                logger.error(f"Room {self.room_name}: Failed to convert drawing data URL to image bytes.")
-                await self.send(text_data=json.dumps({
-                    'type': 'ai_drawing_result', 
-                    'payload': {'success': False, 'error': "處理圖像資料失敗", 'remaining_ai_assists': response_remaining_assists}
-                }))
+            if ai_assist_jobs.has_pending(self.room_group_name, self.player_id):
+                await self.send_payload('ai_drawing_result', {'success': False, 'error': 'AI 正在處理上一個請求，請稍候', 'remaining_ai_assists': response_remaining_assists})
                 return
+
+            logger.info(f"Room {self.room_name}: Queueing AI assist for {self.player_id}. Human assists before this use: {response_remaining_assists if not is_bot else 'N/A (Bot)'}")
             
             if not is_bot:
-                current_player_usage += 1
-                room['ai_assist_usage'][self.player_id] = current_player_usage
+                def consume_ai_assist(room):
+                    usage = room['ai_assist_usage'].get(self.player_id, 0)
+                    if usage >= room.get('max_ai_assists_allowed', 0):
+                        return False
+                    room['ai_assist_usage'][self.player_id] = usage + 1
+                    return usage + 1
+
+                # 檢查與扣除次數在同一次原子更新中完成，避免同時送出的請求超用
+                current_player_usage = await game_rooms.update(self.room_group_name, consume_ai_assist)
+                if not current_player_usage:
+                    await self.send_payload('ai_drawing_result', {'success': False, 'error': '已達 AI 輔助次數上限', 'remaining_ai_assists': 0})
+                    return
                 response_remaining_assists = max_allowed_assists - current_player_usage
-            
-            result_image_bytes = llm_client.generate_image_from_image(
-                image_bytes, 
-                prompt_text=prompt_text, 
-                mime_type=mime_type
+
+            # 在背景執行 LLM 呼叫，立即回傳 job_id，結果完成後再推送
+            job = ai_assist_jobs.submit(
+                self.room_group_name,
+                self.player_id,
+                lambda job: self.run_ai_assist_job(job, prompt_text, drawing_data_url, is_bot, image_bytes, mime_type)
             )
-            
-            if not result_image_bytes:
-                logger.error(f"Room {self.room_name}: LLM returned no image bytes for AI drawing.")
-                await self.send(text_data=json.dumps({
-                    'type': 'ai_drawing_result',
-                    'payload': {'success': False, 'error': 'AI 生成圖像失敗，請重試', 'remaining_ai_assists': response_remaining_assists}
-                }))
-                return
-            
-            result_data_url = image_bytes_to_data_url(result_image_bytes, mime_type)
-            if not result_data_url:
-                logger.error(f"Room {self.room_name}: Failed to convert result image bytes to data URL.")
-                await self.send(text_data=json.dumps({
-                    'type': 'ai_drawing_result',
-                    'payload': {'success': False, 'error': '處理結果圖像失敗', 'remaining_ai_assists': response_remaining_assists}
-                }))
-                return
-            
-            await self.send(text_data=json.dumps({
-                'type': 'ai_drawing_result',
-                'payload': {'success': True, 'image': result_data_url, 'remaining_ai_assists': response_remaining_assists}
-            }))
-            logger.info(f"Room {self.room_name}: Successfully processed AI assist for {self.player_id}. Human assists remaining: {response_remaining_assists if not is_bot else 'N/A (Bot)'}")
+            await self.send_payload('ai_drawing_queued', {'job_id': job.job_id, 'remaining_ai_assists': response_remaining_assists})
             
         except Exception as e:
             logger.error(f"Room {self.room_name}: Error processing AI assist drawing for {self.player_id}: {e}", exc_info=True)
             # 在發生未知錯誤時，response_remaining_assists 會是基於嘗試使用前的狀態（如果錯誤發生在計數增加前）
-            # 或嘗試使用後的狀態（如果錯誤發生在計數增加後）。目前邏輯是在LLM調用前增加計數。
-            await self.send(text_data=json.dumps({
-                'type': 'ai_drawing_result',
-                'payload': {'success': False, 'error': "AI 處理過程出錯", 'remaining_ai_assists': response_remaining_assists}
-            }))
+            # 或嘗試使用後的狀態（如果錯誤發生在計數增加後）。
+            await self.send_payload('ai_drawing_result', {'success': False, 'error': "AI 處理過程出錯", 'remaining_ai_assists': response_remaining_assists})
+
+    async def run_ai_assist_job(self, job, prompt_text, drawing_data_url, is_bot, image_bytes=None, mime_type=None):
+        """AI 輔助繪畫的背景工作：解碼畫布、呼叫 LLM、推送結果"""
+        result_payload = {'job_id': job.job_id, 'success': False}
+        try:
+            if image_bytes is None:
+                image_bytes, mime_type = await image_workers.decode_data_url(drawing_data_url)
+            if not image_bytes:
+                logger.error(f"Room {self.room_name}: Failed to convert drawing data URL to image bytes.")
+                result_payload['error'] = "處理圖像資料失敗"
+                await self.refund_ai_assist(is_bot)
+            else:
+                result_image_bytes = await self.call_llm_provider(
+                    'assist',
+                    'generate_image_from_image',
+                    image_bytes, 
+                    prompt_text, 
+                    mime_type=mime_type
+                )
+                if not result_image_bytes:
+                    logger.error(f"Room {self.room_name}: LLM returned no image bytes for AI drawing.")
+                    result_payload['error'] = 'AI 生成圖像失敗，請重試'
+                else:
+                    result_data_url = await image_workers.encode_data_url(result_image_bytes, mime_type)
+                    if not result_data_url:
+                        logger.error(f"Room {self.room_name}: Failed to convert result image bytes to data URL.")
+                        result_payload['error'] = '處理結果圖像失敗'
+                    else:
+                        result_payload['success'] = True
+                        result_payload['image'] = result_data_url
+                        logger.info(f"Room {self.room_name}: Successfully processed AI assist job {job.job_id} for {self.player_id}.")
+        except asyncio.CancelledError:
+            # 工作被取消 (繪畫階段結束、玩家離線或玩家取消)，退還使用次數
+            await self.refund_ai_assist(is_bot)
+            if job.cancel_reason == 'disconnect':
+                raise
+            result_payload['cancelled'] = True
+            result_payload['error'] = 'AI 輔助已取消'
+        except Exception as e:
+            logger.error(f"Room {self.room_name}: Error in AI assist job {job.job_id} for {self.player_id}: {e}", exc_info=True)
+            result_payload['error'] = "AI 處理過程出錯"
+
+        room = await game_rooms.get(self.room_group_name)
+        max_allowed_assists = room.get('max_ai_assists_allowed', 0) if room else 0
+        if is_bot or not room:
+            result_payload['remaining_ai_assists'] = max_allowed_assists
+        else:
+            result_payload['remaining_ai_assists'] = max(0, max_allowed_assists - room['ai_assist_usage'].get(self.player_id, 0))
+
+        try:
+            await self.send_payload('ai_drawing_result', result_payload)
+        except Exception as e:
+            logger.warning(f"Room {self.room_name}: Could not deliver AI assist job {job.job_id} result to {self.player_id}: {e}")
+
+    async def refund_ai_assist(self, is_bot):
+        """退還一次 AI 輔助使用次數 (工作未產生結果時)"""
+        if is_bot:
+            return
+
+        def refund(room):
+            if room['ai_assist_usage'].get(self.player_id, 0) > 0:
+                room['ai_assist_usage'][self.player_id] -= 1
+
+        await game_rooms.update(self.room_group_name, refund)
+
+    async def handle_cancel_ai_assist(self, payload):
+        """玩家主動取消 AI 輔助工作"""
+        job = ai_assist_jobs.get(payload.get('job_id'))
+        if job and job.player_id == self.player_id and job.room_group_name == self.room_group_name:
+            ai_assist_jobs.cancel(job.job_id, reason='player')
@@ -0,0 +1,185 @@
+import time
+import heapq
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class GuestLeases:
+    """
+    訪客 ID 的租約：註冊時取得，WebSocket 連線期間的訊息 (含客戶端的 heartbeat) 會延長，
+    斷線時釋放；分頁當機或伺服器重啟而沒有釋放的 ID 會在 ttl 秒後自動失效。
+    過期的租約在每次操作時順便清除，成本只與過期的數量有關。
+    """
+
+    def __init__(self, ttl=90.0):
+        self.ttl = ttl
+
+    async def acquire(self, user_id):
+        """僅在 ID 沒有有效租約時取得，成功回傳 True"""
+        raise NotImplementedError
+
+    async def renew(self, user_id):
+        """建立或延長租約 (不論目前是否有效)"""
+        raise NotImplementedError
+
+    async def release(self, user_id):
+        raise NotImplementedError
+
+    async def is_leased(self, user_id):
+        raise NotImplementedError
+
+    async def reap(self):
+        """清除已過期的租約，回傳清除的數量"""
+        raise NotImplementedError
+
+
+class InMemoryGuestLeases(GuestLeases):
+    """
+    單一 process 的記憶體實作。
+    expiries 是每個 ID 目前的到期時間；heap 是 (到期時間, ID) 的 min-heap，延長租約時只加入新項目，
+    舊項目在彈出時與 expiries 比對後丟棄。heap 中過時的項目過多時整個重建，記憶體與有效租約數成正比。
+    """
+
+    def __init__(self, ttl=90.0, clock=time.monotonic):
+        super().__init__(ttl)
+        self.clock = clock
+        self.expiries = {}
+        self.heap = []
+        self.reaped = 0
+
+    def _reap(self, now):
+        reaped = 0
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            expiry, user_id = heapq.heappop(heap)
+            if self.expiries.get(user_id) == expiry:
+                del self.expiries[user_id]
+                reaped += 1
+        self.reaped += reaped
+        return reaped
+
+    def _set(self, user_id, now):
+        expiry = now + self.ttl
+        self.expiries[user_id] = expiry
+        heapq.heappush(self.heap, (expiry, user_id))
+        if len(self.heap) > 4 * len(self.expiries) + 64:
+            self.heap = [(expiry, user_id) for user_id, expiry in self.expiries.items()]
+            heapq.heapify(self.heap)
+
+    async def acquire(self, user_id):
+        now = self.clock()
+        self._reap(now)
+        if user_id in self.expiries:
+            return False
+        self._set(user_id, now)
+        return True
+
+    async def renew(self, user_id):
+        now = self.clock()
+        self._reap(now)
+        self._set(user_id, now)
+
+    async def release(self, user_id):
+        # heap 中的項目留到到期時再丟棄
+        self.expiries.pop(user_id, None)
+
+    async def is_leased(self, user_id):
+        self._reap(self.clock())
+        return user_id in self.expiries
+
+    async def reap(self):
+        return self._reap(self.clock())
+
+    def stats(self):
+        return {
+            'leases': len(self.expiries),
+            'heap_entries': len(self.heap),
+            'reaped': self.reaped,
+        }
+
+
+class RedisGuestLeases(GuestLeases):
+    """
+    使用 Redis 的共享實作，讓所有 worker 看到同一組訪客 ID。
+    租約存放在一個 sorted set 中 (member = ID，score = 到期的 UNIX 時間)；
+    ZREMRANGEBYSCORE 清除過期項目的成本是 O(log N + 過期數)。
+
+    client 可以是任何 redis.asyncio 相容的客戶端，例如測試時使用的 fakeredis.aioredis.FakeRedis。
+    """
+
+    def __init__(self, client=None, url=None, key='gartic:guest_leases', ttl=90.0):
+        super().__init__(ttl)
+        if client is None:
+            import redis.asyncio as redis_asyncio
+            client = redis_asyncio.from_url(url or 'redis://localhost:6379/0')
+        self.client = client
+        self.key = key
+
+    async def acquire(self, user_id):
+        now = time.time()
+        # 同一個 transaction 中先清除過期項目再以 NX 加入，ID 已有有效租約時 ZADD 回傳 0
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(self.key, '-inf', now)
+            pipe.zadd(self.key, {user_id: now + self.ttl}, nx=True)
+            _, added = await pipe.execute()
+        return bool(added)
+
+    async def renew(self, user_id):
+        await self.client.zadd(self.key, {user_id: time.time() + self.ttl})
+
+    async def release(self, user_id):
+        await self.client.zrem(self.key, user_id)
+
+    async def is_leased(self, user_id):
+        expiry = await self.client.zscore(self.key, user_id)
+        return expiry is not None and expiry > time.time()
+
+    async def reap(self):
+        return await self.client.zremrangebyscore(self.key, '-inf', time.time())
+
+
+def get_guest_leases(backend='memory', redis_url=None, ttl=90.0):
+    """依設定建立訪客 ID 租約 (多個 worker 時應使用 redis)"""
+    if backend == 'redis':
+        return RedisGuestLeases(url=redis_url, ttl=ttl)
+    return InMemoryGuestLeases(ttl=ttl)
+
+
+def _create_default_leases():
+    from django.conf import settings
+    return get_guest_leases(
+        backend=getattr(settings, 'GUEST_LEASE_BACKEND', 'memory'),
+        redis_url=getattr(settings, 'REDIS_URL', None),
+        ttl=getattr(settings, 'GUEST_LEASE_TTL', 90),
+    )
+
+
+guest_leases = _create_default_leases()
+
+
+class GuestLeaseMixin:
+    """
+    WebSocket consumer 用：連線時建立 self.user_id 的租約，收到訊息時延長，斷線時釋放。
+    延長最多每 ttl / 4 秒寫入一次，一般訊息與客戶端的 heartbeat 都會觸發。
+    """
+
+    async def hold_guest_lease(self):
+        user_id = getattr(self, 'user_id', None)
+        if user_id:
+            await guest_leases.renew(user_id)
+            self.guest_lease_renewed_at = time.monotonic()
+
+    async def renew_guest_lease(self):
+        user_id = getattr(self, 'user_id', None)
+        if not user_id:
+            return
+        now = time.monotonic()
+        if now - getattr(self, 'guest_lease_renewed_at', 0.0) >= guest_leases.ttl / 4:
+            self.guest_lease_renewed_at = now
+            await guest_leases.renew(user_id)
+
+    async def release_guest_lease(self):
+        user_id = getattr(self, 'user_id', None)
+        if user_id:
+            await guest_leases.release(user_id)
@@ -0,0 +1,203 @@
+import io
+import asyncio
+import logging
+import threading
+from PIL import Image, UnidentifiedImageError, features
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ImageRejected(ValueError):
+    """提交的圖片不符合限制 (格式、尺寸或大小)；訊息可直接顯示給玩家"""
+
+
+class ImageIngestor:
+    """
+    玩家畫作的正規化：驗證尺寸、縮小到設定的上限，並重新編碼成較小的格式。
+
+    每張圖片會嘗試調色盤 PNG 與無損 WebP，取兩者中較小的結果 (若原圖已是允許的格式、
+    未縮放且更小，則保留原圖)。不透明且顏色數不超過 palette_colors 的圖片 (一般塗鴉)
+    轉成調色盤是無損的；顏色更多時只有 lossy_palette=True 才會以量化後的調色盤 PNG 參與比較。
+    normalize() 是 CPU 密集的同步函式，在 consumer 中請使用 anormalize()；
+    指定 workers (ImageWorkerPool) 時 anormalize() 在 worker process 中執行，否則在 thread 中執行。
+    """
+
+    INPUT_FORMATS = ('PNG', 'WEBP', 'JPEG')
+
+    def __init__(self, max_width=1024, max_height=1024, max_input_bytes=5 * 1024 * 1024,
+                 max_output_bytes=512 * 1024, max_source_pixels=4096 * 4096,
+                 palette_colors=256, lossy_palette=False, workers=None):
+        self.max_width = max_width
+        self.max_height = max_height
+        self.max_input_bytes = max_input_bytes
+        self.max_output_bytes = max_output_bytes
+        self.max_source_pixels = max_source_pixels
+        self.palette_colors = palette_colors
+        self.lossy_palette = lossy_palette
+        self.workers = workers
+        self.webp_available = features.check('webp')
+        self.lock = threading.Lock()
+
+        self.images = 0
+        self.rejected = 0
+        self.resized = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def options(self):
+        """建立相同設定的 ImageIngestor 所需的參數 (傳給 worker process)"""
+        return {
+            'max_width': self.max_width,
+            'max_height': self.max_height,
+            'max_input_bytes': self.max_input_bytes,
+            'max_output_bytes': self.max_output_bytes,
+            'max_source_pixels': self.max_source_pixels,
+            'palette_colors': self.palette_colors,
+            'lossy_palette': self.lossy_palette,
+        }
+
+    @staticmethod
+    def _reject(message):
+        raise ImageRejected(message)
+
+    def _record(self, bytes_in, bytes_out, resized):
+        with self.lock:
+            self.images += 1
+            self.resized += int(resized)
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+        # 重新編碼偶爾會比原圖大 (例如縮小後)，counter 只累計省下的部分
+        metrics.image_ingest_bytes_saved.inc(max(0, bytes_in - bytes_out))
+
+    def _record_rejected(self):
+        with self.lock:
+            self.rejected += 1
+        metrics.image_ingest_rejected.inc()
+
+    def normalize(self, data, mime_type=None):
+        """回傳 (bytes, mime_type)；不符合限制時拋出 ImageRejected"""
+        try:
+            output, output_mime, resized = self._normalize(data, mime_type)
+        except ImageRejected:
+            self._record_rejected()
+            raise
+        self._record(len(data), len(output), resized)
+        return output, output_mime
+
+    def _normalize(self, data, mime_type=None):
+        """normalize() 的實作 (不更新統計)，回傳 (bytes, mime_type, 是否縮小)"""
+        if not data:
+            self._reject("圖片內容是空的。")
+        if len(data) > self.max_input_bytes:
+            self._reject("圖片檔案太大。")
+
+        try:
+            image = Image.open(io.BytesIO(data))
+        except (UnidentifiedImageError, OSError):
+            self._reject("無法辨識的圖片格式。")
+        if image.format not in self.INPUT_FORMATS:
+            self._reject("不支援的圖片格式。")
+
+        # 在解碼像素前先以 header 中的尺寸檢查，避免解壓縮炸彈
+        width, height = image.size
+        if width <= 0 or height <= 0 or width * height > self.max_source_pixels:
+            self._reject("圖片尺寸不合法。")
+
+        try:
+            image.load()
+        except (OSError, Image.DecompressionBombError):
+            self._reject("圖片內容已損壞。")
+
+        source_format = image.format
+        image = self._to_canvas_mode(image)
+        resized = width > self.max_width or height > self.max_height
+        if resized:
+            image.thumbnail((self.max_width, self.max_height), Image.LANCZOS)
+
+        candidates = []
+        original_mime = {'PNG': 'image/png', 'WEBP': 'image/webp'}.get(source_format)
+        if not resized and original_mime:
+            candidates.append((data, original_mime))
+        palette_png = self._encode_palette_png(image)
+        if palette_png:
+            candidates.append((palette_png, 'image/png'))
+        if self.webp_available:
+            candidates.append((self._encode(image, 'WEBP', lossless=True, quality=100, method=4), 'image/webp'))
+        if not candidates:
+            candidates.append((self._encode(image, 'PNG', optimize=True), 'image/png'))
+
+        output, output_mime = min(candidates, key=lambda candidate: len(candidate[0]))
+        if len(output) > self.max_output_bytes:
+            self._reject("圖片壓縮後仍然太大。")
+        return output, output_mime, resized
+
+    async def anormalize(self, data, mime_type=None):
+        if self.workers is None:
+            return await asyncio.to_thread(self.normalize, data, mime_type)
+        try:
+            output, (output_mime, resized) = await self.workers.run(
+                normalize_job, data, mime_type, self.options(), output_capacity=self.max_output_bytes
+            )
+        except ImageRejected:
+            self._record_rejected()
+            raise
+        self._record(len(data), len(output), resized)
+        return output, output_mime
+
+    @staticmethod
+    def _to_canvas_mode(image):
+        """轉成 RGB / RGBA；完全不透明的 alpha 通道會被移除"""
+        if image.mode not in ('RGB', 'RGBA'):
+            has_alpha = image.mode in ('LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+        if image.mode == 'RGBA' and image.getchannel('A').getextrema() == (255, 255):
+            image = image.convert('RGB')
+        return image
+
+    def _encode_palette_png(self, image):
+        if image.mode != 'RGB':
+            return None
+        colors = image.getcolors(self.palette_colors)
+        if colors is not None:
+            # 顏色數夠少：以圖片本身的顏色建立調色盤，轉換是無損的
+            palette_source = Image.new('P', (1, 1))
+            flat_palette = [channel for _, color in colors for channel in color]
+            palette_source.putpalette(flat_palette + [0] * (768 - len(flat_palette)))
+            palette_image = image.quantize(palette=palette_source, dither=Image.Dither.NONE)
+        elif self.lossy_palette:
+            palette_image = image.quantize(self.palette_colors, method=Image.Quantize.MEDIANCUT)
+        else:
+            return None
+        return self._encode(palette_image, 'PNG', optimize=True)
+
+    @staticmethod
+    def _encode(image, image_format, **options):
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format, **options)
+        return buffer.getvalue()
+
+    def stats(self):
+        return {
+            'images': self.images,
+            'rejected': self.rejected,
+            'resized': self.resized,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'bytes_saved': self.bytes_in - self.bytes_out,
+        }
+
+
+# --- worker process 端 (ImageWorkerPool) ---
+_worker_ingestors = {}
+
+
+def normalize_job(data, mime_type, options):
+    """在 worker 中以相同設定正規化畫作，回傳 (bytes, (mime_type, 是否縮小))"""
+    key = tuple(sorted(options.items()))
+    ingestor = _worker_ingestors.get(key)
+    if ingestor is None:
+        ingestor = _worker_ingestors[key] = ImageIngestor(**options)
+    output, output_mime, resized = ingestor._normalize(data, mime_type)
+    return output, (output_mime, resized)
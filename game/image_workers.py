@@ -0,0 +1,212 @@
+import os
+import re
+import atexit
+import asyncio
+import logging
+import binascii
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+logger = logging.getLogger(__name__)
+
+# 本模組會在 worker process 中被匯入，不可依賴 Django 設定 (全域的 pool 在 consumers 中建立)
+
+_DATA_URL_HEADER = re.compile(rb'^data:(image/[a-zA-Z+]+);base64$')
+
+
+class ImageWorkerPool:
+    """
+    CPU 密集的圖片工作 (base64 編解碼、畫作正規化) 的 process pool，讓這些工作可以分散到多個核心，
+    不佔用 event loop 與 asyncio 的預設 thread pool。
+
+    大於 shared_memory_threshold 的輸入會放在 SharedMemory 中交給 worker (worker 直接讀取，
+    不經過 pipe 的 pickle)；輸出大小有上限的工作也會預先配置輸出區段，由 worker 直接寫入。
+    所有區段都由主 process 建立與釋放。
+
+    processes=0、或 process pool 無法啟動時，改在 thread 中執行同樣的工作。
+    工作函式必須是模組層級的函式 func(data, *args) -> (bytes, meta)，data 是 bytes 或 memoryview。
+    """
+
+    def __init__(self, processes=None, shared_memory_threshold=256 * 1024):
+        self.processes = (os.cpu_count() or 1) if processes is None else processes
+        self.shared_memory_threshold = shared_memory_threshold
+        self.executor = None
+        self.use_threads = self.processes <= 0
+
+        self.jobs = 0
+        self.shared_memory_jobs = 0
+        self.thread_jobs = 0
+        self.failures = 0
+        atexit.register(self.shutdown)
+
+    def _get_executor(self):
+        if self.executor is None:
+            # spawn：worker 不繼承 event loop 與其他 thread 的狀態
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_warm_up,
+            )
+        return self.executor
+
+    def _allocate(self, size, segments):
+        """建立 SharedMemory 區段；系統不支援或空間不足時回傳 None (改以一般方式傳遞)"""
+        try:
+            segment = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        except OSError as e:
+            logger.warning(f"ImageWorkerPool: shared memory unavailable ({e}); passing {size} bytes through the pipe.")
+            return None
+        segments.append(segment)
+        return segment
+
+    async def run(self, func, data, *args, output_capacity=None):
+        """在 worker 中執行 func(data, *args)，回傳 (bytes, meta)；func 的例外會原樣拋出"""
+        self.jobs += 1
+        if self.use_threads:
+            self.thread_jobs += 1
+            return await asyncio.to_thread(_call_inline, func, data, args)
+
+        segments = []
+        try:
+            input_ref = ('bytes', data)
+            if len(data) >= self.shared_memory_threshold:
+                segment = self._allocate(len(data), segments)
+                if segment is not None:
+                    segment.buf[:len(data)] = data
+                    input_ref = ('shm', segment.name, len(data))
+                    self.shared_memory_jobs += 1
+            output_segment = None
+            if output_capacity is not None and output_capacity >= self.shared_memory_threshold:
+                output_segment = self._allocate(output_capacity, segments)
+            output_ref = ('shm', output_segment.name, output_capacity) if output_segment is not None else None
+
+            loop = asyncio.get_running_loop()
+            try:
+                (kind, value), meta = await loop.run_in_executor(
+                    self._get_executor(), _call, func, input_ref, output_ref, args
+                )
+            except BrokenProcessPool as e:
+                # worker 異常結束 (例如被 OOM killer 終止) 或無法啟動：之後改用 thread
+                self.failures += 1
+                logger.error(f"ImageWorkerPool: process pool is broken ({e}); falling back to threads.")
+                self._switch_to_threads()
+                self.thread_jobs += 1
+                return await asyncio.to_thread(_call_inline, func, data, args)
+            if kind == 'shm':
+                return bytes(output_segment.buf[:value]), meta
+            return value, meta
+        finally:
+            for segment in segments:
+                segment.close()
+                try:
+                    segment.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def _switch_to_threads(self):
+        self.use_threads = True
+        executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    # --- 常用的工作 ---
+    async def decode_data_url(self, data_url):
+        """data URL -> (bytes, mime_type)；格式錯誤時回傳 (None, None)"""
+        if not isinstance(data_url, str) or not data_url.startswith('data:'):
+            return None, None
+        try:
+            encoded = data_url.encode('ascii')
+        except UnicodeEncodeError:
+            return None, None
+        # base64 解碼後的大小不會超過輸入的 3/4
+        try:
+            return await self.run(decode_data_url_job, encoded, output_capacity=len(encoded) * 3 // 4 + 3)
+        except ValueError as e:
+            logger.error(f"ImageWorkerPool: invalid data URL: {e}")
+            return None, None
+
+    async def encode_data_url(self, image_bytes, mime_type="image/png"):
+        """bytes -> data URL 字串"""
+        capacity = len('data:;base64,') + len(mime_type) + (len(image_bytes) + 2) // 3 * 4
+        encoded, _ = await self.run(encode_data_url_job, image_bytes, mime_type, output_capacity=capacity)
+        return encoded.decode('ascii')
+
+    def shutdown(self):
+        executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return {
+            'processes': 0 if self.use_threads else self.processes,
+            'jobs': self.jobs,
+            'shared_memory_jobs': self.shared_memory_jobs,
+            'thread_jobs': self.thread_jobs,
+            'failures': self.failures,
+        }
+
+
+# --- worker 端 ---
+def _warm_up():
+    # 預先匯入 PIL，避免第一個工作承擔匯入時間 (只做 base64 工作時 PIL 不是必要的)
+    try:
+        import PIL.Image  # noqa: F401
+    except ImportError:
+        pass
+
+
+def _call_inline(func, data, args):
+    result, meta = func(data, *args)
+    return bytes(result), meta
+
+
+def _call(func, input_ref, output_ref, args):
+    segment = view = None
+    try:
+        if input_ref[0] == 'shm':
+            _, name, size = input_ref
+            segment = shared_memory.SharedMemory(name=name)
+            view = segment.buf[:size]
+            result, meta = func(view, *args)
+        else:
+            result, meta = func(input_ref[1], *args)
+        return _store(result, output_ref), meta
+    finally:
+        if view is not None:
+            view.release()
+        if segment is not None:
+            try:
+                segment.close()
+            except BufferError:
+                # 例外的 traceback 仍引用區段內容；對應會在物件回收時釋放
+                pass
+
+
+def _store(result, output_ref):
+    if output_ref is not None and len(result) <= output_ref[2]:
+        segment = shared_memory.SharedMemory(name=output_ref[1])
+        try:
+            segment.buf[:len(result)] = result
+        finally:
+            segment.close()
+        return 'shm', len(result)
+    return 'bytes', bytes(result)
+
+
+def decode_data_url_job(data):
+    """data URL (ASCII bytes) -> (圖片 bytes, mime_type)"""
+    comma = bytes(data[:128]).find(b',')
+    if comma < 0:
+        raise ValueError("missing data URL header")
+    match = _DATA_URL_HEADER.match(bytes(data[:comma]))
+    if not match:
+        raise ValueError("unsupported data URL header")
+    # 共享記憶體的輸入是 memoryview，binascii 直接讀取，不需要先複製
+    return binascii.a2b_base64(data[comma + 1:]), match.group(1).decode('ascii')
+
+
+def encode_data_url_job(data, mime_type):
+    return b'data:' + mime_type.encode('ascii') + b';base64,' + binascii.b2a_base64(data, newline=False), None
+
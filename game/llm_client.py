@@ -1,13 +1,16 @@
-import io
 import re
 import os
+import time
 import base64
 import logging
 import asyncio
 import google.genai as genai
 
-from PIL import Image
 from dotenv import load_dotenv
+from .translation_cache import TranslationCache
+from .api_key_pool import APIKeyPool
+from . import metrics
+from . import tracing
 # from googletrans import Translator
 
 load_dotenv()
@@ -44,7 +47,6 @@ def data_url_to_image_bytes(data_url):
 class LLMClient:
     def __init__(self):
         # Load environment variables from .env file
-        self.current_api_key_index = 0
         self.api_key_list = self._init_api_key()
         if not self.api_key_list or len(self.api_key_list) == 0:
             raise ValueError("API_KEY_X environment variable not set.")
@@ -71,22 +73,97 @@ class LLMClient:
             {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
         ]
 
+        # Cache translations; the same prompts pass through translate_to_english repeatedly
+        self.translation_cache = TranslationCache(
+            max_entries=int(os.getenv("TRANSLATION_CACHE_SIZE", 1024)),
+            ttl=int(os.getenv("TRANSLATION_CACHE_TTL", 7 * 24 * 3600)),
+            sqlite_path=os.getenv("TRANSLATION_CACHE_PATH"),
+        )
+
         # Initialize the client
         self._init_client()
     
     def _init_api_key(self, max_key_number: int = 5):
         key_list = []
-        for i in range(max_key_number):
+        # API_KEY0 is accepted for backward compatibility; .env.example numbers keys from 1
+        for i in range(max_key_number + 1):
             key = os.getenv(f"API_KEY{i}")
             if key:
                 key_list.append(key)
         return key_list
 
     def _init_client(self):
-        api_key = self.api_key_list[self.current_api_key_index]
-        self.client = genai.Client(api_key=api_key)
+        # One client per key; calls are spread across keys with per-key rate limits
+        self.key_pool = APIKeyPool(
+            self.api_key_list,
+            client_factory=lambda api_key: genai.Client(api_key=api_key),
+            requests_per_minute=float(os.getenv("API_KEY_RPM", 15)),
+            max_concurrency=int(os.getenv("API_KEY_MAX_CONCURRENCY", 4)),
+        )
+        # Give up quickly when every key is busy or benched so callers can fall back to the local provider
+        self.key_acquire_timeout = float(os.getenv("API_KEY_ACQUIRE_TIMEOUT", 5))
 
-    def translate_to_english(self, text, model_name="gemini-1.5-flash"):
+    def _generate_content(self, request, method):
+        """Runs generate_content on a pooled key, failing over on quota/5xx errors."""
+        with metrics.llm_request_duration.time(method=method, model=request['model']), \
+                tracing.span(f'llm.{method}', model=request['model']):
+            try:
+                return self._generate_content_with_failover(request)
+            except Exception:
+                metrics.llm_request_errors.inc(method=method, model=request['model'])
+                raise
+
+    def _generate_content_with_failover(self, request):
+        last_error = None
+        for _ in range(len(self.key_pool)):
+            api_key = self.key_pool.acquire_sync(timeout=self.key_acquire_timeout)
+            try:
+                response = api_key.client.models.generate_content(**request)
+            except Exception as e:
+                self.key_pool.release(api_key, e)
+                if not self.key_pool.is_failover_error(e):
+                    raise
+                last_error = e
+                continue
+            self.key_pool.release(api_key)
+            return response
+        raise last_error
+
+    async def _agenerate_content(self, request, method):
+        """Async counterpart of _generate_content on the SDK's aio client."""
+        start = time.perf_counter()
+        try:
+            with tracing.span(f'llm.{method}', model=request['model']):
+                return await self._agenerate_content_with_failover(request)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            metrics.llm_request_errors.inc(method=method, model=request['model'])
+            raise
+        finally:
+            metrics.llm_request_duration.observe(time.perf_counter() - start, method=method, model=request['model'])
+
+    async def _agenerate_content_with_failover(self, request):
+        last_error = None
+        for _ in range(len(self.key_pool)):
+            api_key = await self.key_pool.acquire(timeout=self.key_acquire_timeout)
+            try:
+                response = await api_key.client.aio.models.generate_content(**request)
+            except asyncio.CancelledError:
+                self.key_pool.release(api_key)
+                raise
+            except Exception as e:
+                self.key_pool.release(api_key, e)
+                if not self.key_pool.is_failover_error(e):
+                    raise
+                last_error = e
+                continue
+            self.key_pool.release(api_key)
+            return response
+        raise last_error
+
+    # --- Request builders (shared by the sync facade and the async API) ---
+    def _translate_request(self, text, model_name):
         config = genai.types.GenerateContentConfig(
             system_instruction=(
                 "You're a professional translator. Your task is to translate the given text into English.\n"
@@ -96,18 +173,17 @@ class LLMClient:
             temperature=0.2,
             max_output_tokens=24,
         )
-        response = self.client.models.generate_content(
+        return dict(
             model=model_name,
             config=config,
             contents="Please translate the following text into English:\n" + text
         )
-        return response.text
     # def translate_to_english(self, text):
     #     translator = Translator()
     #     translated = translator.translate(text, dest='en')
     #     return translated.text
 
-    def generate_text_from_text(self, prompt_text="請產生一個創意繪畫題目", model_name="gemini-2.0-flash"):
+    def _text_from_text_request(self, prompt_text, model_name):
         config = genai.types.GenerateContentConfig(
             system_instruction=(
                 "你是一位創意繪畫題目的設計師，擅長結合物品、想像力、卡通概念，發想出具有趣味、畫面感的主題。\n"
@@ -119,7 +195,7 @@ class LLMClient:
             top_k=40,
             max_output_tokens=24,
         )
-        response = self.client.models.generate_content(
+        return dict(
             model=model_name,
             config=config,
             contents=(
@@ -146,13 +222,10 @@ class LLMClient:
                 "Your prompt:"
             )
         )
-        return response.text
 
-    def generate_image_bytes_from_text(self, text, model_name="gemini-2.0-flash-preview-image-generation"):
+    def _image_from_text_request(self, translated_text, model_name):
         # prompt_text = self.text2img_prompt.replace("{text_description}", text)
-        text = self.translate_to_english(text)
-        print("Translated text:", text)
-        response = self.client.models.generate_content(
+        return dict(
             model=model_name,
             contents=(
                 "You are an AI drawing robot, specializing in creating images based on user descriptions.\n"
@@ -162,21 +235,15 @@ class LLMClient:
                 "Here you will receive a description of an image. Your task is to create an image based on this description. \n"
                 "The prompt will be written in Chinese, and you should first convert it to English, then draw the image by the English prompt.\n"
                 "Please draw an image based on the following description, in a simple, cute style, like a child drew it with MS Paint:"
-                f"{text}"
+                f"{translated_text}"
             ),
             config=genai.types.GenerateContentConfig(
                 safety_settings=self.safety_settings,
                 response_modalities=['TEXT', 'IMAGE'],
             )
         )
-        image_bytes = None
-        for part in response.candidates[0].content.parts:
-            if part.inline_data is not None:
-                image_bytes = part.inline_data.data
-        return image_bytes
 
-    def generate_text_from_image_bytes(self, image_bytes, prompt_text=None, mime_type="image/png", model_name="gemini-2.0-flash"):
-        """Generates text from a given image (bytes) and text prompt."""
+    def _text_from_image_request(self, image_bytes, mime_type, model_name):
         image_part = genai.types.Part.from_bytes(
             data=image_bytes,
             mime_type=mime_type,
@@ -188,7 +255,7 @@ class LLMClient:
             top_k=40,
             max_output_tokens=24,
         )
-        response = self.client.models.generate_content(
+        return dict(
             model=model_name,
             config=config,
             contents=[
@@ -204,23 +271,86 @@ class LLMClient:
                 image_part,
             ]
         )
-        return response.text
 
-    def generate_image_from_image(self, image_bytes, prompt_text=None, mime_type="image/png", model_name="gemini-2.0-flash-preview-image-generation"):
-        image = Image.open(io.BytesIO(image_bytes))
-
-        translated_text = self.translate_to_english(prompt_text)
+    def _image_from_image_request(self, image_bytes, mime_type, translated_text, model_name):
+        # Send the original bytes; a PIL Image would be decoded and re-encoded by the SDK on the caller's thread
+        image_part = genai.types.Part.from_bytes(data=image_bytes, mime_type=mime_type)
         processed_text = f"{translated_text}. Keep the same minimal line doodle style."
-        response = self.client.models.generate_content(
+        return dict(
             model=model_name,
-            contents=[image, processed_text],
+            contents=[image_part, processed_text],
             config=genai.types.GenerateContentConfig(
             response_modalities=['TEXT', 'IMAGE']
             )
         )
 
+    @staticmethod
+    def _extract_image_bytes(response):
         image_bytes = None
         for part in response.candidates[0].content.parts:
             if part.inline_data is not None:
                 image_bytes = part.inline_data.data
-        return image_bytes
\ No newline at end of file
+        return image_bytes
+
+    # --- Async API (runs on the event loop via the SDK's aio client) ---
+    async def atranslate_to_english(self, text, model_name="gemini-1.5-flash"):
+        with tracing.span('translate_to_english') as span:
+            cached = await self.translation_cache.aget(text)
+            span.set(cached=cached is not None)
+            if cached is not None:
+                return cached
+            start = time.monotonic()
+            response = await self._agenerate_content(self._translate_request(text, model_name), 'translate')
+            await self.translation_cache.aput(text, response.text, time.monotonic() - start)
+            return response.text
+
+    async def agenerate_text_from_text(self, prompt_text="請產生一個創意繪畫題目", model_name="gemini-2.0-flash"):
+        response = await self._agenerate_content(self._text_from_text_request(prompt_text, model_name), 'text_from_text')
+        return response.text
+
+    async def agenerate_image_bytes_from_text(self, text, model_name="gemini-2.0-flash-preview-image-generation"):
+        text = await self.atranslate_to_english(text)
+        response = await self._agenerate_content(self._image_from_text_request(text, model_name), 'image_from_text')
+        return self._extract_image_bytes(response)
+
+    async def agenerate_text_from_image_bytes(self, image_bytes, prompt_text=None, mime_type="image/png", model_name="gemini-2.0-flash"):
+        """Generates text from a given image (bytes) and text prompt."""
+        response = await self._agenerate_content(self._text_from_image_request(image_bytes, mime_type, model_name), 'text_from_image')
+        return response.text
+
+    async def agenerate_image_from_image(self, image_bytes, prompt_text=None, mime_type="image/png", model_name="gemini-2.0-flash-preview-image-generation"):
+        translated_text = await self.atranslate_to_english(prompt_text)
+        response = await self._agenerate_content(self._image_from_image_request(image_bytes, mime_type, translated_text, model_name), 'image_from_image')
+        return self._extract_image_bytes(response)
+
+    # --- Sync facade (kept for existing callers and scripts) ---
+    def translate_to_english(self, text, model_name="gemini-1.5-flash"):
+        with tracing.span('translate_to_english') as span:
+            cached = self.translation_cache.get(text)
+            span.set(cached=cached is not None)
+            if cached is not None:
+                return cached
+            start = time.monotonic()
+            response = self._generate_content(self._translate_request(text, model_name), 'translate')
+            self.translation_cache.put(text, response.text, time.monotonic() - start)
+            return response.text
+
+    def generate_text_from_text(self, prompt_text="請產生一個創意繪畫題目", model_name="gemini-2.0-flash"):
+        response = self._generate_content(self._text_from_text_request(prompt_text, model_name), 'text_from_text')
+        return response.text
+
+    def generate_image_bytes_from_text(self, text, model_name="gemini-2.0-flash-preview-image-generation"):
+        text = self.translate_to_english(text)
+        logger.debug(f"Translated text: {text}")
+        response = self._generate_content(self._image_from_text_request(text, model_name), 'image_from_text')
+        return self._extract_image_bytes(response)
+
+    def generate_text_from_image_bytes(self, image_bytes, prompt_text=None, mime_type="image/png", model_name="gemini-2.0-flash"):
+        """Generates text from a given image (bytes) and text prompt."""
+        response = self._generate_content(self._text_from_image_request(image_bytes, mime_type, model_name), 'text_from_image')
+        return response.text
+
+    def generate_image_from_image(self, image_bytes, prompt_text=None, mime_type="image/png", model_name="gemini-2.0-flash-preview-image-generation"):
+        translated_text = self.translate_to_english(prompt_text)
+        response = self._generate_content(self._image_from_image_request(image_bytes, mime_type, translated_text, model_name), 'image_from_image')
+        return self._extract_image_bytes(response)
@@ -0,0 +1,398 @@
+import io
+import math
+import asyncio
+import hashlib
+import logging
+import random
+from collections import Counter, defaultdict, deque
+
+from PIL import Image, ImageDraw
+
+logger = logging.getLogger(__name__)
+
+# Call types a provider can be selected for (globally, per room, or per call type)
+CALL_TYPES = ('prompt', 'draw', 'guess', 'assist')
+
+
+class LLMProvider:
+    """
+    Interface behind the bot/AI-assist generate_* calls.
+    All methods are coroutines; implementations must not block the event loop.
+    """
+    name = None
+
+    async def generate_text_from_text(self):
+        raise NotImplementedError
+
+    async def generate_image_bytes_from_text(self, text):
+        raise NotImplementedError
+
+    async def generate_text_from_image_bytes(self, image_bytes, mime_type="image/png"):
+        raise NotImplementedError
+
+    async def generate_image_from_image(self, image_bytes, prompt_text, mime_type="image/png"):
+        raise NotImplementedError
+
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini through LLMClient's async API."""
+    name = 'gemini'
+
+    def __init__(self, llm_client):
+        self.llm_client = llm_client
+
+    async def generate_text_from_text(self):
+        return await self.llm_client.agenerate_text_from_text()
+
+    async def generate_image_bytes_from_text(self, text):
+        return await self.llm_client.agenerate_image_bytes_from_text(text)
+
+    async def generate_text_from_image_bytes(self, image_bytes, mime_type="image/png"):
+        return await self.llm_client.agenerate_text_from_image_bytes(image_bytes, mime_type=mime_type)
+
+    async def generate_image_from_image(self, image_bytes, prompt_text, mime_type="image/png"):
+        return await self.llm_client.agenerate_image_from_image(image_bytes, prompt_text=prompt_text, mime_type=mime_type)
+
+
+# --- Local (CPU-only) provider ---
+
+PROMPT_SUBJECTS = [
+    "老奶奶", "機器人", "外送員", "小學生", "恐龍寶寶", "消防員", "魔術師", "廚師",
+    "長頸鹿", "雪人", "海盜", "太空人", "企鵝", "工程師", "忍者", "烏龜",
+]
+PROMPT_PLACES = [
+    "在辦公室", "在廚房", "在操場", "在海底", "在雲上", "在夜市", "在圖書館", "在沙漠",
+    "在電梯裡", "在屋頂", "在火車上", "在游泳池", "在夢裡", "在超市",
+]
+PROMPT_ACTIONS = [
+    "打瞌睡", "煮拉麵", "跳街舞", "放風箏", "修電腦", "踢足球", "彈鋼琴", "洗衣服",
+    "釣魚", "開會", "畫畫", "吃西瓜", "騎腳踏車", "拍照",
+]
+PROMPT_ADJECTIVES = ["超大的", "會飛的", "生氣的", "透明的", "害羞的", "發光的", "迷你的", "倒立的"]
+PROMPT_OBJECTS = ["冰箱", "雨傘", "電視機", "紙飛機", "鬧鐘", "蛋糕", "腳踏車", "吉他", "茶壺", "沙發"]
+PROMPT_TEMPLATES = [
+    "{subject}{place}{action}",
+    "{adjective}{object}",
+    "{subject}和{object}{place}",
+    "{adjective}{subject}{action}",
+]
+
+GUESS_NOUNS = [
+    "房子", "貓咪", "太陽", "一棵樹", "小船", "機器人", "花朵", "汽車", "星星", "雲朵",
+    "魚", "怪獸", "蛋糕", "山", "火箭",
+]
+# (name, RGB) used to describe the dominant color of a drawing
+NAMED_COLORS = [
+    ("紅色", (220, 50, 50)), ("橘色", (240, 150, 40)), ("黃色", (240, 220, 60)),
+    ("綠色", (60, 170, 80)), ("藍色", (60, 110, 220)), ("紫色", (150, 80, 200)),
+    ("粉紅色", (240, 150, 190)), ("咖啡色", (130, 90, 50)), ("黑色", (30, 30, 30)),
+    ("灰色", (140, 140, 140)),
+]
+PALETTE = [color for _, color in NAMED_COLORS[:8]]
+
+
+class NGramPromptModel:
+    """
+    Character bigram model over known prompts, used to mix in novel-sounding prompts.
+    The seed corpus is kept for good; learned prompts live in a bounded window
+    (max_learned), and the oldest one's transitions are removed when it falls out.
+    """
+
+    def __init__(self, corpus=(), max_learned=500):
+        self.transitions = defaultdict(Counter)  # char -> Counter(next char)
+        self.learned = deque()
+        self.max_learned = max_learned
+        for text in corpus:
+            self._add(text, 1)
+
+    @staticmethod
+    def _pairs(text):
+        chars = ['^'] + list(text) + ['$']
+        return zip(chars, chars[1:])
+
+    def _add(self, text, amount):
+        text = (text or '').strip()
+        if len(text) < 2:
+            return False
+        for current, following in self._pairs(text):
+            counts = self.transitions[current]
+            counts[following] += amount
+            if counts[following] <= 0:
+                del counts[following]
+                if not counts:
+                    del self.transitions[current]
+        return True
+
+    def learn(self, text):
+        if not self._add(text, 1):
+            return
+        self.learned.append(text.strip())
+        while len(self.learned) > self.max_learned:
+            self._add(self.learned.popleft(), -1)
+
+    def generate(self, rng, min_length=4, max_length=14):
+        if not self.transitions:
+            return None
+        chars = []
+        current = '^'
+        while len(chars) < max_length:
+            following = self.transitions.get(current)
+            if not following:
+                break
+            current = rng.choices(list(following), weights=list(following.values()))[0]
+            if current == '$':
+                if len(chars) >= min_length:
+                    break
+                current = chars[-1] if chars else '^'
+                continue
+            chars.append(current)
+        text = ''.join(chars)
+        return text if len(text) >= min_length else None
+
+
+def _seeded_rng(*parts):
+    digest = hashlib.sha256('|'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+    return random.Random(int(digest[:16], 16))
+
+
+def _wobbly_line(draw, points, rng, fill, width):
+    """Draws a polyline with small jitter so shapes look hand drawn."""
+    jittered = [(x + rng.uniform(-2, 2), y + rng.uniform(-2, 2)) for x, y in points]
+    draw.line(jittered, fill=fill, width=width, joint='curve')
+
+
+def _motif_sun(draw, cx, cy, s, rng, color):
+    r = 28 * s
+    draw.ellipse([cx - r, cy - r, cx + r, cy + r], fill=(250, 210, 60), outline=(30, 30, 30), width=3)
+    for i in range(8):
+        angle = i * math.pi / 4
+        _wobbly_line(draw, [(cx + math.cos(angle) * r * 1.3, cy + math.sin(angle) * r * 1.3),
+                            (cx + math.cos(angle) * r * 1.8, cy + math.sin(angle) * r * 1.8)], rng, (30, 30, 30), 3)
+
+
+def _motif_house(draw, cx, cy, s, rng, color):
+    w, h = 70 * s, 55 * s
+    draw.rectangle([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], fill=color, outline=(30, 30, 30), width=3)
+    draw.polygon([(cx - w / 2 - 8, cy - h / 2), (cx, cy - h), (cx + w / 2 + 8, cy - h / 2)], fill=(200, 70, 60), outline=(30, 30, 30))
+    draw.rectangle([cx - 10 * s, cy, cx + 10 * s, cy + h / 2], fill=(130, 90, 50), outline=(30, 30, 30), width=2)
+
+
+def _motif_tree(draw, cx, cy, s, rng, color):
+    draw.rectangle([cx - 8 * s, cy, cx + 8 * s, cy + 50 * s], fill=(130, 90, 50), outline=(30, 30, 30), width=2)
+    r = 35 * s
+    draw.ellipse([cx - r, cy - r * 1.6, cx + r, cy + r * 0.2], fill=(60, 170, 80), outline=(30, 30, 30), width=3)
+
+
+def _motif_cat(draw, cx, cy, s, rng, color):
+    r = 30 * s
+    draw.polygon([(cx - r, cy - r * 0.4), (cx - r * 0.7, cy - r * 1.3), (cx - r * 0.2, cy - r * 0.8)], fill=color, outline=(30, 30, 30))
+    draw.polygon([(cx + r, cy - r * 0.4), (cx + r * 0.7, cy - r * 1.3), (cx + r * 0.2, cy - r * 0.8)], fill=color, outline=(30, 30, 30))
+    draw.ellipse([cx - r, cy - r, cx + r, cy + r], fill=color, outline=(30, 30, 30), width=3)
+    for dx in (-0.4, 0.4):
+        draw.ellipse([cx + dx * r - 4, cy - 8, cx + dx * r + 4, cy], fill=(30, 30, 30))
+    for dy in (-3, 3):
+        _wobbly_line(draw, [(cx - r * 0.3, cy + 8 + dy), (cx - r * 1.2, cy + 4 + dy * 2)], rng, (30, 30, 30), 2)
+        _wobbly_line(draw, [(cx + r * 0.3, cy + 8 + dy), (cx + r * 1.2, cy + 4 + dy * 2)], rng, (30, 30, 30), 2)
+
+
+def _motif_fish(draw, cx, cy, s, rng, color):
+    w, h = 45 * s, 22 * s
+    draw.ellipse([cx - w, cy - h, cx + w * 0.6, cy + h], fill=color, outline=(30, 30, 30), width=3)
+    draw.polygon([(cx + w * 0.5, cy), (cx + w * 1.1, cy - h), (cx + w * 1.1, cy + h)], fill=color, outline=(30, 30, 30))
+    draw.ellipse([cx - w * 0.6 - 4, cy - 6, cx - w * 0.6 + 4, cy + 2], fill=(30, 30, 30))
+
+
+def _motif_car(draw, cx, cy, s, rng, color):
+    w, h = 80 * s, 25 * s
+    draw.rectangle([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], fill=color, outline=(30, 30, 30), width=3)
+    draw.polygon([(cx - w / 4, cy - h / 2), (cx - w / 8, cy - h * 1.3), (cx + w / 4, cy - h * 1.3), (cx + w / 3, cy - h / 2)], fill=(180, 220, 240), outline=(30, 30, 30))
+    for dx in (-w / 3, w / 3):
+        draw.ellipse([cx + dx - 10 * s, cy + h / 2 - 10 * s, cx + dx + 10 * s, cy + h / 2 + 10 * s], fill=(30, 30, 30))
+
+
+def _motif_person(draw, cx, cy, s, rng, color):
+    r = 14 * s
+    draw.ellipse([cx - r, cy - 50 * s - r, cx + r, cy - 50 * s + r], fill=(250, 220, 190), outline=(30, 30, 30), width=3)
+    _wobbly_line(draw, [(cx, cy - 50 * s + r), (cx, cy)], rng, color, 4)
+    _wobbly_line(draw, [(cx - 25 * s, cy - 30 * s), (cx, cy - 25 * s), (cx + 25 * s, cy - 35 * s)], rng, color, 4)
+    _wobbly_line(draw, [(cx - 18 * s, cy + 35 * s), (cx, cy), (cx + 18 * s, cy + 35 * s)], rng, color, 4)
+
+
+def _motif_star(draw, cx, cy, s, rng, color):
+    points = []
+    for i in range(10):
+        r = (30 if i % 2 == 0 else 12) * s
+        angle = -math.pi / 2 + i * math.pi / 5
+        points.append((cx + math.cos(angle) * r, cy + math.sin(angle) * r))
+    draw.polygon(points, fill=(250, 210, 60), outline=(30, 30, 30))
+
+
+def _motif_cloud(draw, cx, cy, s, rng, color):
+    for dx, dy, r in ((-25, 5, 20), (0, -8, 26), (25, 5, 20)):
+        draw.ellipse([cx + dx * s - r * s, cy + dy * s - r * s, cx + dx * s + r * s, cy + dy * s + r * s],
+                     fill=(235, 240, 250), outline=(120, 120, 140), width=2)
+
+
+def _motif_flower(draw, cx, cy, s, rng, color):
+    _wobbly_line(draw, [(cx, cy), (cx, cy + 50 * s)], rng, (60, 170, 80), 4)
+    for dx, dy in ((-12, 0), (12, 0), (0, -12), (0, 12)):
+        r = 10 * s
+        draw.ellipse([cx + dx * s - r, cy + dy * s - r, cx + dx * s + r, cy + dy * s + r], fill=color, outline=(30, 30, 30))
+    draw.ellipse([cx - 6 * s, cy - 6 * s, cx + 6 * s, cy + 6 * s], fill=(250, 210, 60))
+
+
+def _motif_robot(draw, cx, cy, s, rng, color):
+    draw.rectangle([cx - 20 * s, cy - 60 * s, cx + 20 * s, cy - 30 * s], fill=(170, 170, 180), outline=(30, 30, 30), width=3)
+    draw.rectangle([cx - 28 * s, cy - 28 * s, cx + 28 * s, cy + 20 * s], fill=color, outline=(30, 30, 30), width=3)
+    for dx in (-8, 8):
+        draw.ellipse([cx + dx * s - 4, cy - 50 * s - 4, cx + dx * s + 4, cy - 50 * s + 4], fill=(220, 50, 50))
+    _wobbly_line(draw, [(cx, cy - 60 * s), (cx, cy - 72 * s)], rng, (30, 30, 30), 3)
+
+
+def _motif_boat(draw, cx, cy, s, rng, color):
+    draw.polygon([(cx - 45 * s, cy), (cx + 45 * s, cy), (cx + 30 * s, cy + 20 * s), (cx - 30 * s, cy + 20 * s)], fill=color, outline=(30, 30, 30))
+    _wobbly_line(draw, [(cx, cy), (cx, cy - 50 * s)], rng, (30, 30, 30), 3)
+    draw.polygon([(cx + 2, cy - 48 * s), (cx + 30 * s, cy - 10 * s), (cx + 2, cy - 10 * s)], fill=(245, 245, 245), outline=(30, 30, 30))
+
+
+MOTIFS = {
+    'sun': _motif_sun, 'house': _motif_house, 'tree': _motif_tree, 'cat': _motif_cat,
+    'fish': _motif_fish, 'car': _motif_car, 'person': _motif_person, 'star': _motif_star,
+    'cloud': _motif_cloud, 'flower': _motif_flower, 'robot': _motif_robot, 'boat': _motif_boat,
+}
+# Keywords (as they appear in Traditional Chinese prompts) -> motif
+KEYWORD_MOTIFS = [
+    ("太陽", 'sun'), ("房", 'house'), ("屋", 'house'), ("樹", 'tree'), ("森林", 'tree'),
+    ("貓", 'cat'), ("魚", 'fish'), ("鯨", 'fish'), ("車", 'car'), ("星", 'star'),
+    ("雲", 'cloud'), ("花", 'flower'), ("機器人", 'robot'), ("船", 'boat'), ("海", 'boat'),
+    ("人", 'person'), ("奶奶", 'person'), ("小明", 'person'), ("學生", 'person'),
+    ("師", 'person'), ("員", 'person'),
+]
+
+
+def draw_doodle(text, size=(400, 300)):
+    """Procedurally draws a simple, childlike doodle for the given prompt (PNG bytes)."""
+    rng = _seeded_rng('doodle', text)
+    width, height = size
+    image = Image.new('RGB', size, (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+
+    motif_names = []
+    for keyword, motif in KEYWORD_MOTIFS:
+        if keyword in (text or '') and motif not in motif_names:
+            motif_names.append(motif)
+    if not motif_names:
+        motif_names = rng.sample(sorted(MOTIFS), 2)
+    motif_names = motif_names[:3]
+
+    # Ground line and an optional sky element give every doodle a bit of context
+    _wobbly_line(draw, [(0, height * 0.8), (width * 0.5, height * 0.78), (width, height * 0.81)], rng, (90, 160, 90), 3)
+    if 'sun' not in motif_names and 'cloud' not in motif_names and rng.random() < 0.5:
+        rng.choice([_motif_sun, _motif_cloud])(draw, width * 0.85, height * 0.15, 0.7, rng, rng.choice(PALETTE))
+
+    slots = len(motif_names)
+    for i, motif in enumerate(motif_names):
+        cx = width * (i + 1) / (slots + 1) + rng.uniform(-15, 15)
+        cy = height * 0.55 + rng.uniform(-20, 20)
+        scale = rng.uniform(0.9, 1.3) if slots > 1 else 1.6
+        MOTIFS[motif](draw, cx, cy, scale, rng, rng.choice(PALETTE))
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def describe_image(image_bytes):
+    """Guesses a short description from a drawing's dominant color and coverage."""
+    rng = _seeded_rng('guess', hashlib.sha256(image_bytes).hexdigest())
+    image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+    image.thumbnail((32, 32))
+    pixels = [p for p in image.getdata() if sum(p) < 690]  # ignore (near-)white background
+    if not pixels:
+        return rng.choice(["一張白紙", "空白的畫布", "雪地裡的北極熊"])
+    average = tuple(sum(channel) / len(pixels) for channel in zip(*pixels))
+    color_name = min(NAMED_COLORS, key=lambda item: sum((a - b) ** 2 for a, b in zip(item[1], average)))[0]
+    coverage = len(pixels) / (image.width * image.height)
+    size_word = "巨大的" if coverage > 0.5 else ("小小的" if coverage < 0.1 else "")
+    return f"{size_word}{color_name}{rng.choice(GUESS_NOUNS)}"
+
+
+def overlay_doodle(image_bytes, prompt_text):
+    """Draws the prompt's doodle on top of an existing drawing (for AI assist)."""
+    base = Image.open(io.BytesIO(image_bytes)).convert('RGBA')
+    doodle = Image.open(io.BytesIO(draw_doodle(prompt_text, size=base.size))).convert('RGBA')
+    # Make the doodle's white background transparent so the original drawing shows through
+    doodle.putdata([(r, g, b, 0) if r > 245 and g > 245 and b > 245 else (r, g, b, 255) for r, g, b, _ in doodle.getdata()])
+    base.alpha_composite(doodle)
+    buffer = io.BytesIO()
+    base.convert('RGB').save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+class LocalProvider(LLMProvider):
+    """
+    CPU-only provider with no network access: template/n-gram prompts and guesses
+    and procedural Pillow doodles. Pillow work runs in a worker thread.
+    """
+    name = 'local'
+
+    def __init__(self, corpus=()):
+        self.rng = random.Random()
+        self.ngram = NGramPromptModel(corpus)
+
+    def learn(self, text):
+        """Feeds an LLM-generated prompt into the n-gram model (never player text: the model is shared by all rooms)."""
+        self.ngram.learn(text)
+
+    async def generate_text_from_text(self):
+        if self.rng.random() < 0.2:
+            prompt = self.ngram.generate(self.rng)
+            if prompt:
+                return prompt
+        return self.rng.choice(PROMPT_TEMPLATES).format(
+            subject=self.rng.choice(PROMPT_SUBJECTS),
+            place=self.rng.choice(PROMPT_PLACES),
+            action=self.rng.choice(PROMPT_ACTIONS),
+            adjective=self.rng.choice(PROMPT_ADJECTIVES),
+            object=self.rng.choice(PROMPT_OBJECTS),
+        )
+
+    async def generate_image_bytes_from_text(self, text):
+        return await asyncio.to_thread(draw_doodle, text)
+
+    async def generate_text_from_image_bytes(self, image_bytes, mime_type="image/png"):
+        return await asyncio.to_thread(describe_image, image_bytes)
+
+    async def generate_image_from_image(self, image_bytes, prompt_text, mime_type="image/png"):
+        return await asyncio.to_thread(overlay_doodle, image_bytes, prompt_text)
+
+
+class ProviderRegistry:
+    """
+    Resolves which provider serves a call. Precedence: the room's per-call-type
+    choice, the room's overall choice, the configured per-call-type default, the
+    configured default, and finally the local provider.
+    """
+
+    def __init__(self, default='gemini', per_call_type=None, fallback='local'):
+        self.providers = {}
+        self.default = default
+        self.per_call_type = dict(per_call_type or {})
+        self.fallback = fallback
+
+    def register(self, provider):
+        self.providers[provider.name] = provider
+
+    def get(self, name):
+        return self.providers.get(name)
+
+    def available(self):
+        return list(self.providers)
+
+    def resolve(self, call_type, room=None):
+        room_choices = (room or {}).get('llm_providers', {})
+        for name in (room_choices.get(call_type), room_choices.get('all'),
+                     self.per_call_type.get(call_type), self.default, self.fallback):
+            if name and name in self.providers:
+                return self.providers[name]
+        return None
@@ -0,0 +1,264 @@
+import time
+import bisect
+import threading
+
+# Prometheus text exposition format (0.0.4) 的最小實作，不依賴 prometheus_client。
+# 每次記錄只是在鎖內做一次字典查詢與加法，可以常駐在正式環境中。
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+
+
+class Counter(_Metric):
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def collect(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(_Metric):
+    """可直接 set / inc / dec；也可在每次輸出前以 set_all() 整組更新 (例如依狀態統計的房間數)"""
+    metric_type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.values = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_all(self, values):
+        """以 {label values tuple: value} 取代所有數值"""
+        with self.lock:
+            self.values = {tuple(str(part) for part in key): value for key, value in values.items()}
+
+    def collect(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Histogram(_Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}  # {label values: [bucket counts..., sum, count]}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, **labels):
+        """with metric.time(label=...): 記錄區塊的執行時間"""
+        return _Timer(self, labels)
+
+    def collect(self):
+        with self.lock:
+            series_items = sorted((key, list(series)) for key, series in self.series.items())
+        lines = []
+        for key, series in series_items:
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(float(upper_bound)))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, [('le', '+Inf')])
+            lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []  # 輸出前執行的 async 函式 (更新 gauge)
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    async def collect(self):
+        for collector in self.collectors:
+            await collector()
+        return self.render()
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# --- LLM ---
+llm_request_duration = registry.histogram(
+    'gartic_llm_request_duration_seconds', 'LLM API call latency by method and model.',
+    ('method', 'model'), buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60),
+)
+llm_request_errors = registry.counter(
+    'gartic_llm_request_errors_total', 'LLM API calls that raised an error.', ('method', 'model'),
+)
+bot_fallbacks = registry.counter(
+    'gartic_bot_fallbacks_total', 'Predefined content used instead of an LLM result (placeholder drawing or phrase).',
+    ('kind', 'reason'),
+)
+llm_provider_fallbacks = registry.counter(
+    'gartic_llm_provider_fallbacks_total', 'Bot calls answered by the local provider after the room provider failed.',
+    ('call_type',),
+)
+# API key 以設定中的順序編號 (key_index) 標示，不輸出 key 本身
+llm_key_requests = registry.counter(
+    'gartic_llm_key_requests_total', 'LLM API calls started on each API key.', ('key_index',),
+)
+llm_key_errors = registry.counter(
+    'gartic_llm_key_errors_total', 'LLM API calls that failed on each API key.', ('key_index',),
+)
+llm_key_benches = registry.counter(
+    'gartic_llm_key_benches_total', 'Times an API key was benched after a quota or server error.', ('key_index',),
+)
+llm_key_in_flight = registry.gauge(
+    'gartic_llm_key_in_flight', 'LLM API calls currently running on each API key.', ('key_index',),
+)
+
+# --- 房間與連線 ---
+rooms = registry.gauge('gartic_rooms', 'Rooms held in the room stores by store and state.', ('store', 'state'))
+websocket_connections = registry.gauge(
+    'gartic_websocket_connections', 'Open WebSocket connections in this process.', ('consumer',),
+)
+websocket_messages = registry.counter(
+    'gartic_websocket_messages_total', 'WebSocket messages by direction and message type.', ('direction', 'type'),
+)
+websocket_bytes = registry.counter(
+    'gartic_websocket_bytes_total', 'WebSocket payload bytes by direction and message type.', ('direction', 'type'),
+)
+
+# --- 機器人題目池 ---
+prompt_pool_depth = registry.gauge('gartic_prompt_pool_depth', 'Pre-generated bot prompts waiting in the pool.')
+prompt_pool_requests = registry.counter(
+    'gartic_prompt_pool_requests_total', 'Bot prompt requests served from the pool (hit) or not (miss).', ('result',),
+)
+
+# --- 畫作正規化 ---
+image_ingest_bytes_saved = registry.counter(
+    'gartic_image_ingest_bytes_saved_total', 'Bytes removed from submitted drawings by normalization.',
+)
+image_ingest_rejected = registry.counter(
+    'gartic_image_ingest_rejected_total', 'Submitted drawings rejected by normalization.',
+)
+
+# --- 翻譯快取 ---
+translation_cache_lookups = registry.counter(
+    'gartic_translation_cache_lookups_total', 'translate_to_english cache lookups by result.', ('result',),
+)
+translation_cache_saved_seconds = registry.counter(
+    'gartic_translation_cache_saved_seconds_total',
+    'Estimated translation latency avoided by cache hits (hits x average uncached latency).',
+)
+
+# --- 遊戲流程 ---
+op_transition_duration = registry.histogram(
+    'gartic_op_transition_duration_seconds',
+    'Time from start_next_operation until the next operation is assigned (excluding bot work).',
+    ('state',),
+)
+
+
+def record_message(direction, message_type, size):
+    websocket_messages.inc(direction=direction, type=message_type)
+    websocket_bytes.inc(size, direction=direction, type=message_type)
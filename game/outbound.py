@@ -0,0 +1,82 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class OutboundScheduler:
+    """
+    每個房間的廣播合併排程。
+
+    schedule() 在 window 秒內對同一個房間的多次呼叫只會觸發一次 flush，並使用最後一次的值
+    (例如多個機器人幾乎同時完成時，只送出一則狀態差異)。
+    需要維持順序的訊息 (任務指派、game_over) 在送出前應先呼叫 flush()，
+    讓尚未送出的狀態在它們之前送達。同一個房間的 flush 不會並行執行。
+    window <= 0 時不合併，schedule() 會立即 flush。
+    """
+
+    def __init__(self, window=0.05):
+        self.window = window
+        self.pending = {}  # {key: (value, flush_callback)}
+        self.timers = {}   # {key: asyncio.Task}
+        self.locks = {}    # {key: asyncio.Lock}
+
+        self.scheduled = 0
+        self.coalesced = 0
+        self.flushed = 0
+
+    def _lock(self, key):
+        lock = self.locks.get(key)
+        if lock is None:
+            lock = self.locks[key] = asyncio.Lock()
+        return lock
+
+    async def schedule(self, key, value, flush):
+        """登記一次廣播；flush 是 async callable，會以最後登記的 value 呼叫"""
+        self.scheduled += 1
+        if key in self.pending:
+            self.coalesced += 1
+        self.pending[key] = (value, flush)
+        if self.window <= 0:
+            await self.flush(key)
+        elif key not in self.timers:
+            self.timers[key] = asyncio.create_task(self._flush_later(key))
+
+    async def _flush_later(self, key):
+        await asyncio.sleep(self.window)
+        # 從這裡開始計時器不再能被取消，flush 一定會執行完
+        self.timers.pop(key, None)
+        try:
+            await self.flush(key)
+        except Exception as e:
+            logger.error(f"OutboundScheduler: flush for {key} failed: {e}", exc_info=True)
+
+    async def flush(self, key):
+        """立即送出尚未送出的廣播 (若有)，並等待進行中的 flush 完成"""
+        timer = self.timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        async with self._lock(key):
+            entry = self.pending.pop(key, None)
+            if entry is None:
+                return
+            value, flush = entry
+            self.flushed += 1
+            await flush(value)
+
+    def discard(self, key):
+        """房間刪除時丟棄尚未送出的廣播"""
+        timer = self.timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        self.pending.pop(key, None)
+        self.locks.pop(key, None)
+
+    def stats(self):
+        return {
+            'window': self.window,
+            'pending': len(self.pending),
+            'scheduled': self.scheduled,
+            'coalesced': self.coalesced,
+            'flushed': self.flushed,
+        }
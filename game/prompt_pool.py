@@ -0,0 +1,193 @@
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# 正規化題目時移除的字元 (空白與常見標點)
+_NORMALIZE_PATTERN = re.compile(r'[\s,，。.!！?？、"\'「」『』]+')
+
+
+def normalize_prompt(text):
+    """題目去重用的正規化：移除空白與標點並轉小寫"""
+    return _NORMALIZE_PATTERN.sub('', text or '').casefold()
+
+
+class PromptPool:
+    """
+    預先產生的機器人題目池。
+    背景的補充工作會維持池中有一定數量、不重複的題目，機器人出題時可以直接取用，
+    池子空了才需要即時呼叫 LLM。可選擇將池子內容存到磁碟，重啟後仍可使用。
+    每個題目記錄產生時間，超過 max_age 秒的題目在載入與取用時丟棄，避免一直給出舊的題目。
+    """
+
+    def __init__(self, generate, capacity=32, low_watermark=8, refill_concurrency=2,
+                 recent_size=256, persist_path=None, max_age=3 * 24 * 3600):
+        self.generate = generate  # async () -> str
+        self.capacity = capacity
+        self.low_watermark = low_watermark
+        self.refill_concurrency = refill_concurrency
+        self.persist_path = persist_path
+        self.max_age = max_age
+
+        self.prompts = deque()  # (題目, 產生時間 (UNIX 時間))
+        # 最近出現過的題目 (包含已被取用的)，用於去重
+        self.recent = deque(maxlen=recent_size)
+        self.recent_keys = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.duplicates = 0
+        self.expired = 0
+        self.errors = 0
+
+        self._refill_task = None
+        self._refill_needed = None
+        self._load()
+
+    # --- 取用 ---
+    def take(self):
+        """取出一個題目；池子為空時回傳 None (呼叫端應改為即時產生)"""
+        self.ensure_started()
+        self._drop_expired()
+        if self.prompts:
+            prompt, _ = self.prompts.popleft()
+            self.hits += 1
+            metrics.prompt_pool_requests.inc(result='hit')
+        else:
+            prompt = None
+            self.misses += 1
+            metrics.prompt_pool_requests.inc(result='miss')
+        metrics.prompt_pool_depth.set(len(self.prompts))
+        if len(self.prompts) <= self.low_watermark and self._refill_needed is not None:
+            self._refill_needed.set()
+        return prompt
+
+    def add(self, prompt, created_at=None):
+        """加入題目，重複 (與池中或最近出現過的題目相同) 時回傳 False"""
+        prompt = (prompt or '').strip().strip('，,。"「」')
+        key = normalize_prompt(prompt)
+        if not key or key in self.recent_keys:
+            self.duplicates += 1
+            return False
+        self.remember(prompt)
+        self.prompts.append((prompt, time.time() if created_at is None else created_at))
+        metrics.prompt_pool_depth.set(len(self.prompts))
+        return True
+
+    def _drop_expired(self):
+        # 題目依加入順序排列，過期的都在前端
+        cutoff = time.time() - self.max_age
+        while self.prompts and self.prompts[0][1] < cutoff:
+            self.prompts.popleft()
+            self.expired += 1
+
+    def remember(self, prompt):
+        """記錄一個已使用的題目 (例如即時產生的)，避免池子之後再給出相同題目"""
+        key = normalize_prompt(prompt)
+        if not key or key in self.recent_keys:
+            return
+        if len(self.recent) == self.recent.maxlen:
+            self.recent_keys.discard(self.recent[0])
+        self.recent.append(key)
+        self.recent_keys.add(key)
+
+    # --- 背景補充 ---
+    def ensure_started(self):
+        """在目前的 event loop 中啟動背景補充工作 (若尚未啟動)"""
+        if self._refill_task is not None and not self._refill_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._refill_needed = asyncio.Event()
+        self._refill_needed.set()
+        self._refill_task = loop.create_task(self._refill_loop())
+
+    async def _refill_loop(self):
+        backoff = 1
+        while True:
+            await self._refill_needed.wait()
+            self._refill_needed.clear()
+            # 每輪最多呼叫 2 * capacity 次，避免模型一直給出重複題目時不停消耗 LLM 的配額
+            attempts = 0
+            while len(self.prompts) < self.capacity and attempts < 2 * self.capacity:
+                batch = min(self.refill_concurrency, self.capacity - len(self.prompts))
+                attempts += batch
+                results = await asyncio.gather(*(self.generate() for _ in range(batch)), return_exceptions=True)
+                added = 0
+                for result in results:
+                    if isinstance(result, Exception) or not result:
+                        self.errors += 1
+                        continue
+                    self.generated += 1
+                    if self.add(result):
+                        added += 1
+                if not added:
+                    # 全部失敗或全部重複
+                    logger.warning(f"PromptPool: refill batch added nothing, retrying in {backoff}s")
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, 60)
+                else:
+                    backoff = 1
+            logger.info(f"PromptPool: refilled. Stats: {self.stats()}")
+            await self._save()
+
+    # --- 持久化 ---
+    def _load(self):
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            cutoff = time.time() - self.max_age
+            for entry in entries:
+                if len(self.prompts) >= self.capacity:
+                    break
+                # 沒有產生時間的舊格式 (純字串) 視為過期
+                if not isinstance(entry, dict) or entry.get('created_at', 0) < cutoff:
+                    self.expired += 1
+                    continue
+                self.add(entry.get('prompt'), created_at=entry['created_at'])
+            logger.info(f"PromptPool: loaded {len(self.prompts)} prompts from {self.persist_path}")
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning(f"PromptPool: failed to load {self.persist_path}: {e}")
+
+    async def _save(self):
+        if not self.persist_path:
+            return
+        snapshot = [{'prompt': prompt, 'created_at': created_at} for prompt, created_at in self.prompts]
+
+        def write():
+            tmp_path = f"{self.persist_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_path, self.persist_path)
+
+        try:
+            await asyncio.to_thread(write)
+        except OSError as e:
+            logger.warning(f"PromptPool: failed to save {self.persist_path}: {e}")
+
+    # --- 指標 ---
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'depth': len(self.prompts),
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'generated': self.generated,
+            'duplicates': self.duplicates,
+            'expired': self.expired,
+            'errors': self.errors,
+        }
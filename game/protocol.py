@@ -0,0 +1,311 @@
+import json
+import time
+from collections import Counter
+
+from . import metrics
+from . import tracing
+
+try:
+    import msgpack
+except ImportError:  # MessagePack 是可選的；未安裝時只提供 JSON
+    msgpack = None
+
+# 遊戲協定的編碼方式在 WebSocket 握手時以 subprotocol 協商：
+#   gartic.json.v1    : 文字訊息 {"type": ..., "payload": ...} (預設，未指定 subprotocol 的舊客戶端也使用此格式)
+#   gartic.msgpack.v1 : 二進位 MessagePack 陣列 [type_code, payload]
+# 客戶端的實作在 static/js/protocol.js，兩邊的 MESSAGE_TYPES 順序必須一致 (只能在尾端新增)。
+JSON_SUBPROTOCOL = 'gartic.json.v1'
+MSGPACK_SUBPROTOCOL = 'gartic.msgpack.v1'
+
+MESSAGE_TYPES = [
+    # 伺服器 -> 客戶端
+    'game_state_update', 'assign_prompt', 'request_drawing', 'request_guess',
+    'game_over', 'results_book', 'update_displayed_book', 'clear_canvas_instruction',
+    'notification', 'error', 'ai_drawing_queued', 'ai_drawing_result',
+    'chat', 'room_update', 'game_started',
+    # 客戶端 -> 伺服器
+    'chat_message', 'start_game', 'submit_prompt', 'submit_drawing', 'submit_guess',
+    'clear_canvas', 'ai_assist_drawing', 'cancel_ai_assist', 'navigate_book',
+    'request_results_book', 'add_bot', 'remove_bot', 'set_llm_provider',
+    # 版本化狀態差異
+    'game_state_delta', 'sync_state',
+    # 客戶端定期送出，延長訪客 ID 的租約
+    'heartbeat',
+]
+MESSAGE_TYPE_CODES = {message_type: code for code, message_type in enumerate(MESSAGE_TYPES, start=1)}
+
+
+class ProtocolError(ValueError):
+    """無法解析的客戶端訊息"""
+
+
+class JSONCodec:
+    name = 'json'
+    subprotocol = JSON_SUBPROTOCOL
+    binary = False
+
+    def encode(self, message_type, payload):
+        return json.dumps({'type': message_type, 'payload': payload})
+
+    def decode(self, data):
+        try:
+            message = json.loads(data)
+        except ValueError as e:
+            raise ProtocolError(f"Invalid JSON message: {e}")
+        if not isinstance(message, dict):
+            raise ProtocolError("Message must be a JSON object")
+        return message.get('type'), message.get('payload') or {}
+
+
+class MsgpackCodec:
+    name = 'msgpack'
+    subprotocol = MSGPACK_SUBPROTOCOL
+    binary = True
+
+    def encode(self, message_type, payload):
+        # 未登記的訊息類型直接以字串傳送
+        return msgpack.packb([MESSAGE_TYPE_CODES.get(message_type, message_type), payload], use_bin_type=True)
+
+    def decode(self, data):
+        try:
+            message = msgpack.unpackb(data, raw=False)
+        except Exception as e:
+            raise ProtocolError(f"Invalid MessagePack message: {e}")
+        if not isinstance(message, (list, tuple)) or len(message) != 2:
+            raise ProtocolError("Message must be a [type, payload] array")
+        type_code, payload = message
+        if isinstance(type_code, int):
+            if not 1 <= type_code <= len(MESSAGE_TYPES):
+                raise ProtocolError(f"Unknown message type code {type_code}")
+            type_code = MESSAGE_TYPES[type_code - 1]
+        return type_code, payload or {}
+
+
+JSON_CODEC = JSONCodec()
+CODECS = {JSON_CODEC.name: JSON_CODEC}
+if msgpack is not None:
+    CODECS[MsgpackCodec.name] = MsgpackCodec()
+CODECS_BY_SUBPROTOCOL = {codec.subprotocol: codec for codec in CODECS.values()}
+
+
+def negotiate_codec(subprotocols):
+    """依客戶端列出的 subprotocol 順序選擇第一個支援的編碼，回傳 (codec, 要回應的 subprotocol)"""
+    for subprotocol in subprotocols or ():
+        codec = CODECS_BY_SUBPROTOCOL.get(subprotocol)
+        if codec:
+            return codec, subprotocol
+    return JSON_CODEC, None
+
+
+def encode_message(message_type, payload):
+    """將一則伺服器訊息編碼成 JSON 文字訊息"""
+    return JSON_CODEC.encode(message_type, payload)
+
+
+def broadcast_event(message_type, payload, exclude_channels=None, codec_names=None):
+    """
+    建立 group_send 用的事件：訊息在送出前就以群組使用的編碼 (codec_names，見 GroupCodecs) 各編碼一次，
+    群組中每個 consumer 只需轉送符合自己連線編碼的那一份，不會各自重新序列化。
+    JSON 一律包含，作為沒有對應編碼時的後備；codec_names 為 None 時以所有編碼編碼。
+    exclude_channels 中的 channel 不會收到訊息 (例如發送者自己)。
+    """
+    names = {JSON_CODEC.name}
+    names.update(CODECS if codec_names is None else codec_names)
+    return {
+        'type': 'broadcast_frame',
+        'message_type': message_type,
+        'frames': {name: CODECS[name].encode(message_type, payload) for name in names if name in CODECS},
+        'exclude_channels': list(exclude_channels or ()),
+    }
+
+
+class GroupCodecs:
+    """
+    記錄每個群組中的連線使用了 JSON 以外的哪些編碼，廣播時只以這些編碼 (加上 JSON) 編碼，
+    群組中沒有 MessagePack 連線時不需要多編碼、也不需要經由 channel layer 多傳送一份。
+    記錄不完整時 (例如其他 worker 剛加入的連線) 對應的連線會收到 JSON 文字訊息；
+    protocol.js 對文字訊息一律以 JSON 解析，因此只影響訊息大小，不影響正確性。
+    """
+
+    async def join(self, group, codec_name):
+        raise NotImplementedError
+
+    async def leave(self, group, codec_name):
+        raise NotImplementedError
+
+    async def codecs_for(self, group):
+        """回傳群組使用的非 JSON 編碼名稱 (set)"""
+        raise NotImplementedError
+
+
+class InMemoryGroupCodecs(GroupCodecs):
+    """單一 process 的實作 (InMemoryChannelLayer 時群組中的連線都在同一個 process)"""
+
+    def __init__(self):
+        self.groups = {}  # group -> Counter(編碼名稱 -> 連線數)
+
+    async def join(self, group, codec_name):
+        if codec_name != JSON_CODEC.name:
+            self.groups.setdefault(group, Counter())[codec_name] += 1
+
+    async def leave(self, group, codec_name):
+        counts = self.groups.get(group)
+        if not counts or codec_name not in counts:
+            return
+        counts[codec_name] -= 1
+        if counts[codec_name] <= 0:
+            del counts[codec_name]
+        if not counts:
+            del self.groups[group]
+
+    async def codecs_for(self, group):
+        return set(self.groups.get(group, ()))
+
+
+class RedisGroupCodecs(GroupCodecs):
+    """
+    使用 Redis 的共享實作 (channels_redis 時群組中的連線分散在多個 worker)。
+    每個群組一個 hash (編碼名稱 -> 連線數)；讀取結果在本 process 快取 cache_ttl 秒，
+    避免每次廣播都查詢 Redis。worker 當機沒有扣回的計數在 ttl 秒沒有新連線後隨 key 一起過期。
+    """
+
+    def __init__(self, client=None, url=None, prefix='gartic:group_codecs:', ttl=24 * 3600, cache_ttl=2.0):
+        if client is None:
+            import redis.asyncio as redis_asyncio
+            client = redis_asyncio.from_url(url or 'redis://localhost:6379/0')
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.cache_ttl = cache_ttl
+        self.cache = {}  # group -> (快取到期時間 (monotonic), 編碼名稱 set)
+
+    async def join(self, group, codec_name):
+        if codec_name == JSON_CODEC.name:
+            return
+        key = f"{self.prefix}{group}"
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hincrby(key, codec_name, 1)
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+        # 本 process 的廣播立即使用新的編碼
+        cached = self.cache.get(group)
+        if cached:
+            cached[1].add(codec_name)
+
+    async def leave(self, group, codec_name):
+        if codec_name != JSON_CODEC.name:
+            # 計數降到 0 的欄位保留 (與並行的 join 競爭時刪除欄位會遺失計數)，讀取時忽略
+            await self.client.hincrby(f"{self.prefix}{group}", codec_name, -1)
+
+    async def codecs_for(self, group):
+        now = time.monotonic()
+        cached = self.cache.get(group)
+        if cached and cached[0] > now:
+            return cached[1]
+        counts = await self.client.hgetall(f"{self.prefix}{group}")
+        names = {
+            name.decode() if isinstance(name, bytes) else name
+            for name, count in counts.items() if int(count) > 0
+        }
+        if len(self.cache) > 4096:
+            self.cache = {g: entry for g, entry in self.cache.items() if entry[0] > now}
+        self.cache[group] = (now + self.cache_ttl, names)
+        return names
+
+
+def get_group_codecs(backend='memory', redis_url=None):
+    """依 channel layer 的設定建立群組編碼的記錄"""
+    if len(CODECS) == 1:
+        # 只有 JSON (未安裝 msgpack)，不需要記錄
+        return InMemoryGroupCodecs()
+    if backend == 'redis':
+        return RedisGroupCodecs(url=redis_url)
+    return InMemoryGroupCodecs()
+
+
+def _create_default_group_codecs():
+    from django.conf import settings
+    return get_group_codecs(
+        backend=getattr(settings, 'CHANNEL_LAYER_BACKEND', 'memory'),
+        redis_url=getattr(settings, 'REDIS_URL', None),
+    )
+
+
+group_codecs = _create_default_group_codecs()
+
+
+async def group_broadcast_event(group, message_type, payload, exclude_channels=None):
+    """建立只以群組使用的編碼編碼的 broadcast_event"""
+    return broadcast_event(message_type, payload, exclude_channels, await group_codecs.codecs_for(group))
+
+
+class BroadcastMixin:
+    """
+    AsyncWebsocketConsumer 的協定輔助：協商編碼、送出單一訊息，
+    以及「編碼一次、轉送多次」的群組廣播。
+    """
+
+    codec = JSON_CODEC
+    connection_counted = False
+    codec_group = None
+
+    async def accept_with_codec(self):
+        """協商編碼並接受連線；應在 group_add 之後呼叫，讓群組的廣播包含這個連線的編碼"""
+        self.codec, subprotocol = negotiate_codec(self.scope.get('subprotocols'))
+        self.codec_group = getattr(self, 'room_group_name', None)
+        if self.codec_group:
+            await group_codecs.join(self.codec_group, self.codec.name)
+        await self.accept(subprotocol=subprotocol)
+        self.connection_counted = True
+        metrics.websocket_connections.inc(consumer=type(self).__name__)
+
+    async def websocket_disconnect(self, message):
+        if self.connection_counted:
+            self.connection_counted = False
+            metrics.websocket_connections.dec(consumer=type(self).__name__)
+        if self.codec_group:
+            codec_group, self.codec_group = self.codec_group, None
+            await group_codecs.leave(codec_group, self.codec.name)
+        await super().websocket_disconnect(message)
+
+    def decode_message(self, text_data=None, bytes_data=None):
+        """回傳 (message_type, payload)；文字訊息一律以 JSON 解析"""
+        if text_data is not None:
+            message_type, payload = JSON_CODEC.decode(text_data)
+            size = len(text_data.encode('utf-8'))
+        elif not self.codec.binary:
+            raise ProtocolError("Binary message received on a JSON connection")
+        else:
+            message_type, payload = self.codec.decode(bytes_data)
+            size = len(bytes_data)
+        # 未登記的類型合併計算，避免客戶端送來任意字串造成過多的 label
+        metrics.record_message('in', message_type if message_type in MESSAGE_TYPE_CODES else 'unknown', size)
+        return message_type, payload
+
+    async def send_frame(self, frame):
+        if isinstance(frame, bytes):
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
+
+    async def send_payload(self, message_type, payload):
+        frame = self.codec.encode(message_type, payload)
+        # JSON 以 ensure_ascii 編碼，字元數即為位元組數
+        metrics.record_message('out', message_type, len(frame))
+        await self.send_frame(frame)
+
+    async def group_broadcast(self, message_type, payload, exclude_channels=None):
+        with tracing.span('broadcast', type=message_type):
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                await group_broadcast_event(self.room_group_name, message_type, payload, exclude_channels)
+            )
+
+    async def broadcast_frame(self, event):
+        """處理 broadcast_event 建立的群組事件：直接轉送已編碼的訊息"""
+        if self.channel_name in event.get('exclude_channels', ()):
+            return
+        frames = event['frames']
+        frame = frames.get(self.codec.name) or frames[JSON_CODEC.name]
+        metrics.record_message('out', event['message_type'], len(frame))
+        await self.send_frame(frame)
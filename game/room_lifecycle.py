@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+from .blob_store import blob_store, is_blob_url, blob_key_from_url
+
+logger = logging.getLogger(__name__)
+
+
+class RoomUsage:
+    __slots__ = ('last_active', 'room_bytes', 'blob_keys', 'finished')
+
+    def __init__(self):
+        self.last_active = time.monotonic()
+        self.room_bytes = 0
+        self.blob_keys = frozenset()
+        self.finished = False
+
+
+class RoomLifecycleManager:
+    """
+    追蹤本 process 服務的房間 (最後活動時間、約略佔用的記憶體)，並定期清除：
+      - 已結束超過 finished_ttl 秒、或閒置超過 idle_ttl 秒的房間
+      - 總佔用超過 memory_budget 時，從最久沒有活動的房間開始清除
+    房間的大小為房間 JSON 的長度加上其畫作在 blob store 記憶體層的大小 (總量中共用的畫作只計算一次)。
+    清除前可先將房間寫入 archive_dir；清除後不再被任何房間引用的畫作會移出記憶體層，
+    磁碟層則在每次 sweep 時依 blob store 的 disk_ttl / disk_budget 清理。
+
+    on_evict(store_name, key, reason) 在房間被刪除後呼叫，讓呼叫端清理該房間的其他資源。
+    """
+
+    def __init__(self, stores, memory_budget=256 * 1024 * 1024, finished_ttl=600, idle_ttl=1800,
+                 sweep_interval=30, archive_dir=None, on_evict=None):
+        self.stores = stores  # {store_name: RoomStore}
+        self.memory_budget = memory_budget
+        self.finished_ttl = finished_ttl
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        self.archive_dir = archive_dir
+        self.on_evict = on_evict
+        self.rooms = OrderedDict()  # {(store_name, key): RoomUsage}，依最後活動時間排序
+        self.blob_refs = {}  # {blob_key: 引用它的房間數}
+        self.task = None
+
+        self.evicted = {'finished': 0, 'idle': 0, 'memory': 0}
+        self.archived = 0
+
+    # --- 活動追蹤 ---
+    def touch(self, store_name, key):
+        """記錄房間的活動 (O(1))；房間大小在 sweep 時才重新計算"""
+        room_id = (store_name, key)
+        usage = self.rooms.get(room_id)
+        if usage is None:
+            self.rooms[room_id] = RoomUsage()
+        else:
+            usage.last_active = time.monotonic()
+            self.rooms.move_to_end(room_id)
+
+    def forget(self, store_name, key):
+        """房間已被正常刪除 (例如所有玩家都離開)"""
+        usage = self.rooms.pop((store_name, key), None)
+        if usage:
+            self._release_blobs(usage.blob_keys)
+
+    def _release_blobs(self, blob_keys):
+        released = []
+        for blob_key in blob_keys:
+            count = self.blob_refs.get(blob_key, 0) - 1
+            if count > 0:
+                self.blob_refs[blob_key] = count
+            else:
+                self.blob_refs.pop(blob_key, None)
+                released.append(blob_key)
+        if released:
+            # 移出記憶體層可能需要寫入磁碟，不在 event loop 上執行
+            asyncio.get_running_loop().run_in_executor(None, self._evict_blobs, released)
+
+    @staticmethod
+    def _evict_blobs(blob_keys):
+        for blob_key in blob_keys:
+            blob_store.evict(blob_key)
+
+    def _measure(self, usage, room):
+        blob_keys = set()
+        for book in room.get('books', {}).values():
+            for entry in book:
+                if is_blob_url(entry.get('data')):
+                    blob_key = blob_key_from_url(entry['data'])
+                    if blob_key:
+                        blob_keys.add(blob_key)
+        blob_keys = frozenset(blob_keys)
+        for blob_key in blob_keys - usage.blob_keys:
+            self.blob_refs[blob_key] = self.blob_refs.get(blob_key, 0) + 1
+        self._release_blobs(usage.blob_keys - blob_keys)
+
+        usage.blob_keys = blob_keys
+        usage.room_bytes = len(json.dumps(room, default=str))
+        usage.finished = room.get('state') == 'finished'
+
+    # --- 清除 ---
+    def ensure_started(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"RoomLifecycleManager: sweep failed: {e}", exc_info=True)
+
+    async def sweep(self):
+        """重新計算房間大小，並清除過期或超出記憶體預算的房間；回傳清除的房間數"""
+        now = time.monotonic()
+        expired = []
+        for (store_name, key), usage in list(self.rooms.items()):
+            room = await self.stores[store_name].get(key)
+            if room is None:
+                self.forget(store_name, key)
+                continue
+            self._measure(usage, room)
+            idle_for = now - usage.last_active
+            if usage.finished and idle_for > self.finished_ttl:
+                expired.append((store_name, key, 'finished'))
+            elif idle_for > self.idle_ttl:
+                expired.append((store_name, key, 'idle'))
+
+        for store_name, key, reason in expired:
+            await self.evict(store_name, key, reason)
+
+        evicted = len(expired)
+        # self.rooms 依最後活動時間排序，最前面的就是最久沒有活動的房間
+        total_bytes = self.total_bytes()
+        while self.rooms and total_bytes > self.memory_budget:
+            (store_name, key), usage = next(iter(self.rooms.items()))
+            total_bytes -= usage.room_bytes + sum(
+                blob_store.resident_size(blob_key) for blob_key in usage.blob_keys
+                if self.blob_refs.get(blob_key) == 1
+            )
+            await self.evict(store_name, key, 'memory')
+            evicted += 1
+
+        # 清理磁碟層 (仍被房間引用的畫作保留)
+        await asyncio.to_thread(blob_store.maybe_prune_disk, frozenset(self.blob_refs))
+        return evicted
+
+    async def evict(self, store_name, key, reason):
+        store = self.stores[store_name]
+        if self.archive_dir:
+            room = await store.get(key)
+            if room is not None:
+                await asyncio.to_thread(self._archive, store_name, key, room)
+        await store.delete(key)
+        self.forget(store_name, key)
+        self.evicted[reason] = self.evicted.get(reason, 0) + 1
+        logger.info(f"RoomLifecycleManager: evicted {store_name} room {key} ({reason})")
+        if self.on_evict:
+            try:
+                await self.on_evict(store_name, key, reason)
+            except Exception as e:
+                logger.error(f"RoomLifecycleManager: on_evict for {key} failed: {e}", exc_info=True)
+
+    def _archive(self, store_name, key, room):
+        directory = os.path.join(self.archive_dir, store_name)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{key}-{int(time.time())}.json")
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(room, f, ensure_ascii=False, default=str)
+            self.archived += 1
+        except OSError as e:
+            logger.error(f"RoomLifecycleManager: failed to archive {key}: {e}")
+
+    # --- 統計 ---
+    def total_bytes(self):
+        # 多個房間共用的畫作只計算一次
+        room_bytes = sum(usage.room_bytes for usage in self.rooms.values())
+        return room_bytes + sum(blob_store.resident_size(blob_key) for blob_key in self.blob_refs)
+
+    def stats(self):
+        return {
+            'rooms': len(self.rooms),
+            'total_bytes': self.total_bytes(),
+            'memory_budget': self.memory_budget,
+            'referenced_blobs': len(self.blob_refs),
+            'evicted': dict(self.evicted),
+            'archived': self.archived,
+        }
@@ -0,0 +1,275 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# update() 的 mutator 回傳此值時，房間會在同一次原子更新中被刪除
+DELETE_ROOM = object()
+
+
+class DeferredLog:
+    """
+    mutator 可能因衝突而重跑，不可在其中直接輸出 log。mutator 改寫入 DeferredLog，
+    update() 返回後再以 flush() 輸出 (只保留最後一次執行的內容)：
+
+        deferred = DeferredLog(logger)
+        result = await store.update(key, deferred.wrap(mutator))
+        deferred.flush()
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.records = []
+
+    def wrap(self, mutator):
+        def wrapped(room):
+            self.records.clear()
+            return mutator(room)
+        return wrapped
+
+    def log(self, level, message):
+        self.records.append((level, message))
+
+    def debug(self, message):
+        self.log(logging.DEBUG, message)
+
+    def info(self, message):
+        self.log(logging.INFO, message)
+
+    def warning(self, message):
+        self.log(logging.WARNING, message)
+
+    def error(self, message):
+        self.log(logging.ERROR, message)
+
+    def flush(self):
+        records, self.records = self.records, []
+        for level, message in records:
+            self.logger.log(level, message)
+
+
+def room_state(room):
+    """房間的狀態 (等待室沒有 state，記為 open)"""
+    return room.get('state', 'open')
+
+
+class RoomVersionConflict(Exception):
+    """樂觀鎖重試次數用盡 (房間被其他 worker 持續修改)"""
+
+
+class RoomStore:
+    """
+    房間狀態儲存介面。
+
+    所有對房間的修改都必須透過 update(key, mutator)：mutator 是同步函式，接收房間 dict，
+    就地修改並可回傳任意結果。實作保證 mutator 的讀取與寫入是原子的，並在每次成功寫入後
+    遞增 room['version']。mutator 可能因衝突而被重新執行，因此不可有外部副作用。
+    """
+
+    async def get(self, key):
+        """回傳房間 dict，不存在時回傳 None"""
+        raise NotImplementedError
+
+    async def get_many(self, keys):
+        """依序回傳多個房間 (不存在的為 None)"""
+        return [await self.get(key) for key in keys]
+
+    async def create(self, key, room):
+        """僅在房間不存在時建立，成功回傳 True"""
+        raise NotImplementedError
+
+    async def update(self, key, mutator):
+        """原子地修改房間並回傳 mutator 的結果；房間不存在時回傳 None，不會呼叫 mutator"""
+        raise NotImplementedError
+
+    async def delete(self, key):
+        raise NotImplementedError
+
+    async def count_by_state(self):
+        """回傳 {state: 房間數}；由建立、更新與刪除時維護，不需要讀取每個房間"""
+        raise NotImplementedError
+
+    async def exists(self, key):
+        return await self.get(key) is not None
+
+    async def keys(self):
+        raise NotImplementedError
+
+
+class InMemoryRoomStore(RoomStore):
+    """
+    單一 process 的記憶體實作。
+    mutator 是同步的，在單一 event loop 中執行期間不會被打斷，因此不需要額外加鎖。
+    get() 回傳的是實際的房間物件 (非副本)。
+    """
+
+    def __init__(self):
+        self.rooms = {}
+        self.state_counts = {}
+
+    def _count(self, state, amount):
+        count = self.state_counts.get(state, 0) + amount
+        if count:
+            self.state_counts[state] = count
+        else:
+            self.state_counts.pop(state, None)
+
+    async def get(self, key):
+        return self.rooms.get(key)
+
+    async def create(self, key, room):
+        if key in self.rooms:
+            return False
+        room['version'] = 1
+        self.rooms[key] = room
+        self._count(room_state(room), 1)
+        return True
+
+    async def update(self, key, mutator):
+        room = self.rooms.get(key)
+        if room is None:
+            return None
+        before = room_state(room)
+        result = mutator(room)
+        if result is DELETE_ROOM:
+            del self.rooms[key]
+            self._count(before, -1)
+        else:
+            room['version'] = room.get('version', 0) + 1
+            after = room_state(room)
+            if after != before:
+                self._count(before, -1)
+                self._count(after, 1)
+        return result
+
+    async def delete(self, key):
+        room = self.rooms.pop(key, None)
+        if room is not None:
+            self._count(room_state(room), -1)
+
+    async def count_by_state(self):
+        return dict(self.state_counts)
+
+    async def keys(self):
+        return list(self.rooms)
+
+    def __len__(self):
+        return len(self.rooms)
+
+
+class RedisRoomStore(RoomStore):
+    """
+    使用 Redis 協定的共享實作，讓多個 worker 可以服務同一個房間。
+    房間以 JSON 儲存；update() 以 WATCH/MULTI 做樂觀鎖，衝突時重新讀取並重跑 mutator。
+    各狀態的房間數存在另一個 hash (counts_key) 中，與房間的寫入在同一個 transaction 中更新。
+
+    client 可以是任何 redis.asyncio 相容的客戶端，例如測試時使用的 fakeredis.aioredis.FakeRedis。
+    """
+
+    def __init__(self, client=None, url=None, prefix='gartic:room:', max_retries=50):
+        if client is None:
+            import redis.asyncio as redis_asyncio
+            client = redis_asyncio.from_url(url or 'redis://localhost:6379/0')
+        self.client = client
+        self.prefix = prefix
+        # 不可以 prefix 開頭，否則 keys() 會把它當成房間
+        self.counts_key = f"{prefix.rstrip(':')}.state_counts"
+        self.max_retries = max_retries
+
+    def _key(self, key):
+        return f"{self.prefix}{key}"
+
+    @staticmethod
+    def _loads(raw):
+        return json.loads(raw) if raw is not None else None
+
+    async def get(self, key):
+        return self._loads(await self.client.get(self._key(key)))
+
+    async def get_many(self, keys):
+        # 一次 MGET，避免逐一往返
+        if not keys:
+            return []
+        return [self._loads(raw) for raw in await self.client.mget([self._key(key) for key in keys])]
+
+    async def create(self, key, room):
+        from redis.exceptions import WatchError
+
+        room['version'] = 1
+        redis_key = self._key(key)
+        for _ in range(self.max_retries):
+            async with self.client.pipeline(transaction=True) as pipe:
+                try:
+                    await pipe.watch(redis_key)
+                    if await pipe.exists(redis_key):
+                        await pipe.unwatch()
+                        return False
+                    pipe.multi()
+                    pipe.set(redis_key, json.dumps(room))
+                    pipe.hincrby(self.counts_key, room_state(room), 1)
+                    await pipe.execute()
+                    return True
+                except WatchError:
+                    continue
+        raise RoomVersionConflict(f"Gave up creating room {key} after {self.max_retries} conflicts")
+
+    async def update(self, key, mutator):
+        from redis.exceptions import WatchError
+
+        redis_key = self._key(key)
+        for _ in range(self.max_retries):
+            async with self.client.pipeline(transaction=True) as pipe:
+                try:
+                    await pipe.watch(redis_key)
+                    room = self._loads(await pipe.get(redis_key))
+                    if room is None:
+                        await pipe.unwatch()
+                        return None
+                    before = room_state(room)
+                    result = mutator(room)
+                    pipe.multi()
+                    if result is DELETE_ROOM:
+                        pipe.delete(redis_key)
+                        pipe.hincrby(self.counts_key, before, -1)
+                    else:
+                        room['version'] = room.get('version', 0) + 1
+                        pipe.set(redis_key, json.dumps(room))
+                        after = room_state(room)
+                        if after != before:
+                            pipe.hincrby(self.counts_key, before, -1)
+                            pipe.hincrby(self.counts_key, after, 1)
+                    await pipe.execute()
+                    return result
+                except WatchError:
+                    logger.debug(f"RedisRoomStore: version conflict on {key}, retrying")
+                    continue
+        raise RoomVersionConflict(f"Gave up updating room {key} after {self.max_retries} conflicts")
+
+    async def delete(self, key):
+        # 經由 update() 刪除，才能在同一個 transaction 中扣掉房間原本狀態的計數
+        await self.update(key, lambda room: DELETE_ROOM)
+
+    async def count_by_state(self):
+        counts = {}
+        for state, count in (await self.client.hgetall(self.counts_key)).items():
+            if isinstance(state, bytes):
+                state = state.decode('utf-8')
+            if int(count) > 0:
+                counts[state] = int(count)
+        return counts
+
+    async def keys(self):
+        prefix_length = len(self.prefix)
+        keys = []
+        async for raw_key in self.client.scan_iter(match=f"{self.prefix}*"):
+            if isinstance(raw_key, bytes):
+                raw_key = raw_key.decode('utf-8')
+            keys.append(raw_key[prefix_length:])
+        return keys
+
+
+def get_room_store(namespace, backend='memory', redis_url=None):
+    """依設定建立房間儲存 (namespace 用來區分 game / waiting 房間)"""
+    if backend == 'redis':
+        return RedisRoomStore(url=redis_url, prefix=f'gartic:{namespace}:')
+    return InMemoryRoomStore()
@@ -0,0 +1,96 @@
+import asyncio
+import unittest
+
+from .room_store import RedisRoomStore, DELETE_ROOM
+
+try:
+    import fakeredis
+except ImportError:  # 測試相依套件，見 requirements-dev.txt
+    fakeredis = None
+
+
+@unittest.skipUnless(fakeredis, 'fakeredis is not installed')
+class RedisRoomStoreConcurrencyTests(unittest.IsolatedAsyncioTestCase):
+    """以 fakeredis 模擬多個 worker 同時修改同一個房間 (每個 store 使用自己的連線，共用同一個伺服器)"""
+
+    WORKERS = 4
+    UPDATES_PER_WORKER = 25
+
+    async def asyncSetUp(self):
+        server = fakeredis.FakeServer()
+        self.stores = [
+            RedisRoomStore(client=fakeredis.aioredis.FakeRedis(server=server), prefix='test:room:')
+            for _ in range(self.WORKERS)
+        ]
+        await self.stores[0].create('room', {'counter': 0, 'players': {}})
+
+    async def asyncTearDown(self):
+        for store in self.stores:
+            await store.client.aclose()
+
+    async def _run_workers(self, mutator):
+        async def worker(store):
+            results = []
+            for _ in range(self.UPDATES_PER_WORKER):
+                results.append(await store.update('room', mutator))
+                await asyncio.sleep(0)
+            return results
+
+        per_worker = await asyncio.gather(*(worker(store) for store in self.stores))
+        return [result for results in per_worker for result in results]
+
+    async def test_concurrent_updates_are_not_lost(self):
+        def increment(room):
+            room['counter'] += 1
+            return room['counter']
+
+        results = await self._run_workers(increment)
+
+        total = self.WORKERS * self.UPDATES_PER_WORKER
+        room = await self.stores[0].get('room')
+        self.assertEqual(room['counter'], total)
+        self.assertEqual(room['version'], total + 1)
+        # 每次成功的寫入都看到不同的值，沒有兩個 mutator 基於同一份舊資料寫入
+        self.assertEqual(sorted(results), list(range(1, total + 1)))
+
+    async def test_delete_room_is_applied_once_after_all_prior_updates(self):
+        threshold = self.WORKERS * self.UPDATES_PER_WORKER // 2
+
+        def increment_then_delete(room):
+            room['counter'] += 1
+            if room['counter'] == threshold:
+                return DELETE_ROOM
+            return room['counter']
+
+        results = await self._run_workers(increment_then_delete)
+
+        self.assertEqual(results.count(DELETE_ROOM), 1)
+        applied = [result for result in results if result is not None and result is not DELETE_ROOM]
+        self.assertEqual(sorted(applied), list(range(1, threshold)))
+        # 刪除後的 update 都看不到房間，不會重新建立
+        self.assertEqual(results.count(None), len(results) - threshold)
+        self.assertIsNone(await self.stores[0].get('room'))
+        self.assertEqual(await self.stores[0].keys(), [])
+
+    async def test_state_counts_follow_updates_and_deletes(self):
+        store = self.stores[0]
+        await store.create('other', {'state': 'prompting'})
+        self.assertEqual(await store.count_by_state(), {'open': 1, 'prompting': 1})
+
+        def set_state(state):
+            def mutator(room):
+                room['state'] = state
+            return mutator
+
+        await asyncio.gather(*(
+            other.update('other', set_state('drawing')) for other in self.stores
+        ))
+        self.assertEqual(await store.count_by_state(), {'open': 1, 'drawing': 1})
+
+        await store.update('room', lambda room: DELETE_ROOM)
+        await self.stores[1].delete('other')
+        self.assertEqual(await store.count_by_state(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
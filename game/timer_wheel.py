@@ -0,0 +1,171 @@
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _Timer:
+    __slots__ = ('key', 'expiry_tick', 'callback', 'level', 'slot')
+
+    def __init__(self, key, expiry_tick, callback):
+        self.key = key
+        self.expiry_tick = expiry_tick
+        self.callback = callback
+        self.level = None
+        self.slot = None
+
+
+class TimerWheel:
+    """
+    階層式時間輪 (hierarchical timing wheel)，整個 process 只需一個背景 task 驅動。
+
+    時間以 tick 為單位；第 0 層每格代表 1 tick，第 n 層每格代表 wheel_size**n tick。
+    計時器依距離到期的 tick 數放入對應的層，較高層的格子在輪到時會「下沉」到較低層重新放置。
+    新增、取消與每個 tick 的推進都是 O(1) (攤銷)，與計時器總數無關。
+
+    每個 key 同時只有一個計時器；以相同 key 重新 schedule 會取代舊的計時器。
+    到期時 callback (無參數、回傳 coroutine 的函式) 會在新的 task 中執行。
+    """
+
+    def __init__(self, tick=1.0, wheel_size=64, levels=4):
+        self.tick = tick
+        self.wheel_size = wheel_size
+        self.levels = levels
+        self.wheels = [[{} for _ in range(wheel_size)] for _ in range(levels)]  # slot: {key: _Timer}
+        self.timers = {}  # {key: _Timer}
+        self.current_tick = 0
+        self.started_at = None
+        self.driver = None
+
+        self.scheduled = 0
+        self.cancelled = 0
+        self.fired = 0
+
+    def __len__(self):
+        return len(self.timers)
+
+    # --- 放置 / 移除 ---
+    def _place(self, timer):
+        """將計時器放入對應的層與格子；已到期的回傳 False"""
+        remaining = timer.expiry_tick - self.current_tick
+        if remaining <= 0:
+            return False
+        span = self.wheel_size
+        for level in range(self.levels):
+            if remaining < span or level == self.levels - 1:
+                unit = span // self.wheel_size
+                # 超出最高層範圍的計時器先放在最高層最遠的格子，之後下沉時再重新放置
+                expiry = min(timer.expiry_tick, self.current_tick + span - unit)
+                slot = (expiry // unit) % self.wheel_size
+                timer.level, timer.slot = level, slot
+                self.wheels[level][slot][timer.key] = timer
+                return True
+            span *= self.wheel_size
+        return False
+
+    def _unlink(self, timer):
+        if timer.level is not None:
+            self.wheels[timer.level][timer.slot].pop(timer.key, None)
+            timer.level = timer.slot = None
+
+    # --- 公開 API ---
+    def schedule(self, key, delay, callback):
+        """delay 秒後執行 callback；必須在 event loop 中呼叫"""
+        if self.started_at is None:
+            self.started_at = time.monotonic()
+        self.cancel(key, count=False)
+        elapsed_ticks = (time.monotonic() - self.started_at) / self.tick
+        if not self.timers:
+            # 時間輪是空的 (driver 已停止)：直接跳到目前時間，不需逐 tick 補上閒置期間
+            self.current_tick = max(self.current_tick, int(elapsed_ticks))
+        # 至少延後一個 tick，並向上取整確保不會提早觸發
+        expiry_tick = max(self.current_tick + 1, int(elapsed_ticks + delay / self.tick) + 1)
+        timer = _Timer(key, expiry_tick, callback)
+        self.timers[key] = timer
+        self._place(timer)
+        self.scheduled += 1
+        self._ensure_driver()
+
+    def cancel(self, key, count=True):
+        timer = self.timers.pop(key, None)
+        if timer is None:
+            return False
+        self._unlink(timer)
+        if count:
+            self.cancelled += 1
+        return True
+
+    def deadline_of(self, key):
+        """回傳計時器到期的 time.monotonic() 時間，沒有計時器時回傳 None"""
+        timer = self.timers.get(key)
+        if timer is None:
+            return None
+        return self.started_at + timer.expiry_tick * self.tick
+
+    # --- 推進 ---
+    def advance(self):
+        """推進一個 tick，回傳到期的計時器"""
+        self.current_tick += 1
+        # 由高層往低層下沉，讓同一 tick 下沉到第 0 層的計時器也能在本 tick 觸發
+        for level in range(self.levels - 1, 0, -1):
+            unit = self.wheel_size ** level
+            if self.current_tick % unit:
+                continue
+            slot = (self.current_tick // unit) % self.wheel_size
+            bucket = self.wheels[level][slot]
+            if not bucket:
+                continue
+            self.wheels[level][slot] = {}
+            for timer in bucket.values():
+                if not self._place(timer):
+                    # 正好在本 tick 到期：放入第 0 層目前的格子，稍後一起觸發
+                    timer.level, timer.slot = 0, self.current_tick % self.wheel_size
+                    self.wheels[0][timer.slot][timer.key] = timer
+
+        slot = self.current_tick % self.wheel_size
+        bucket = self.wheels[0][slot]
+        if not bucket:
+            return []
+        self.wheels[0][slot] = {}
+        expired = []
+        for timer in bucket.values():
+            timer.level = timer.slot = None
+            if timer.expiry_tick > self.current_tick:
+                # 同一格中較晚一圈的計時器
+                self._place(timer)
+                continue
+            self.timers.pop(timer.key, None)
+            expired.append(timer)
+        return expired
+
+    def _ensure_driver(self):
+        if self.driver is None or self.driver.done():
+            self.driver = asyncio.create_task(self._drive())
+
+    async def _drive(self):
+        while self.timers:
+            next_tick_at = self.started_at + (self.current_tick + 1) * self.tick
+            await asyncio.sleep(max(0.0, next_tick_at - time.monotonic()))
+            # 若 event loop 忙碌導致延遲，一次補上所有錯過的 tick
+            target_tick = int((time.monotonic() - self.started_at) / self.tick)
+            while self.current_tick < target_tick:
+                for timer in self.advance():
+                    self.fired += 1
+                    asyncio.create_task(self._fire(timer))
+        self.driver = None
+
+    async def _fire(self, timer):
+        try:
+            await timer.callback()
+        except Exception as e:
+            logger.error(f"TimerWheel: callback for {timer.key} failed: {e}", exc_info=True)
+
+    def stats(self):
+        return {
+            'timers': len(self.timers),
+            'current_tick': self.current_tick,
+            'scheduled': self.scheduled,
+            'cancelled': self.cancelled,
+            'fired': self.fired,
+        }
@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import functools
+import contextvars
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+
+# 輕量的追蹤 span：以 contextvars 傳遞目前的 span，asyncio task 與 asyncio.to_thread 會自動繼承。
+# 每個遊戲一個 trace (trace_id = 房間的 game_id)，span 結束時以一行 JSON 寫入輪替的檔案：
+#   {"trace_id", "span_id", "parent_id", "name", "start", "duration", "attrs", "error"}
+# 檔案寫入在背景 thread 中進行 (QueueHandler)，不會阻塞 event loop。
+# 未呼叫 configure() 時所有 span 都是 no-op。離線分析請使用 scripts/trace_summary.py。
+
+_current_span = contextvars.ContextVar('gartic_current_span', default=None)
+_exporter = None
+_listener = None
+
+
+def configure(path, max_bytes=10 * 1024 * 1024, backup_count=5):
+    """啟用追蹤並將 span 寫入 path (超過 max_bytes 時輪替，保留 backup_count 個舊檔)"""
+    global _exporter, _listener
+    shutdown()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    span_queue = queue.SimpleQueue()
+    _listener = QueueListener(span_queue, handler)
+    _listener.start()
+
+    exporter = logging.getLogger('gartic.trace')
+    exporter.propagate = False
+    exporter.setLevel(logging.INFO)
+    exporter.handlers = [QueueHandler(span_queue)]
+    _exporter = exporter
+
+
+@atexit.register
+def shutdown():
+    """停止背景寫入 thread (會先寫完佇列中的 span)；之後的 span 都是 no-op"""
+    global _exporter, _listener
+    listener, _listener, _exporter = _listener, None, None
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
+def enabled():
+    return _exporter is not None
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'attributes', 'start', 'started_at', 'error', 'token')
+
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.parent_id = parent_id
+        self.span_id = os.urandom(8).hex()
+        self.attributes = attributes
+        self.error = None
+        self.token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.start = time.time()
+        self.started_at = time.perf_counter()
+        self.token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        duration = time.perf_counter() - self.started_at
+        _current_span.reset(self.token)
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        exporter = _exporter
+        if exporter is not None:
+            exporter.info(json.dumps({
+                'trace_id': self.trace_id,
+                'span_id': self.span_id,
+                'parent_id': self.parent_id,
+                'name': self.name,
+                'start': round(self.start, 6),
+                'duration': round(duration, 6),
+                'attrs': self.attributes,
+                'error': self.error,
+            }, ensure_ascii=False, default=str))
+        return False
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name, trace_id=None, **attributes):
+    """
+    建立 span (context manager)。
+    有目前 span 時成為其子 span；否則以 trace_id 開始新的根 span。
+    追蹤未啟用、或沒有目前 span 也沒有 trace_id 時回傳 no-op span。
+    """
+    if _exporter is None:
+        return _NOOP_SPAN
+    parent = _current_span.get()
+    if parent is not None and (trace_id is None or trace_id == parent.trace_id):
+        return Span(name, parent.trace_id, parent.span_id, attributes)
+    if trace_id is None:
+        return _NOOP_SPAN
+    return Span(name, trace_id, None, attributes)
+
+
+def annotate(**attributes):
+    """為目前的 span 加上屬性 (例如操作編號、玩家)"""
+    current = _current_span.get()
+    if current is not None and _exporter is not None:
+        current.set(**attributes)
+
+
+def traced(name):
+    """async 方法的 decorator：以 self.trace_id 為 trace，將整個呼叫包在 span 中"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            with span(name, trace_id=getattr(self, 'trace_id', None)):
+                return await func(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,193 @@
+import re
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text):
+    """Normalizes text for cache lookup (NFKC, collapsed whitespace, casefolded)."""
+    text = unicodedata.normalize('NFKC', text or '')
+    return re.sub(r'\s+', ' ', text).strip().casefold()
+
+
+class TranslationCache:
+    """
+    LRU + TTL cache for translate_to_english results.
+
+    The in-memory tier is an OrderedDict bounded by max_entries. When sqlite_path
+    is set, entries are also written to a SQLite table so translations survive
+    restarts; memory misses fall through to that tier and are promoted on hit.
+    """
+
+    def __init__(self, max_entries=1024, ttl=7 * 24 * 3600, sqlite_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # {key: (translation, expires_at)}
+        self.lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.miss_latency_total = 0.0
+        self.miss_latency_count = 0
+
+        self.db = None
+        self.db_lock = threading.Lock()
+        if sqlite_path:
+            self._open_db(sqlite_path)
+
+    # --- memory tier ---
+    def _memory_get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            translation, expires_at = item
+            if expires_at < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return translation
+
+    def _memory_put(self, key, translation, expires_at):
+        with self.lock:
+            self.entries[key] = (translation, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    # --- persistent tier ---
+    def _open_db(self, sqlite_path):
+        try:
+            self.db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS translations ("
+                "key TEXT PRIMARY KEY, translation TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self.db.execute("DELETE FROM translations WHERE expires_at < ?", (time.time(),))
+            self.db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"TranslationCache: persistent tier disabled ({sqlite_path}): {e}")
+            self.db = None
+
+    def _db_get(self, key):
+        if self.db is None:
+            return None
+        try:
+            with self.db_lock:
+                row = self.db.execute(
+                    "SELECT translation, expires_at FROM translations WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"TranslationCache: persistent lookup failed: {e}")
+            return None
+        if row is None or row[1] < time.time():
+            return None
+        self._memory_put(key, row[0], row[1])
+        return row[0]
+
+    def _db_put(self, key, translation, expires_at):
+        if self.db is None:
+            return
+        try:
+            with self.db_lock:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO translations (key, translation, expires_at) VALUES (?, ?, ?)",
+                    (key, translation, expires_at)
+                )
+                self.db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"TranslationCache: persistent write failed: {e}")
+
+    # --- accounting ---
+    def _average_miss_latency(self):
+        return self.miss_latency_total / self.miss_latency_count if self.miss_latency_count else 0.0
+
+    def _record_hit(self, result):
+        if result == 'memory_hit':
+            self.memory_hits += 1
+        else:
+            self.persistent_hits += 1
+        metrics.translation_cache_lookups.inc(result=result)
+        metrics.translation_cache_saved_seconds.inc(self._average_miss_latency())
+
+    def _record_miss(self):
+        self.misses += 1
+        metrics.translation_cache_lookups.inc(result='miss')
+
+    def _record_latency(self, latency):
+        if latency is not None:
+            self.miss_latency_total += latency
+            self.miss_latency_count += 1
+
+    # --- public API ---
+    def get(self, text):
+        key = normalize_text(text)
+        translation = self._memory_get(key)
+        if translation is not None:
+            self._record_hit('memory_hit')
+            return translation
+        translation = self._db_get(key)
+        if translation is not None:
+            self._record_hit('persistent_hit')
+            return translation
+        self._record_miss()
+        return None
+
+    def put(self, text, translation, latency=None):
+        """Stores a translation; latency is the time the uncached call took."""
+        self._record_latency(latency)
+        if not translation:
+            return
+        key = normalize_text(text)
+        expires_at = time.time() + self.ttl
+        self._memory_put(key, translation, expires_at)
+        self._db_put(key, translation, expires_at)
+
+    async def aget(self, text):
+        """Async lookup; only the SQLite tier is moved off the event loop."""
+        key = normalize_text(text)
+        translation = self._memory_get(key)
+        if translation is not None:
+            self._record_hit('memory_hit')
+            return translation
+        if self.db is not None:
+            translation = await asyncio.to_thread(self._db_get, key)
+            if translation is not None:
+                self._record_hit('persistent_hit')
+                return translation
+        self._record_miss()
+        return None
+
+    async def aput(self, text, translation, latency=None):
+        self._record_latency(latency)
+        if not translation:
+            return
+        key = normalize_text(text)
+        expires_at = time.time() + self.ttl
+        self._memory_put(key, translation, expires_at)
+        if self.db is not None:
+            await asyncio.to_thread(self._db_put, key, translation, expires_at)
+
+    def stats(self):
+        hits = self.memory_hits + self.persistent_hits
+        lookups = hits + self.misses
+        average_miss_latency = self._average_miss_latency()
+        return {
+            'entries': len(self.entries),
+            'memory_hits': self.memory_hits,
+            'persistent_hits': self.persistent_hits,
+            'misses': self.misses,
+            'hit_ratio': hits / lookups if lookups else 0.0,
+            'average_miss_latency': average_miss_latency,
+            # Estimated time saved: every hit avoided one average translation round trip
+            'saved_seconds': hits * average_miss_latency,
+        }
@@ -0,0 +1,196 @@
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.db import DatabaseError, connection
+from django.db.models.signals import post_save, post_delete
+
+logger = logging.getLogger(__name__)
+
+
+class UserRegistry:
+    """
+    已註冊使用者名稱的記憶體索引，讓檢查用戶 ID 是否可用時不必每次查詢資料庫。
+
+    索引在啟動時於背景 thread 中一次載入 (warm)，之後由 User 的 post_save / post_delete signal 同步；
+    每 refresh_interval 秒在背景重新載入一次，以涵蓋不觸發 signal 的批次操作與其他 process 建立的使用者。
+    載入期間收到的 signal 會先記錄，載入完成後再套用，避免被舊的查詢結果覆蓋。
+
+    索引無法載入 (例如尚未 migrate) 時改為逐一查詢資料庫，並以 negative cache 記住最近確認不存在的名稱，
+    避免同一個名稱在 negative_ttl 秒內重複查詢。
+    """
+
+    def __init__(self, refresh_interval=300.0, negative_ttl=30.0, negative_capacity=4096):
+        self.refresh_interval = refresh_interval
+        self.negative_ttl = negative_ttl
+        self.negative_capacity = negative_capacity
+
+        self.names = {}  # username -> user id
+        self.ids = {}  # user id -> username
+        self.negative = OrderedDict()  # username -> 確認不存在的時間 (monotonic)
+        self.lock = threading.Lock()
+        self.journal = None  # 載入期間收到的 signal
+        self.loaded = False
+        self.loaded_at = 0.0
+        self.failed_at = None
+        self.loading = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='user-registry')
+
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.db_lookups = 0
+        self.loads = 0
+        self.load_failures = 0
+
+    # --- 載入 ---
+    def connect_signals(self):
+        post_save.connect(self._on_user_saved, sender=User, dispatch_uid='game.user_registry.saved')
+        post_delete.connect(self._on_user_deleted, sender=User, dispatch_uid='game.user_registry.deleted')
+
+    def start_warm(self):
+        """在背景開始載入索引 (已在載入中則沿用)；回傳 concurrent.futures.Future"""
+        with self.lock:
+            if self.loading is None or self.loading.done():
+                self.journal = []
+                self.loading = self.executor.submit(self._load)
+            return self.loading
+
+    def _load(self):
+        try:
+            rows = list(User.objects.values_list('id', 'username').iterator())
+        except DatabaseError as e:
+            self.load_failures += 1
+            self.failed_at = time.monotonic()
+            logger.warning(f"UserRegistry: could not load usernames ({e}); falling back to per-name queries.")
+            with self.lock:
+                self.journal = None
+            return False
+        finally:
+            # 這個 thread 很少使用，不保留資料庫連線
+            connection.close()
+
+        ids = dict(rows)
+        names = {username: user_id for user_id, username in rows}
+        with self.lock:
+            journal, self.journal = self.journal or [], None
+            self.ids, self.names = ids, names
+            for receiver, user_id, username in journal:
+                receiver(user_id, username)
+            self.loaded = True
+            self.loaded_at = time.monotonic()
+            self.failed_at = None
+            self.negative.clear()
+        self.loads += 1
+        logger.info(f"UserRegistry: indexed {len(names)} usernames.")
+        return True
+
+    def _maybe_refresh(self):
+        if self.loaded and time.monotonic() - self.loaded_at > self.refresh_interval:
+            self.start_warm()
+
+    def _should_wait_for_load(self):
+        # 載入失敗後 refresh_interval 秒內不再重試，期間直接逐一查詢
+        return not self.loaded and (self.failed_at is None or time.monotonic() - self.failed_at > self.refresh_interval)
+
+    # --- signal ---
+    def _on_user_saved(self, sender, instance, **kwargs):
+        with self.lock:
+            self._apply_save(instance.pk, instance.username)
+            if self.journal is not None:
+                self.journal.append((self._apply_save, instance.pk, instance.username))
+
+    def _on_user_deleted(self, sender, instance, **kwargs):
+        with self.lock:
+            self._apply_delete(instance.pk, instance.username)
+            if self.journal is not None:
+                self.journal.append((self._apply_delete, instance.pk, instance.username))
+
+    def _apply_save(self, user_id, username):
+        # 改名時移除舊名稱
+        previous = self.ids.get(user_id)
+        if previous is not None and previous != username and self.names.get(previous) == user_id:
+            del self.names[previous]
+        self.ids[user_id] = username
+        self.names[username] = user_id
+        self.negative.pop(username, None)
+
+    def _apply_delete(self, user_id, username):
+        previous = self.ids.pop(user_id, None)
+        for name in (previous, username):
+            if name is not None and self.names.get(name) == user_id:
+                del self.names[name]
+
+    # --- 查詢 ---
+    async def is_registered(self, username, authoritative=False):
+        """
+        username 是否已是註冊使用者。
+        索引已載入時只查記憶體；authoritative=True (例如真正佔用 ID 前) 時，
+        不在索引中的名稱會再向資料庫確認一次 (結果記入 negative cache)。
+        """
+        if username in self.names:
+            self.hits += 1
+            self._maybe_refresh()
+            return True
+
+        if self._should_wait_for_load():
+            # 啟動後的第一次查詢等待索引載入完成；載入失敗時才逐一查詢
+            await asyncio.wrap_future(self.start_warm())
+            if username in self.names:
+                self.hits += 1
+                return True
+        self._maybe_refresh()
+
+        if self.loaded and not authoritative:
+            self.misses += 1
+            return False
+
+        checked_at = self.negative.get(username)
+        if checked_at is not None and time.monotonic() - checked_at < self.negative_ttl:
+            self.negative_hits += 1
+            return False
+
+        self.db_lookups += 1
+        user_id = await sync_to_async(self._lookup)(username)
+        with self.lock:
+            if user_id is not None:
+                self._apply_save(user_id, username)
+            else:
+                self.negative[username] = time.monotonic()
+                self.negative.move_to_end(username)
+                while len(self.negative) > self.negative_capacity:
+                    self.negative.popitem(last=False)
+        return user_id is not None
+
+    @staticmethod
+    def _lookup(username):
+        return User.objects.filter(username=username).values_list('id', flat=True).first()
+
+    def stats(self):
+        return {
+            'loaded': self.loaded,
+            'usernames': len(self.names),
+            'negative_entries': len(self.negative),
+            'hits': self.hits,
+            'misses': self.misses,
+            'negative_hits': self.negative_hits,
+            'db_lookups': self.db_lookups,
+            'loads': self.loads,
+            'load_failures': self.load_failures,
+        }
+
+
+def _create_default_registry():
+    from django.conf import settings
+    return UserRegistry(
+        refresh_interval=getattr(settings, 'USER_REGISTRY_REFRESH_INTERVAL', 300),
+        negative_ttl=getattr(settings, 'USER_REGISTRY_NEGATIVE_TTL', 30),
+    )
+
+
+user_registry = _create_default_registry()
@@ -1,13 +1,12 @@
 from django.shortcuts import render, redirect
-from django.http import JsonResponse, HttpResponse
-from django.contrib.auth.models import User
-from django.views.decorators.http import require_GET, require_POST
-from django.views.decorators.csrf import csrf_exempt
+from django.http import JsonResponse, HttpResponse, HttpResponseNotAllowed, HttpResponseNotModified, Http404
+from django.views.decorators.http import require_GET
 import logging
 import json
-
-# 全局集合來存儲活躍的訪客用戶ID
-active_guest_ids = set()
+from .blob_store import blob_store, is_blob_key, mime_type_for_key
+from . import metrics as game_metrics
+from .user_registry import user_registry
+from .guest_leases import guest_leases
 
 # 設置日誌
 logger = logging.getLogger(__name__)
@@ -32,10 +31,14 @@ def waiting_room(request, room_name):
         'room_name': room_name
     })
 
-@require_POST
-@csrf_exempt  # 注意：在生產環境中應該適當處理CSRF保護
-def register_user_id(request):
+# 以下的 async view 不使用 require_GET / require_POST / csrf_exempt 裝飾器：
+# Django 5.0 之前這些裝飾器會把 coroutine view 包成同步函式，回傳未 await 的 coroutine，
+# 因此在 view 內檢查 request.method，並直接設定 csrf_exempt 屬性 (與 csrf_exempt 裝飾器的作用相同)
+
+async def register_user_id(request):
     """註冊從sessionStorage提交的用戶ID"""
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
     try:
         data = json.loads(request.body)
         user_id = data.get('userid', '')
@@ -44,23 +47,24 @@ def register_user_id(request):
         if not user_id:
             return JsonResponse({'success': False, 'message': '未提供用戶ID'}, status=400)
         
-        # 檢查用戶ID是否已存在
-        exists_in_db = User.objects.filter(username=user_id).exists()
-        exists_in_active = user_id in active_guest_ids
-        
-        if exists_in_db or exists_in_active:
+        # 檢查用戶ID是否已存在 (真正佔用ID前，不在索引中的名稱會再向資料庫確認)
+        if await user_registry.is_registered(user_id, authoritative=True):
             return JsonResponse({'success': False, 'message': '此用戶ID已被使用'}, status=409)
         
-        # 若ID可用，則將其添加到活躍ID集合中
-        active_guest_ids.add(user_id)
-        logger.info(f"register_user_id: 已添加用戶ID {user_id}, 當前活躍IDs: {active_guest_ids}")
+        # 若ID可用，則取得其租約 (已被其他訪客持有時失敗)
+        if not await guest_leases.acquire(user_id):
+            return JsonResponse({'success': False, 'message': '此用戶ID已被使用'}, status=409)
+        logger.info(f"register_user_id: 已取得用戶ID {user_id} 的租約")
         return JsonResponse({'success': True, 'message': '用戶ID註冊成功'})
     except json.JSONDecodeError:
         return JsonResponse({'success': False, 'message': '無效的請求格式'}, status=400)
 
-@require_GET
-def check_userid_availability(request):
+register_user_id.csrf_exempt = True  # 注意：在生產環境中應該適當處理CSRF保護
+
+async def check_userid_availability(request):
     """檢查用戶 ID 是否可用"""
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
     userid = request.GET.get('userid', '')
     
     if not userid:
@@ -77,15 +81,60 @@ def check_userid_availability(request):
     if len(userid) > 20:
         return JsonResponse({'available': False, 'message': '用戶 ID 不能超過 20 個字符'})
     
-    # 檢查是否已存在於用戶表中
-    exists_in_db = User.objects.filter(username=userid).exists()
+    # 檢查是否已存在於用戶表中 (記憶體索引，不查詢資料庫)
+    exists_in_db = await user_registry.is_registered(userid)
     
-    # 檢查是否已存在於活躍訪客ID中
-    exists_in_active = userid in active_guest_ids
+    # 檢查是否已被活躍訪客持有
+    exists_in_active = await guest_leases.is_leased(userid)
     
-    logger.debug(f"check_userid_availability: 檢查ID {userid}, exists_in_db={exists_in_db}, exists_in_active={exists_in_active}, active_ids={active_guest_ids}")
+    logger.debug(f"check_userid_availability: 檢查ID {userid}, exists_in_db={exists_in_db}, exists_in_active={exists_in_active}")
     
     if exists_in_db or exists_in_active:
         return JsonResponse({'available': False, 'message': '此 ID 已被使用'})
     else:
         return JsonResponse({'available': True, 'message': '此 ID 可用'})
+
+
+@require_GET
+def blob(request, key):
+    """提供內容定址的畫作；內容永不改變，因此可使用強 ETag 與 immutable 快取"""
+    if not is_blob_key(key):
+        raise Http404("Blob not found")
+    # 同樣的內容以不同副檔名 (Content-Type) 儲存時是不同的表示，ETag 包含完整的 key
+    etag = f'"{key}"'
+    cache_control = 'public, max-age=31536000, immutable'
+
+    if_none_match = request.headers.get('If-None-Match', '')
+    if etag in [tag.strip() for tag in if_none_match.split(',')]:
+        # 內容定址：相同的 ETag 代表相同的內容，不需讀取畫作
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control
+        return response
+
+    data = blob_store.get(key)
+    if data is None:
+        raise Http404("Blob not found")
+
+    if if_none_match.strip() == '*':
+        # "*" 只在畫作存在時成立
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control
+        return response
+
+    response = HttpResponse(data, content_type=mime_type_for_key(key))
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    response['X-Content-Type-Options'] = 'nosniff'
+    # 畫作可能是玩家上傳的 SVG，禁止其中的腳本執行
+    response['Content-Security-Policy'] = "default-src 'none'; style-src 'unsafe-inline'; sandbox"
+    return response
+
+
+async def metrics(request):
+    """Prometheus 格式的監控數據"""
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    from . import consumers  # noqa: F401  註冊房間統計的 collector
+    return HttpResponse(await game_metrics.registry.collect(), content_type=game_metrics.CONTENT_TYPE)
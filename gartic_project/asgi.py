@@ -17,6 +17,10 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gartic_project.settings')
 django_asgi_app = get_asgi_application()
 
 import game.routing # 確保導入了 game.routing
+from game.user_registry import user_registry
+
+# 啟動時在背景載入使用者名稱索引，檢查用戶 ID 時不必查詢資料庫
+user_registry.start_warm()
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
@@ -65,12 +65,28 @@ ROOT_URLCONF = 'gartic_project.urls'
 # 配置Channels
 ASGI_APPLICATION = 'gartic_project.asgi.application'
 
+# 房間狀態與 Channel layer 的後端
+# 'memory' 只適用單一 worker；設定為 'redis' 時多個 daphne worker 可以共享房間與群組訊息
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+ROOM_STORE_BACKEND = os.getenv('ROOM_STORE_BACKEND', 'memory')
+CHANNEL_LAYER_BACKEND = os.getenv('CHANNEL_LAYER', ROOM_STORE_BACKEND)
+
 # 配置Channel layers
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-    },
-}
+if CHANNEL_LAYER_BACKEND == 'redis':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [REDIS_URL],
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
 
 TEMPLATES = [
     {
@@ -146,6 +162,79 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# 遊戲伺服器效能設定
+# 每個房間同時進行的機器人 LLM 呼叫上限
+BOT_CONCURRENCY_PER_ROOM = int(os.getenv('BOT_CONCURRENCY_PER_ROOM', 4))
+
+# 機器人題目池 (預先產生的題目)
+PROMPT_POOL_SIZE = int(os.getenv('PROMPT_POOL_SIZE', 32))
+PROMPT_POOL_LOW_WATERMARK = int(os.getenv('PROMPT_POOL_LOW_WATERMARK', 8))
+PROMPT_POOL_PATH = os.getenv('PROMPT_POOL_PATH')  # 例如 BASE_DIR / 'prompt_pool.json'；未設定則只存在記憶體
+PROMPT_POOL_MAX_AGE = int(os.getenv('PROMPT_POOL_MAX_AGE', 3 * 24 * 3600))  # 題目產生後可使用的秒數
+
+# 機器人 AI provider：'gemini' 或 'local' (本機 CPU、不需網路)；可再依呼叫類型覆寫
+LLM_PROVIDER = os.getenv('LLM_PROVIDER', 'gemini')
+LLM_PROVIDER_BY_CALL_TYPE = {
+    call_type: os.getenv(f'LLM_PROVIDER_{call_type.upper()}')
+    for call_type in ('prompt', 'draw', 'guess', 'assist')
+    if os.getenv(f'LLM_PROVIDER_{call_type.upper()}')
+}
+
+# 畫作 blob store：記憶體上限 (bytes) 與溢出到磁碟的目錄；多個 worker 時應立即寫入共用目錄
+BLOB_STORE_MEMORY_BYTES = int(os.getenv('BLOB_STORE_MEMORY_BYTES', 64 * 1024 * 1024))
+BLOB_STORE_DIR = os.getenv('BLOB_STORE_DIR')  # 未設定則使用系統暫存目錄下的 gartic_blobs
+BLOB_STORE_WRITE_THROUGH = os.getenv('BLOB_STORE_WRITE_THROUGH', str(ROOM_STORE_BACKEND == 'redis')).lower() in ('1', 'true', 'yes')
+# 磁碟層的上限：超過 TTL (秒) 沒有使用的畫作會被刪除，總大小超過 BLOB_STORE_DISK_BYTES 時從最舊的開始刪除
+BLOB_STORE_DISK_BYTES = int(os.getenv('BLOB_STORE_DISK_BYTES', 1024 * 1024 * 1024))
+BLOB_STORE_DISK_TTL = float(os.getenv('BLOB_STORE_DISK_TTL', 24 * 3600))
+
+# 二進位上傳 (畫作、AI 輔助畫布) 的大小上限 (bytes)
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', 5 * 1024 * 1024))
+
+# 提交畫作的正規化：超過尺寸會被縮小，壓縮後超過 DRAWING_MAX_BYTES 會被拒絕
+DRAWING_MAX_WIDTH = int(os.getenv('DRAWING_MAX_WIDTH', 1024))
+DRAWING_MAX_HEIGHT = int(os.getenv('DRAWING_MAX_HEIGHT', 1024))
+DRAWING_MAX_BYTES = int(os.getenv('DRAWING_MAX_BYTES', 512 * 1024))
+
+# 圖片 CPU 工作的 process 數 (預設為 CPU 核心數，0 表示改用 thread)；超過門檻的資料以共享記憶體交給 worker
+IMAGE_WORKER_PROCESSES = int(os.getenv('IMAGE_WORKER_PROCESSES')) if os.getenv('IMAGE_WORKER_PROCESSES') else None
+IMAGE_WORKER_SHM_THRESHOLD = int(os.getenv('IMAGE_WORKER_SHM_THRESHOLD', 256 * 1024))
+
+# 遊戲結果逐本傳送時，背景預先送出書本的間隔 (秒)
+RESULTS_PREFETCH_INTERVAL = float(os.getenv('RESULTS_PREFETCH_INTERVAL', 0.25))
+
+# 同一房間在此時間窗 (秒) 內的多次狀態廣播會合併成一則；0 表示不合併
+BROADCAST_COALESCE_WINDOW = float(os.getenv('BROADCAST_COALESCE_WINDOW', 0.05))
+
+# 各階段的時限 (秒)；逾時仍未提交的玩家會以預設內容自動提交，0 表示不限時
+PROMPT_TIMEOUT = float(os.getenv('PROMPT_TIMEOUT', 120))
+DRAW_TIMEOUT = float(os.getenv('DRAW_TIMEOUT', 180))
+GUESS_TIMEOUT = float(os.getenv('GUESS_TIMEOUT', 90))
+# 階段計時器 (時間輪) 的精度 (秒)
+PHASE_TIMER_TICK = float(os.getenv('PHASE_TIMER_TICK', 1.0))
+
+# 房間生命週期：已結束 / 閒置的房間在 TTL (秒) 後清除，總佔用超過預算時從最久沒有活動的房間開始清除
+ROOM_MEMORY_BUDGET_BYTES = int(os.getenv('ROOM_MEMORY_BUDGET_BYTES', 256 * 1024 * 1024))
+FINISHED_ROOM_TTL = float(os.getenv('FINISHED_ROOM_TTL', 600))
+IDLE_ROOM_TTL = float(os.getenv('IDLE_ROOM_TTL', 1800))
+ROOM_SWEEP_INTERVAL = float(os.getenv('ROOM_SWEEP_INTERVAL', 30))
+# 設定後，房間被清除前會以 JSON 寫入此目錄
+ROOM_ARCHIVE_DIR = os.getenv('ROOM_ARCHIVE_DIR') or None
+
+# 遊戲追蹤：設定 TRACE_FILE 後，每個遊戲的 span 以 JSONL 寫入此檔 (輪替)，可用 scripts/trace_summary.py 分析
+TRACE_FILE = os.getenv('TRACE_FILE') or None
+TRACE_MAX_BYTES = int(os.getenv('TRACE_MAX_BYTES', 10 * 1024 * 1024))
+TRACE_BACKUP_COUNT = int(os.getenv('TRACE_BACKUP_COUNT', 5))
+
+# 使用者名稱索引：背景重新載入的間隔 (秒)；索引無法載入時，確認不存在的名稱在 NEGATIVE_TTL 秒內不重複查詢
+USER_REGISTRY_REFRESH_INTERVAL = float(os.getenv('USER_REGISTRY_REFRESH_INTERVAL', 300))
+USER_REGISTRY_NEGATIVE_TTL = float(os.getenv('USER_REGISTRY_NEGATIVE_TTL', 30))
+
+# 訪客 ID 租約：WebSocket 沒有任何訊息 (客戶端每 30 秒送一次 heartbeat) 超過 TTL 秒後 ID 自動釋放；
+# 多個 worker 時使用 redis 共享
+GUEST_LEASE_BACKEND = os.getenv('GUEST_LEASE_BACKEND', ROOM_STORE_BACKEND)
+GUEST_LEASE_TTL = float(os.getenv('GUEST_LEASE_TTL', 90))
+
 # 記錄設置
 LOGGING = {
     'version': 1,
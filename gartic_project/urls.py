@@ -26,4 +26,5 @@ urlpatterns = [
     path('game/check-userid/', game_views.check_userid_availability, name='game_check_userid'),
     path('game/register-user-id/', game_views.register_user_id, name='register_user_id'),
     path('game/', include('game.urls')),
+    path('metrics', game_views.metrics, name='metrics'),
 ]
@@ -0,0 +1,380 @@
+"""
+在同一個 process 內對 gartic_project.asgi.application 進行負載測試。
+
+每個模擬房間都走完整的遊戲流程：
+  等待室 (/ws/waiting_room/<room>/) 加入 -> 房主選擇 stub AI、加入機器人、開始遊戲
+  -> 重新連線到 /ws/game/<room>/ -> 出題、繪畫、猜測直到 game_over
+
+機器人使用註冊為 'stub' 的 provider，延遲依指定的分布產生，不會呼叫真正的 LLM。
+每個並發等級在獨立的子 process 中執行，因此 peak RSS 是該等級自己的數值。
+
+    python scripts/loadtest.py --rooms 10 100 1000
+    python scripts/loadtest.py --rooms 50 --humans 3 --bots 3 --image-latency lognormal:1.5,0.4 --think-time uniform:0,0.5
+
+延遲分布的格式：fixed:<秒>、uniform:<最小>,<最大>、lognormal:<中位數>,<sigma>
+房間儲存與 channel layer 依環境變數設定 (預設為記憶體；例如 ROOM_STORE_BACKEND=redis 可測試 Redis)。
+
+報告的指標：
+  games/s           完成的遊戲數 / 總時間
+  op transition     最後一位玩家提交 (機器人已完成) 到房間收到下一個操作任務的時間 (p50 / p99)
+  event loop lag    定期 sleep 的延遲超出量 (p50 / p99 / max)
+  peak RSS          子 process 的最大常駐記憶體
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import base64
+import asyncio
+import argparse
+import resource
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# --- 延遲分布 ---
+def parse_distribution(spec):
+    """'fixed:0.1' / 'uniform:0.1,0.5' / 'lognormal:0.5,0.6' -> 無參數函式，回傳秒數"""
+    kind, _, args = spec.partition(':')
+    try:
+        values = [float(value) for value in args.split(',')] if args else []
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid distribution '{spec}'")
+    if kind == 'fixed' and len(values) == 1:
+        return lambda: values[0]
+    if kind == 'uniform' and len(values) == 2:
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'lognormal' and len(values) == 2 and values[0] > 0:
+        median, sigma = values
+        return lambda: random.lognormvariate(0, sigma) * median
+    raise argparse.ArgumentTypeError(f"invalid distribution '{spec}' (use fixed:S, uniform:A,B or lognormal:MEDIAN,SIGMA)")
+
+
+def distribution_spec(spec):
+    """argparse 的 type：只驗證格式，保留字串以便傳給子 process"""
+    parse_distribution(spec)
+    return spec
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def make_png(seed, size=96):
+    from PIL import Image, ImageDraw
+    rng = random.Random(seed)
+    image = Image.new('RGB', (size, size), 'white')
+    draw = ImageDraw.Draw(image)
+    for _ in range(6):
+        points = [(rng.randrange(size), rng.randrange(size)) for _ in range(4)]
+        draw.line(points, fill=tuple(rng.randrange(256) for _ in range(3)), width=3)
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def create_stub_provider(text_latency, image_latency, error_rate):
+    from game.llm_providers import LLMProvider
+
+    class StubProvider(LLMProvider):
+        """以指定的延遲回傳固定內容的 provider；error_rate 的比例會丟出例外 (測試預設內容的 fallback)"""
+        name = 'stub'
+
+        def __init__(self):
+            self.images = [make_png(seed) for seed in range(8)]
+            self.calls = 0
+            self.errors = 0
+
+        async def _wait(self, latency):
+            self.calls += 1
+            await asyncio.sleep(latency())
+            if error_rate and random.random() < error_rate:
+                self.errors += 1
+                raise RuntimeError('stub provider error')
+
+        async def generate_text_from_text(self):
+            await self._wait(text_latency)
+            return f"stub prompt {random.randrange(10000)}"
+
+        async def generate_image_bytes_from_text(self, text):
+            await self._wait(image_latency)
+            return random.choice(self.images)
+
+        async def generate_text_from_image_bytes(self, image_bytes, mime_type="image/png"):
+            await self._wait(text_latency)
+            return f"stub guess {random.randrange(10000)}"
+
+        async def generate_image_from_image(self, image_bytes, prompt_text, mime_type="image/png"):
+            await self._wait(image_latency)
+            return random.choice(self.images)
+
+    return StubProvider()
+
+
+# --- 模擬客戶端 ---
+class RoomView:
+    """房間內所有模擬玩家共用的觀察結果"""
+
+    def __init__(self):
+        self.waiting_on = []
+        self.completing_submit_at = None  # 本操作最後一位玩家 (機器人已完成) 的提交時間
+        self.transitions = []
+
+
+class SimulatedGame:
+    def __init__(self, application, room_name, humans, bots, think_time, drawing_data_url, timeout):
+        self.application = application
+        self.room_name = room_name
+        self.player_ids = [f"{room_name}_p{index}" for index in range(humans)]
+        self.bots = bots
+        self.think_time = think_time
+        self.drawing_data_url = drawing_data_url
+        self.timeout = timeout
+        self.view = RoomView()
+        self.errors = []
+
+    def communicator(self, path, player_id):
+        from channels.testing import WebsocketCommunicator
+        return WebsocketCommunicator(self.application, f"{path}?userid={player_id}")
+
+    @staticmethod
+    async def send(communicator, message_type, payload=None):
+        await communicator.send_to(text_data=json.dumps({'type': message_type, 'payload': payload or {}}))
+
+    async def receive(self, communicator):
+        message = json.loads(await communicator.receive_from(timeout=self.timeout))
+        return message.get('type'), message.get('payload') or {}
+
+    async def wait_for(self, communicator, message_type):
+        while True:
+            received_type, payload = await self.receive(communicator)
+            if received_type == message_type:
+                return payload
+            if received_type == 'error':
+                self.errors.append(payload.get('message'))
+
+    async def play(self):
+        # 等待室：第一個連線的玩家是房主
+        waiting = []
+        for player_id in self.player_ids:
+            communicator = self.communicator(f"/ws/waiting_room/{self.room_name}/", player_id)
+            connected, _ = await communicator.connect(timeout=self.timeout)
+            if not connected:
+                raise RuntimeError(f"{player_id} could not join the waiting room")
+            waiting.append(communicator)
+        host = waiting[0]
+        await self.send(host, 'set_llm_provider', {'provider': 'stub', 'call_type': 'all'})
+        for _ in range(self.bots):
+            await self.send(host, 'add_bot')
+        await self.send(host, 'start_game')
+        await asyncio.gather(*(self.wait_for(communicator, 'game_started') for communicator in waiting))
+        for communicator in waiting:
+            await communicator.disconnect()
+
+        # 遊戲房間：所有玩家連線後才送出 start_game (與前端相同)
+        game = []
+        for player_id in self.player_ids:
+            communicator = self.communicator(f"/ws/game/{self.room_name}/", player_id)
+            connected, _ = await communicator.connect(timeout=self.timeout)
+            if not connected:
+                raise RuntimeError(f"{player_id} could not join the game room")
+            game.append(communicator)
+        try:
+            for communicator in game:
+                await self.send(communicator, 'start_game')
+            await asyncio.gather(*(
+                self.play_player(communicator, player_id) for communicator, player_id in zip(game, self.player_ids)
+            ))
+        finally:
+            for communicator in game:
+                await communicator.disconnect()
+
+    async def play_player(self, communicator, player_id):
+        view = self.view
+        while True:
+            message_type, payload = await self.receive(communicator)
+            if message_type in ('game_state_update', 'game_state_delta'):
+                state = payload.get('changes', payload)
+                if 'waiting_on' in state:
+                    view.waiting_on = state['waiting_on']
+            elif message_type in ('assign_prompt', 'request_drawing', 'request_guess', 'game_over'):
+                if view.completing_submit_at is not None:
+                    view.transitions.append(time.perf_counter() - view.completing_submit_at)
+                    view.completing_submit_at = None
+                if message_type == 'game_over':
+                    return
+                await asyncio.sleep(self.think_time())
+                # waiting_on 只會在操作內縮小，過期的資料只會多列玩家，不會誤判
+                if view.waiting_on == [player_id]:
+                    view.completing_submit_at = time.perf_counter()
+                if message_type == 'assign_prompt':
+                    await self.send(communicator, 'submit_prompt', {'prompt': f"prompt from {player_id}"})
+                elif message_type == 'request_drawing':
+                    await self.send(communicator, 'submit_drawing', {
+                        'drawing': self.drawing_data_url, 'assignment_id': payload.get('assignment_id'),
+                    })
+                else:
+                    await self.send(communicator, 'submit_guess', {'guess': f"guess from {player_id}"})
+            elif message_type == 'error':
+                self.errors.append(payload.get('message'))
+
+
+async def monitor_loop_lag(samples, interval=0.05):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - started - interval)
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+async def run_level(args, rooms):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gartic_project.settings')
+    from gartic_project.asgi import application
+    from game import consumers
+
+    stub = create_stub_provider(parse_distribution(args.text_latency), parse_distribution(args.image_latency), args.error_rate)
+    consumers.llm_providers.register(stub)
+    drawing_data_url = 'data:image/png;base64,' + base64.b64encode(make_png('human')).decode('ascii')
+
+    lag_samples = []
+    monitor = asyncio.create_task(monitor_loop_lag(lag_samples))
+    run_id = f"{os.getpid()}_{int(time.time())}"
+    games = [
+        SimulatedGame(application, f"load_{run_id}_{index}", args.humans, args.bots,
+                      parse_distribution(args.think_time), drawing_data_url, args.game_timeout)
+        for index in range(rooms)
+    ]
+
+    async def play(game):
+        for round_index in range(args.games_per_room):
+            if round_index:
+                game.view = RoomView()
+            await game.play()
+
+    started = time.perf_counter()
+    outcomes = await asyncio.gather(*(play(game) for game in games), return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    monitor.cancel()
+
+    failures = [outcome for outcome in outcomes if isinstance(outcome, BaseException)]
+    completed = (len(games) - len(failures)) * args.games_per_room
+    transitions = [value for game in games for value in game.view.transitions]
+    return {
+        'rooms': rooms,
+        'games_completed': completed,
+        'games_failed': len(failures),
+        'failure_sample': [repr(failure) for failure in failures[:3]],
+        'server_errors': sum(len(game.errors) for game in games),
+        'elapsed': elapsed,
+        'games_per_second': completed / elapsed if elapsed else 0,
+        'op_transitions': len(transitions),
+        'op_transition_p50': percentile(transitions, 0.5),
+        'op_transition_p99': percentile(transitions, 0.99),
+        'loop_lag_p50': percentile(lag_samples, 0.5),
+        'loop_lag_p99': percentile(lag_samples, 0.99),
+        'loop_lag_max': max(lag_samples, default=None),
+        'llm_calls': stub.calls,
+        'llm_errors': stub.errors,
+        'peak_rss_bytes': peak_rss_bytes(),
+    }
+
+
+def run_child(args):
+    """單一並發等級；遊戲程式的 print 與 log 導向 /dev/null，只輸出一行 JSON 結果"""
+    import logging
+    sys.path.insert(0, ROOT_DIR)
+    real_stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            import django
+            os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gartic_project.settings')
+            django.setup()
+            logging.disable(logging.WARNING if args.verbose else logging.ERROR)
+            result = asyncio.run(run_level(args, args.rooms[0]))
+        finally:
+            sys.stdout = real_stdout
+    print(json.dumps(result))
+
+
+def format_ms(seconds):
+    return f"{seconds * 1000:.1f}" if seconds is not None else '-'
+
+
+def print_report(results):
+    header = (f"{'rooms':>6} {'games':>7} {'failed':>6} {'games/s':>8} {'op p50ms':>9} {'op p99ms':>9} "
+              f"{'lag p50ms':>9} {'lag p99ms':>9} {'lag max':>8} {'peak RSS':>9}")
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        print(f"{result['rooms']:>6} {result['games_completed']:>7} {result['games_failed']:>6} "
+              f"{result['games_per_second']:>8.2f} {format_ms(result['op_transition_p50']):>9} "
+              f"{format_ms(result['op_transition_p99']):>9} {format_ms(result['loop_lag_p50']):>9} "
+              f"{format_ms(result['loop_lag_p99']):>9} {format_ms(result['loop_lag_max']):>8} "
+              f"{result['peak_rss_bytes'] / 1024 / 1024:>8.1f}M")
+    for result in results:
+        for failure in result['failure_sample']:
+            print(f"  rooms={result['rooms']} failure: {failure}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Play full games against the ASGI app with simulated clients and a stub LLM.')
+    parser.add_argument('--rooms', type=int, nargs='+', default=[10, 100, 1000],
+                        help='concurrent rooms; each value runs in its own process (default: 10 100 1000)')
+    parser.add_argument('--humans', type=int, default=2, help='simulated human players per room (default: 2)')
+    parser.add_argument('--bots', type=int, default=2, help='bots per room (default: 2)')
+    parser.add_argument('--games-per-room', type=int, default=1, help='games played back to back in each room')
+    parser.add_argument('--text-latency', type=distribution_spec, default='lognormal:0.3,0.5',
+                        help='stub latency for prompts and guesses (default: lognormal:0.3,0.5)')
+    parser.add_argument('--image-latency', type=distribution_spec, default='lognormal:1.0,0.5',
+                        help='stub latency for drawings (default: lognormal:1.0,0.5)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of stub LLM calls that fail')
+    parser.add_argument('--think-time', type=distribution_spec, default='uniform:0,0.2',
+                        help='delay before a simulated human submits (default: uniform:0,0.2)')
+    parser.add_argument('--game-timeout', type=float, default=60,
+                        help='seconds to wait for any single message before failing a game')
+    parser.add_argument('--json', action='store_true', help='print raw JSON results')
+    parser.add_argument('--verbose', action='store_true', help='keep warnings from the game code')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    results = []
+    for rooms in args.rooms:
+        # 每個等級使用新的 process：房間、blob 與 RSS 都不會受到前一個等級影響
+        command = [
+            sys.executable, os.path.abspath(__file__), '--child', '--rooms', str(rooms),
+            '--humans', str(args.humans), '--bots', str(args.bots), '--games-per-room', str(args.games_per_room),
+            '--text-latency', args.text_latency, '--image-latency', args.image_latency,
+            '--error-rate', str(args.error_rate), '--think-time', args.think_time,
+            '--game-timeout', str(args.game_timeout),
+        ] + (['--verbose'] if args.verbose else [])
+        completed = subprocess.run(command, cwd=ROOT_DIR, stdout=subprocess.PIPE, text=True)
+        if completed.returncode != 0:
+            print(f"rooms={rooms}: load test process failed (exit {completed.returncode})", file=sys.stderr)
+            continue
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
+    if any(result['games_failed'] for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+離線分析 game/tracing.py 輸出的 JSONL 追蹤檔，列出每個遊戲各操作的關鍵路徑 (critical path)。
+
+    python scripts/trace_summary.py traces.jsonl            # 也會讀取輪替的 traces.jsonl.1, .2 ...
+    python scripts/trace_summary.py traces.jsonl --game <game_id> --top 5
+
+每個操作 (op) 從 start_prompting_round / start_next_operation 開始，到下一個操作開始為止。
+操作的關鍵路徑是最晚結束的提交 (玩家提交、機器人產生或逾時自動提交)，
+機器人的時間再細分為 LLM 呼叫 (llm.*) 與翻譯 (translate_to_english)。
+"""
+import os
+import sys
+import glob
+import json
+import argparse
+from collections import defaultdict
+
+OP_SPANS = ('start_prompting_round', 'start_next_operation')
+SUBMIT_SPANS = ('submit_prompt', 'submit_drawing', 'submit_guess', 'phase_deadline')
+BOT_SPANS = ('bot_prompt', 'bot_drawing', 'bot_guess')
+
+
+def trace_files(path):
+    """path 本身加上輪替產生的 path.1, path.2 ... (由舊到新)"""
+    rotated = [p for p in glob.glob(f"{glob.escape(path)}.*") if p.rsplit('.', 1)[-1].isdigit()]
+    rotated.sort(key=lambda p: int(p.rsplit('.', 1)[-1]), reverse=True)
+    return rotated + ([path] if os.path.exists(path) else [])
+
+
+def load_spans(paths):
+    traces = defaultdict(list)
+    skipped = 0
+    for path in paths:
+        for file_path in trace_files(path):
+            with open(file_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        span = json.loads(line)
+                    except ValueError:
+                        skipped += 1  # 輪替或程序中止時可能留下不完整的一行
+                        continue
+                    traces[span['trace_id']].append(span)
+    if skipped:
+        print(f"(skipped {skipped} malformed lines)", file=sys.stderr)
+    return traces
+
+
+def end_of(span):
+    return span['start'] + span['duration']
+
+
+def op_of(span, by_id):
+    """沿著 parent 找到 span 所屬的操作編號"""
+    while span is not None:
+        if 'op' in span['attrs']:
+            return span['attrs']['op']
+        span = by_id.get(span['parent_id'])
+    return None
+
+
+def summarize_trace(spans):
+    spans.sort(key=lambda s: s['start'])
+    by_id = {span['span_id']: span for span in spans}
+    children = defaultdict(list)
+    for span in spans:
+        children[span['parent_id']].append(span)
+
+    ops = {}
+    for span in spans:
+        if span['name'] in OP_SPANS and 'op' in span['attrs'] and span['attrs']['op'] not in ops:
+            ops[span['attrs']['op']] = span
+
+    def descendants(span):
+        stack = list(children[span['span_id']])
+        while stack:
+            child = stack.pop()
+            yield child
+            stack.extend(children[child['span_id']])
+
+    op_numbers = sorted(ops)
+    rows = []
+    for index, op_number in enumerate(op_numbers):
+        op_span = ops[op_number]
+        window_end = ops[op_numbers[index + 1]]['start'] if index + 1 < len(op_numbers) else None
+        # 玩家提交以 annotate 的 op 判斷；機器人的工作則屬於產生它的操作 (parent)
+        items = [
+            span for span in spans
+            if span['name'] in SUBMIT_SPANS + BOT_SPANS and op_of(span, by_id) == op_number
+        ]
+        critical = max(items, key=end_of) if items else None
+        bot_llm = defaultdict(float)
+        for span in items:
+            if span['name'] in BOT_SPANS:
+                for child in descendants(span):
+                    if child['name'].startswith('llm.') or child['name'] == 'translate_to_english':
+                        bot_llm[child['name']] += child['duration']
+        rows.append({
+            'op': op_number,
+            'state': op_span['attrs'].get('state'),
+            'start': op_span['start'],
+            'duration': (window_end - op_span['start']) if window_end else None,
+            'critical': critical,
+            'bot_llm': dict(bot_llm),
+            'submissions': len(items),
+        })
+
+    broadcasts = [span for span in spans if span['name'] in ('broadcast', 'broadcast_game_state')]
+    return {
+        'rows': rows,
+        'broadcast_count': len(broadcasts),
+        'broadcast_seconds': sum(span['duration'] for span in broadcasts if span['name'] == 'broadcast'),
+        'errors': [span for span in spans if span.get('error')],
+        'start': spans[0]['start'],
+        'end': max(end_of(span) for span in spans),
+    }
+
+
+def format_critical(span, op_start):
+    if span is None:
+        return '-'
+    attrs = span['attrs']
+    who = attrs.get('player') or ','.join(map(str, attrs.get('players', []))) or '?'
+    note = ' (fallback)' if attrs.get('fallback') else ''
+    return f"{span['name']} by {who} done at +{end_of(span) - op_start:.2f}s{note}"
+
+
+def print_summary(trace_id, summary, top):
+    print(f"game {trace_id}: {summary['end'] - summary['start']:.2f}s, "
+          f"{summary['broadcast_count']} broadcasts ({summary['broadcast_seconds'] * 1000:.1f}ms in group_send), "
+          f"{len(summary['errors'])} errored spans")
+    for row in summary['rows']:
+        duration = f"{row['duration']:.2f}s" if row['duration'] is not None else 'open'
+        print(f"  op {row['op']:>2} {row['state'] or '?':<10} {duration:>8}  "
+              f"critical: {format_critical(row['critical'], row['start'])}")
+        if row['bot_llm']:
+            breakdown = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in sorted(row['bot_llm'].items()))
+            print(f"{'':19}bot LLM: {breakdown}")
+    timed = [row for row in summary['rows'] if row['duration'] is not None]
+    if top and timed:
+        slowest = sorted(timed, key=lambda row: row['duration'], reverse=True)[:top]
+        listed = ', '.join(f"op {row['op']} ({row['duration']:.2f}s)" for row in slowest)
+        print(f"  slowest ops: {listed}")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize the per-game critical path from tracing JSONL files.')
+    parser.add_argument('paths', nargs='+', help='trace files (rotated .N files are read automatically)')
+    parser.add_argument('--game', help='only show this game_id (trace id)')
+    parser.add_argument('--top', type=int, default=3, help='list the N slowest ops per game (default: 3)')
+    args = parser.parse_args()
+
+    traces = load_spans(args.paths)
+    if args.game:
+        traces = {args.game: traces.get(args.game, [])}
+    for trace_id, spans in sorted(traces.items(), key=lambda item: min((s['start'] for s in item[1]), default=0)):
+        if not spans:
+            print(f"game {trace_id}: no spans")
+            continue
+        print_summary(trace_id, summarize_trace(spans), args.top)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+// 遊戲 WebSocket 協定 (與 game/protocol.py 對應)
+// 連線時以 subprotocol 協商編碼：伺服器支援時使用 MessagePack 二進位訊息 [type_code, payload]，
+// 否則使用 JSON 文字訊息 {type, payload}。MESSAGE_TYPES 的順序必須與伺服器相同。
+(function(global) {
+    'use strict';
+
+    const JSON_SUBPROTOCOL = 'gartic.json.v1';
+    const MSGPACK_SUBPROTOCOL = 'gartic.msgpack.v1';
+
+    const MESSAGE_TYPES = [
+        // 伺服器 -> 客戶端
+        'game_state_update', 'assign_prompt', 'request_drawing', 'request_guess',
+        'game_over', 'results_book', 'update_displayed_book', 'clear_canvas_instruction',
+        'notification', 'error', 'ai_drawing_queued', 'ai_drawing_result',
+        'chat', 'room_update', 'game_started',
+        // 客戶端 -> 伺服器
+        'chat_message', 'start_game', 'submit_prompt', 'submit_drawing', 'submit_guess',
+        'clear_canvas', 'ai_assist_drawing', 'cancel_ai_assist', 'navigate_book',
+        'request_results_book', 'add_bot', 'remove_bot', 'set_llm_provider',
+        // 版本化狀態差異
+        'game_state_delta', 'sync_state',
+        // 客戶端定期送出，延長訪客 ID 的租約
+        'heartbeat',
+    ];
+    const MESSAGE_TYPE_CODES = {};
+    MESSAGE_TYPES.forEach((messageType, index) => { MESSAGE_TYPE_CODES[messageType] = index + 1; });
+
+    const textEncoder = new TextEncoder();
+    const textDecoder = new TextDecoder();
+
+    // --- MessagePack (只實作協定用得到的型別：nil、bool、數字、字串、bin、陣列、map) ---
+    function encodeMsgpack(value) {
+        const bytes = [];
+
+        function pushUint(number, byteLength) {
+            for (let shift = (byteLength - 1) * 8; shift >= 0; shift -= 8) {
+                bytes.push(Math.floor(number / Math.pow(2, shift)) & 0xff);
+            }
+        }
+
+        function writeLength(length, fixPrefix, fixMax, code8, code16, code32) {
+            if (fixPrefix !== null && length <= fixMax) {
+                bytes.push(fixPrefix | length);
+            } else if (code8 !== null && length <= 0xff) {
+                bytes.push(code8, length);
+            } else if (length <= 0xffff) {
+                bytes.push(code16);
+                pushUint(length, 2);
+            } else {
+                bytes.push(code32);
+                pushUint(length, 4);
+            }
+        }
+
+        function write(item) {
+            if (item === null || item === undefined) {
+                bytes.push(0xc0);
+            } else if (item === false) {
+                bytes.push(0xc2);
+            } else if (item === true) {
+                bytes.push(0xc3);
+            } else if (typeof item === 'number') {
+                if (Number.isInteger(item) && item >= 0 && item <= 0xffffffff) {
+                    if (item < 0x80) bytes.push(item);
+                    else if (item <= 0xff) bytes.push(0xcc, item);
+                    else if (item <= 0xffff) { bytes.push(0xcd); pushUint(item, 2); }
+                    else { bytes.push(0xce); pushUint(item, 4); }
+                } else if (Number.isInteger(item) && item < 0 && item >= -0x80000000) {
+                    if (item >= -32) bytes.push(item & 0xff);
+                    else { bytes.push(0xd2); pushUint(item >>> 0, 4); }
+                } else {
+                    const view = new DataView(new ArrayBuffer(8));
+                    view.setFloat64(0, item);
+                    bytes.push(0xcb);
+                    for (let i = 0; i < 8; i++) bytes.push(view.getUint8(i));
+                }
+            } else if (typeof item === 'string') {
+                const encoded = textEncoder.encode(item);
+                writeLength(encoded.length, 0xa0, 31, 0xd9, 0xda, 0xdb);
+                for (let i = 0; i < encoded.length; i++) bytes.push(encoded[i]);
+            } else if (item instanceof Uint8Array) {
+                writeLength(item.length, null, 0, 0xc4, 0xc5, 0xc6);
+                for (let i = 0; i < item.length; i++) bytes.push(item[i]);
+            } else if (Array.isArray(item)) {
+                writeLength(item.length, 0x90, 15, null, 0xdc, 0xdd);
+                item.forEach(write);
+            } else if (typeof item === 'object') {
+                const keys = Object.keys(item).filter(key => item[key] !== undefined);
+                writeLength(keys.length, 0x80, 15, null, 0xde, 0xdf);
+                keys.forEach(key => { write(key); write(item[key]); });
+            } else {
+                throw new Error(`Cannot encode ${typeof item} as MessagePack`);
+            }
+        }
+
+        write(value);
+        return new Uint8Array(bytes);
+    }
+
+    function decodeMsgpack(buffer) {
+        const view = new DataView(buffer.buffer, buffer.byteOffset, buffer.byteLength);
+        let offset = 0;
+
+        function readString(length) {
+            const value = textDecoder.decode(buffer.subarray(offset, offset + length));
+            offset += length;
+            return value;
+        }
+        function readBinary(length) {
+            const value = buffer.slice(offset, offset + length);
+            offset += length;
+            return value;
+        }
+        function readArray(length) {
+            const value = new Array(length);
+            for (let i = 0; i < length; i++) value[i] = read();
+            return value;
+        }
+        function readMap(length) {
+            const value = {};
+            for (let i = 0; i < length; i++) {
+                const key = read();
+                value[key] = read();
+            }
+            return value;
+        }
+        function readUint64() {
+            const high = view.getUint32(offset);
+            const low = view.getUint32(offset + 4);
+            offset += 8;
+            return high * 0x100000000 + low;
+        }
+        function readInt64() {
+            const high = view.getInt32(offset);
+            const low = view.getUint32(offset + 4);
+            offset += 8;
+            return high * 0x100000000 + low;
+        }
+
+        function read() {
+            const code = view.getUint8(offset++);
+            let value;
+            if (code <= 0x7f) return code;
+            if (code >= 0xe0) return code - 0x100;
+            if ((code & 0xf0) === 0x80) return readMap(code & 0x0f);
+            if ((code & 0xf0) === 0x90) return readArray(code & 0x0f);
+            if ((code & 0xe0) === 0xa0) return readString(code & 0x1f);
+            switch (code) {
+                case 0xc0: return null;
+                case 0xc2: return false;
+                case 0xc3: return true;
+                case 0xc4: value = view.getUint8(offset); offset += 1; return readBinary(value);
+                case 0xc5: value = view.getUint16(offset); offset += 2; return readBinary(value);
+                case 0xc6: value = view.getUint32(offset); offset += 4; return readBinary(value);
+                case 0xca: value = view.getFloat32(offset); offset += 4; return value;
+                case 0xcb: value = view.getFloat64(offset); offset += 8; return value;
+                case 0xcc: value = view.getUint8(offset); offset += 1; return value;
+                case 0xcd: value = view.getUint16(offset); offset += 2; return value;
+                case 0xce: value = view.getUint32(offset); offset += 4; return value;
+                case 0xcf: return readUint64();
+                case 0xd0: value = view.getInt8(offset); offset += 1; return value;
+                case 0xd1: value = view.getInt16(offset); offset += 2; return value;
+                case 0xd2: value = view.getInt32(offset); offset += 4; return value;
+                case 0xd3: return readInt64();
+                case 0xd9: value = view.getUint8(offset); offset += 1; return readString(value);
+                case 0xda: value = view.getUint16(offset); offset += 2; return readString(value);
+                case 0xdb: value = view.getUint32(offset); offset += 4; return readString(value);
+                case 0xdc: value = view.getUint16(offset); offset += 2; return readArray(value);
+                case 0xdd: value = view.getUint32(offset); offset += 4; return readArray(value);
+                case 0xde: value = view.getUint16(offset); offset += 2; return readMap(value);
+                case 0xdf: value = view.getUint32(offset); offset += 4; return readMap(value);
+                default: throw new Error(`Unsupported MessagePack type 0x${code.toString(16)}`);
+            }
+        }
+
+        return read();
+    }
+
+    // --- 對外介面 ---
+    function openSocket(url) {
+        const socket = new WebSocket(url, [MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL]);
+        socket.binaryType = 'arraybuffer';
+        return socket;
+    }
+
+    function usesMsgpack(socket) {
+        return socket.protocol === MSGPACK_SUBPROTOCOL;
+    }
+
+    function encode(socket, type, payload) {
+        if (usesMsgpack(socket)) {
+            return encodeMsgpack([MESSAGE_TYPE_CODES[type] || type, payload || {}]);
+        }
+        return JSON.stringify({ type, payload });
+    }
+
+    function decode(data) {
+        if (typeof data === 'string') {
+            const message = JSON.parse(data);
+            return { type: message.type, payload: message.payload || {} };
+        }
+        const message = decodeMsgpack(new Uint8Array(data));
+        const typeCode = message[0];
+        return {
+            type: typeof typeCode === 'number' ? MESSAGE_TYPES[typeCode - 1] : typeCode,
+            payload: message[1] || {},
+        };
+    }
+
+    function send(socket, type, payload = {}) {
+        socket.send(encode(socket, type, payload));
+    }
+
+    // 連線期間定期送出 heartbeat，讓伺服器延長訪客 ID 的租約 (間隔必須小於伺服器的 GUEST_LEASE_TTL)
+    const HEARTBEAT_INTERVAL_MS = 30000;
+
+    function startHeartbeat(socket, intervalMs = HEARTBEAT_INTERVAL_MS) {
+        const timer = setInterval(() => {
+            if (socket.readyState === WebSocket.OPEN) {
+                send(socket, 'heartbeat');
+            }
+        }, intervalMs);
+        socket.addEventListener('close', () => clearInterval(timer));
+        return timer;
+    }
+
+    global.GarticProtocol = {
+        JSON_SUBPROTOCOL,
+        MSGPACK_SUBPROTOCOL,
+        MESSAGE_TYPES,
+        openSocket,
+        encode,
+        decode,
+        send,
+        startHeartbeat,
+        encodeMsgpack,
+        decodeMsgpack,
+    };
+})(window);
@@ -128,6 +128,9 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // 遊戲狀態變數
     let currentGameState = 'waiting';
+    let gameStateData = null; // 最近一次套用的完整狀態
+    let stateVersion = null; // 伺服器的 state_version，用來判斷差異是否可以直接套用
+    let stateSyncPending = false;
     let myPlayerId = null;
     let isHostClient = false; // 新增：追蹤此客戶端是否為主持人
     let isDrawing = false;
@@ -143,6 +146,10 @@ document.addEventListener('DOMContentLoaded', function() {
     };
     // 新增：跟踪AI輔助次數
     let remainingAiAssists = 0;
+    // 目前等待中的 AI 輔助工作 ID
+    let pendingAiJobId = null;
+    // 伺服器指派的目前任務 ID，隨二進位上傳一起送出
+    let currentAssignmentId = null;
 
     // Undo/Redo stacks
     let undoStack = [];
@@ -165,12 +172,13 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // --- WebSocket 連接 ---
     const wsProtocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    const gameSocket = new WebSocket(
+    const gameSocket = GarticProtocol.openSocket(
         `${wsProtocol}//${window.location.host}/ws/game/${roomName}/?userid=${encodeURIComponent(user_id)}`
     );
 
     gameSocket.onopen = function(e) {
         console.log('WebSocket connection established');
+        GarticProtocol.startHeartbeat(gameSocket);
         // Client is ready, will wait for game_state_update or specific assignments.
         // If client is reconnecting, server might send current state.
         // For new game, client sends 'start_game' which host (or first player) triggers.
@@ -192,49 +200,40 @@ document.addEventListener('DOMContentLoaded', function() {
     };
 
     gameSocket.onmessage = function(e) {
-        const data = JSON.parse(e.data);
-        const messageType = data.type;
-        const payload = data.payload;
+        const { type: messageType, payload } = GarticProtocol.decode(e.data);
 
         console.log("Received message:", messageType, payload);
 
         switch (messageType) {
             case 'game_state_update':
-                myPlayerId = payload.your_player_id || myPlayerId; 
-                console.log("game_state_update: myPlayerId is now:", myPlayerId); // DEBUG
-                if (myPlayerId && payload.players && payload.players[myPlayerId]) {
-                    const playerEntry = payload.players[myPlayerId];
-                    console.log("game_state_update: Player entry for host check:", playerEntry); // DEBUG
-                    console.log("game_state_update: isHost property from payload:", playerEntry.isHost); // DEBUG
-                    isHostClient = playerEntry.isHost || false; // 根據 payload 更新 isHostClient
-                    console.log("game_state_update: isHostClient set to:", isHostClient, "for player:", myPlayerId); // DEBUG
-                } else {
-                    console.warn("game_state_update: Could not determine host status. Conditions for host check not fully met."); // DEBUG
-                    console.warn("game_state_update: myPlayerId:", myPlayerId, "payload.players:", payload.players); // DEBUG
-                    if (payload.players && myPlayerId) {
-                        console.warn("game_state_update: payload.players[myPlayerId]:", payload.players[myPlayerId]); // DEBUG
-                    }
-                    // isHostClient is not set to false here to allow subsequent messages to potentially set it correctly
-                }
-                updateUI(payload);
+                stateSyncPending = false;
+                applyGameState(payload);
+                break;
+            case 'game_state_delta':
+                applyGameStateDelta(payload);
                 break;
             case 'assign_prompt': // New: Server assigns task to submit a prompt
                 showPromptInput();
                 break;
             case 'request_drawing': // Existing: Server assigns task to draw
+                currentAssignmentId = payload.assignment_id || null;
                 showDrawingArea(payload.prompt_or_guess, payload.round);
                 break;
             case 'request_guess': // Existing: Server assigns task to guess
+                currentAssignmentId = payload.assignment_id || null;
                 showGuessInput(payload.drawing_data, payload.round);
                 break;
             case 'game_over':
                 showResults(payload); // showResults 內部會更新 isHostClient 並調用 updateBookNavigationButtons
                 break;
+            case 'results_book': // 遊戲結果逐本送達
+                receiveResultsBook(payload);
+                break;
             case 'update_displayed_book': // 新增：處理書本導覽更新
                 if (payload && typeof payload.book_index === 'number') {
                     currentBookDisplayIndex = payload.book_index;
-                    renderCurrentBook(); 
                     updateBookNavigationButtons(); // 使用已更新的 isHostClient
+                    ensureBookLoaded(currentBookDisplayIndex);
                 }
                 break;
             case 'clear_canvas_instruction':
@@ -246,6 +245,17 @@ document.addEventListener('DOMContentLoaded', function() {
             case 'error':
                 showStatusMessage(`錯誤: ${payload.message}`, 'error');
                 break;
+            case 'ai_drawing_queued':
+                pendingAiJobId = payload.job_id;
+                if (typeof payload.remaining_ai_assists === 'number') {
+                    remainingAiAssists = payload.remaining_ai_assists;
+                    const remainingAiAssistsEl = document.getElementById('remaining-ai-assists');
+                    if (remainingAiAssistsEl) {
+                        remainingAiAssistsEl.textContent = remainingAiAssists;
+                    }
+                }
+                showStatusMessage('AI 正在處理您的繪畫...', 'info');
+                break;
             case 'ai_drawing_result':
                 handleAiDrawingResult(payload);
                 break;
@@ -255,6 +265,55 @@ document.addEventListener('DOMContentLoaded', function() {
     };
 
     // --- UI 更新函數 ---
+    // 套用完整狀態 (game_state_update) 或合併差異後的狀態
+    function applyGameState(stateData) {
+        gameStateData = stateData;
+        stateVersion = stateData.state_version;
+        myPlayerId = stateData.your_player_id || myPlayerId; 
+        console.log("game_state_update: myPlayerId is now:", myPlayerId); // DEBUG
+        if (myPlayerId && stateData.players && stateData.players[myPlayerId]) {
+            const playerEntry = stateData.players[myPlayerId];
+            console.log("game_state_update: Player entry for host check:", playerEntry); // DEBUG
+            console.log("game_state_update: isHost property from stateData:", playerEntry.isHost); // DEBUG
+            isHostClient = playerEntry.isHost || false; // 根據 stateData 更新 isHostClient
+            console.log("game_state_update: isHostClient set to:", isHostClient, "for player:", myPlayerId); // DEBUG
+        } else {
+            console.warn("game_state_update: Could not determine host status. Conditions for host check not fully met."); // DEBUG
+            console.warn("game_state_update: myPlayerId:", myPlayerId, "stateData.players:", stateData.players); // DEBUG
+            if (stateData.players && myPlayerId) {
+                console.warn("game_state_update: stateData.players[myPlayerId]:", stateData.players[myPlayerId]); // DEBUG
+            }
+            // isHostClient is not set to false here to allow subsequent messages to potentially set it correctly
+        }
+        updateUI(stateData);
+    }
+
+    // 狀態差異只在版本連續時套用，否則向伺服器要求完整狀態
+    function applyGameStateDelta(delta) {
+        if (gameStateData && delta.base_version < stateVersion) {
+            return; // 比目前狀態更舊的差異 (在完整狀態之後才到達)
+        }
+        if (!gameStateData || delta.base_version !== stateVersion) {
+            if (!stateSyncPending) {
+                console.warn("game_state_delta: version mismatch, requesting full state", stateVersion, delta.base_version);
+                stateSyncPending = true;
+                sendMessage('sync_state', { state_version: stateVersion });
+            }
+            return;
+        }
+        stateSyncPending = false;
+        const nextState = {
+            ...gameStateData,
+            ...delta.changes,
+            state_version: delta.state_version
+        };
+        // 沒有附上狀態訊息的差異沿用目前的訊息
+        if ('status_message' in delta) {
+            nextState.status_message = delta.status_message;
+        }
+        applyGameState(nextState);
+    }
+
     function updateUI(stateData) {
         currentGameState = stateData.state;
         // Use a more specific status message if available, otherwise generate default
@@ -512,7 +571,8 @@ document.addEventListener('DOMContentLoaded', function() {
             console.log("showResults: myPlayerId updated from game_over payload to:", myPlayerId); // DEBUG
         }
         
-        allBooksPayload = payload; 
+        // 書本內容由之後的 results_book 訊息逐本送達並快取在 allBooksPayload.books
+        allBooksPayload = Object.assign({}, payload, { books: (allBooksPayload && allBooksPayload.books) || payload.books || {} });
         
         console.log("showResults: Full payload received for game_over:", JSON.stringify(payload, null, 2)); // DEBUG
         console.log("showResults: myPlayerId before host check:", myPlayerId); // DEBUG
@@ -536,7 +596,7 @@ document.addEventListener('DOMContentLoaded', function() {
             console.log("showResults: isHostClient defaulted to false in ELSE branch."); // DEBUG
         }
 
-        displayedBooksOrder = payload.turn_order || Object.keys(payload.books || {});
+        displayedBooksOrder = payload.turn_order || Object.keys(allBooksPayload.books);
 
         currentBookDisplayIndex = 0; 
 
@@ -562,88 +622,124 @@ document.addEventListener('DOMContentLoaded', function() {
             return;
         }
     
-        // 創建之前、當前和下一個故事本
+        // 創建之前、當前和下一個故事本 (尚未送達的書本先顯示載入中)
         for (let i = 0; i < displayedBooksOrder.length; i++) {
-            const originalPlayerId = displayedBooksOrder[i];
-            const bookData = allBooksPayload.books[originalPlayerId];
-            const playersData = allBooksPayload.players; // 從 payload 中獲取玩家數據
+            booksContainer.appendChild(buildBookElement(i));
+        }
+        ensureBookLoaded(currentBookDisplayIndex);
+    }
+
+    // 收到 results_book 時只替換該本書的元素，不重繪其他書本
+    function receiveResultsBook(payload) {
+        if (!allBooksPayload) {
+            allBooksPayload = { books: {}, players: {} };
+        }
+        allBooksPayload.books[payload.owner] = payload.items || [];
+        const existing = booksContainer.children[payload.book_index];
+        if (existing && displayedBooksOrder[payload.book_index] === payload.owner) {
+            booksContainer.replaceChild(buildBookElement(payload.book_index), existing);
+        }
+    }
+
+    // 目前顯示的書本若尚未送達 (例如訊息遺失)，向伺服器補要
+    function ensureBookLoaded(bookIndex) {
+        const originalPlayerId = displayedBooksOrder[bookIndex];
+        if (originalPlayerId && allBooksPayload && !allBooksPayload.books[originalPlayerId]) {
+            setTimeout(() => {
+                if (!allBooksPayload.books[originalPlayerId]) {
+                    sendMessage('request_results_book', { book_index: bookIndex });
+                }
+            }, 2000);
+        }
+    }
+
+    function buildBookElement(i) {
+        const originalPlayerId = displayedBooksOrder[i];
+        const bookData = allBooksPayload.books[originalPlayerId];
+        const playersData = allBooksPayload.players || {}; // 從 payload 中獲取玩家數據
+
+        const bookDiv = document.createElement('div');
+        bookDiv.className = 'book';
+        
+        // 設置適當的類別用於轉場動畫
+        if (i === currentBookDisplayIndex) {
+            bookDiv.classList.add('active');
+        } else if (i < currentBookDisplayIndex) {
+            bookDiv.classList.add('previous');
+        } else {
+            bookDiv.classList.add('next');
+        }
+        
+        const bookTitle = document.createElement('h4');
+        const initiatorName = playersData[originalPlayerId]?.name || `玩家 ${originalPlayerId.substring(0,4)}`;
+        bookTitle.textContent = `${initiatorName} 的故事本`;
+        bookDiv.appendChild(bookTitle);
+
+        if (!bookData) {
+            const loadingText = document.createElement('p');
+            loadingText.className = 'book-loading';
+            loadingText.textContent = '故事本載入中...';
+            bookDiv.appendChild(loadingText);
+            return bookDiv;
+        }
     
-            if (!bookData) continue;
+        const progressLine = document.createElement('div');
+        progressLine.className = 'book-progress-line';
+        bookDiv.appendChild(progressLine);
     
-            const bookDiv = document.createElement('div');
-            bookDiv.className = 'book';
-            
-            // 設置適當的類別用於轉場動畫
-            if (i === currentBookDisplayIndex) {
-                bookDiv.classList.add('active');
-            } else if (i < currentBookDisplayIndex) {
-                bookDiv.classList.add('previous');
-            } else {
-                bookDiv.classList.add('next');
-            }
-            
-            const bookTitle = document.createElement('h4');
-            const initiatorName = playersData[originalPlayerId]?.name || `玩家 ${originalPlayerId.substring(0,4)}`;
-            bookTitle.textContent = `${initiatorName} 的故事本`;
-            bookDiv.appendChild(bookTitle);
+        bookData.forEach((item, itemIndex) => {
+            const itemDiv = document.createElement('div');
+            itemDiv.className = 'book-item';
+            // 添加用於動畫延遲的自定義屬性
+            itemDiv.style.setProperty('--item-index', itemIndex);
     
-            const progressLine = document.createElement('div');
-            progressLine.className = 'book-progress-line';
-            bookDiv.appendChild(progressLine);
+            const itemPlayerId = item.player;
+            const itemPlayerName = playersData[itemPlayerId]?.name || `玩家 ${itemPlayerId.substring(0,4)}`;
     
-            bookData.forEach((item, itemIndex) => {
-                const itemDiv = document.createElement('div');
-                itemDiv.className = 'book-item';
-                // 添加用於動畫延遲的自定義屬性
-                itemDiv.style.setProperty('--item-index', itemIndex);
+            const typeTag = document.createElement('div');
+            typeTag.className = 'book-item-tag';
+            
+            const contentDiv = document.createElement('div');
+            contentDiv.className = 'book-item-content';
     
-                const itemPlayerId = item.player;
-                const itemPlayerName = playersData[itemPlayerId]?.name || `玩家 ${itemPlayerId.substring(0,4)}`;
+            let roundText = "";
+            if (item.round > 0) {
+                roundText = ` (第 ${item.round} 回合)`;
+            }
     
-                const typeTag = document.createElement('div');
-                typeTag.className = 'book-item-tag';
+            if (item.type === 'prompt') {
+                typeTag.textContent = '題目';
+                typeTag.classList.add('tag-prompt');
+                const contentText = document.createElement('p');
+                contentText.innerHTML = `<strong>${itemPlayerName}</strong> 提出了題目：<br>"${item.data}"`;
+                contentDiv.appendChild(contentText);
+            } else if (item.type === 'drawing') {
+                typeTag.textContent = '繪畫';
+                typeTag.classList.add('tag-drawing');
                 
-                const contentDiv = document.createElement('div');
-                contentDiv.className = 'book-item-content';
-    
-                let roundText = "";
-                if (item.round > 0) {
-                    roundText = ` (第 ${item.round} 回合)`;
-                }
-    
-                if (item.type === 'prompt') {
-                    typeTag.textContent = '題目';
-                    typeTag.classList.add('tag-prompt');
-                    const contentText = document.createElement('p');
-                    contentText.innerHTML = `<strong>${itemPlayerName}</strong> 提出了題目：<br>"${item.data}"`;
-                    contentDiv.appendChild(contentText);
-                } else if (item.type === 'drawing') {
-                    typeTag.textContent = '繪畫';
-                    typeTag.classList.add('tag-drawing');
-                    
-                    const contentText = document.createElement('p');
-                    contentText.innerHTML = `<strong>${itemPlayerName}</strong> 根據上一個提示畫了${roundText}：`;
-                    contentDiv.appendChild(contentText);
-                    
-                    const img = document.createElement('img');
-                    img.src = item.data;
-                    img.alt = `${itemPlayerName} 的繪畫`;
-                    img.className = 'book-drawing';
-                    contentDiv.appendChild(img);
-                } else if (item.type === 'guess') {
-                    typeTag.textContent = '猜測';
-                    typeTag.classList.add('tag-guess');
-                    const contentText = document.createElement('p');
-                    contentText.innerHTML = `<strong>${itemPlayerName}</strong> 猜測這是${roundText}：<br>"${item.data}"`;
-                    contentDiv.appendChild(contentText);
-                }
+                const contentText = document.createElement('p');
+                contentText.innerHTML = `<strong>${itemPlayerName}</strong> 根據上一個提示畫了${roundText}：`;
+                contentDiv.appendChild(contentText);
                 
-                itemDiv.appendChild(typeTag);
-                itemDiv.appendChild(contentDiv);
-                bookDiv.appendChild(itemDiv);
-            });
-            booksContainer.appendChild(bookDiv);
-        }
+                const img = document.createElement('img');
+                img.src = item.data;
+                img.alt = `${itemPlayerName} 的繪畫`;
+                img.className = 'book-drawing';
+                img.loading = 'lazy';
+                contentDiv.appendChild(img);
+            } else if (item.type === 'guess') {
+                typeTag.textContent = '猜測';
+                typeTag.classList.add('tag-guess');
+                const contentText = document.createElement('p');
+                contentText.innerHTML = `<strong>${itemPlayerName}</strong> 猜測這是${roundText}：<br>"${item.data}"`;
+                contentDiv.appendChild(contentText);
+            }
+            
+            itemDiv.appendChild(typeTag);
+            itemDiv.appendChild(contentDiv);
+            bookDiv.appendChild(itemDiv);
+        });
+        return bookDiv;
     }
     
     // 訂閱事件來處理Prev/Next導航和WebSocket消息
@@ -930,13 +1026,49 @@ document.addEventListener('DOMContentLoaded', function() {
     // --- 事件監聽器 ---
     function sendMessage(type, payload = {}) {
         if (gameSocket.readyState === WebSocket.OPEN) {
-            gameSocket.send(JSON.stringify({ type, payload }));
+            GarticProtocol.send(gameSocket, type, payload);
         } else {
             console.error("WebSocket is not open. Cannot send message.");
             showStatusMessage("無法連接伺服器，請重新整理頁面。", "error");
         }
     }
 
+    // 二進位上傳訊息 (格式見 game/binary_frames.py)：
+    // [0xC1, 版本, 類型代碼, header 長度 (uint16)] + JSON header + 原始圖片
+    const BINARY_FRAME_MAGIC = 0xC1;
+    const BINARY_FRAME_VERSION = 1;
+    const BINARY_FRAME_TYPES = { submit_drawing: 1, ai_assist_drawing: 2 };
+
+    function sendBinaryMessage(type, meta, imageBlob) {
+        if (gameSocket.readyState !== WebSocket.OPEN) {
+            console.error("WebSocket is not open. Cannot send message.");
+            showStatusMessage("無法連接伺服器，請重新整理頁面。", "error");
+            return;
+        }
+        const header = new TextEncoder().encode(JSON.stringify(meta));
+        const prefix = new Uint8Array(5);
+        prefix[0] = BINARY_FRAME_MAGIC;
+        prefix[1] = BINARY_FRAME_VERSION;
+        prefix[2] = BINARY_FRAME_TYPES[type];
+        new DataView(prefix.buffer).setUint16(3, header.length);
+        gameSocket.send(new Blob([prefix, header, imageBlob]));
+    }
+
+    // 以二進位訊息上傳畫布；瀏覽器不支援 toBlob 時改用舊的 data URL + JSON 方式
+    function sendCanvas(type, meta, jsonPayload) {
+        if (drawingCanvasEl.toBlob) {
+            drawingCanvasEl.toBlob(function(blob) {
+                if (blob) {
+                    sendBinaryMessage(type, Object.assign({ mime: blob.type || 'image/png' }, meta), blob);
+                } else {
+                    sendMessage(type, Object.assign({ drawing: drawingCanvasEl.toDataURL('image/png') }, jsonPayload));
+                }
+            }, 'image/png');
+        } else {
+            sendMessage(type, Object.assign({ drawing: drawingCanvasEl.toDataURL('image/png') }, jsonPayload));
+        }
+    }
+
     submitPromptButton.onclick = function() {
         const promptText = promptInput.value.trim();
         if (promptText) {
@@ -1007,7 +1139,10 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // 取消按鈕點擊事件
     if (aiAssistCancelBtn) {
-        aiAssistCancelBtn.onclick = hideAiAssistModal;
+        aiAssistCancelBtn.onclick = function() {
+            cancelPendingAiAssist();
+            hideAiAssistModal();
+        };
     }
 
     // Modal 背景點擊關閉
@@ -1032,14 +1167,8 @@ document.addEventListener('DOMContentLoaded', function() {
             aiAssistSubmitBtn.disabled = true;
             aiAssistSubmitBtn.innerHTML = '<span class="btn-icon">⏳</span><span class="btn-text">處理中...</span>';
 
-            // 取得當前畫布內容
-            const drawingDataUrl = drawingCanvasEl.toDataURL('image/png');
-            
-            // 向後端發送 AI 輔助繪畫請求
-            sendMessage('ai_assist_drawing', { 
-                prompt: promptText,
-                drawing: drawingDataUrl
-            });
+            // 以二進位訊息將當前畫布與描述送往後端
+            sendCanvas('ai_assist_drawing', { prompt: promptText }, { prompt: promptText });
 
             // 顯示處理中訊息
             showStatusMessage('AI 正在處理您的繪畫...', 'info');
@@ -1047,8 +1176,8 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     submitDrawingButton.onclick = function() {
-        const drawingDataUrl = drawingCanvasEl.toDataURL(); // 預設為 image/png
-        sendMessage('submit_drawing', { drawing: drawingDataUrl });
+        // 以二進位訊息上傳畫作，避免 base64 膨脹與伺服器端的 JSON 解析
+        sendCanvas('submit_drawing', { assignment_id: currentAssignmentId }, { assignment_id: currentAssignmentId });
         submitDrawingButton.disabled = true;
         showStatusMessage('繪畫已提交，等待其他玩家...', 'info'); 
     };
@@ -1321,9 +1450,25 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    // 取消等待中的 AI 輔助工作
+    function cancelPendingAiAssist() {
+        if (pendingAiJobId) {
+            sendMessage('cancel_ai_assist', { job_id: pendingAiJobId });
+        }
+    }
+
     // 添加處理 AI 繪畫結果的函數
     function handleAiDrawingResult(payload) {
-        if (payload.success) {
+        if (payload.job_id && payload.job_id !== pendingAiJobId) {
+            // 已被取代或取消的工作結果，忽略
+            console.warn("Ignoring stale AI drawing result:", payload.job_id);
+            return;
+        }
+        pendingAiJobId = null;
+
+        if (payload.cancelled) {
+            showStatusMessage(payload.error || 'AI 輔助已取消', 'info');
+        } else if (payload.success) {
             const context = drawingCanvasEl.getContext('2d');
 
             // 將結果圖像應用到畫布
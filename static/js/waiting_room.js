@@ -42,6 +42,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const startGameButton = document.getElementById('start-game-button');
     const addBotButton = document.getElementById('add-bot');
     const removeBotButton = document.getElementById('remove-bot');
+    const botProviderSelect = document.getElementById('bot-provider-select');
     const roomLinkInput = document.getElementById('room-link');
     const copyLinkButton = document.getElementById('copy-link');
     const notification = document.getElementById('notification');
@@ -67,11 +68,12 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // WebSocket 連接
     const wsProtocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    const gameSocket = new WebSocket(
+    const gameSocket = GarticProtocol.openSocket(
         `${wsProtocol}//${window.location.host}/ws/waiting_room/${roomName}/?userid=${encodeURIComponent(user_id)}`
     );
     gameSocket.onopen = function(e) {
         console.log('WebSocket connection established');
+        GarticProtocol.startHeartbeat(gameSocket);
     };
     gameSocket.onclose = function(e) {
         console.error('WebSocket connection closed unexpectedly');
@@ -82,9 +84,7 @@ document.addEventListener('DOMContentLoaded', function() {
         showNotification('連線錯誤，請檢查網路或伺服器狀態。', 'error');
     }
     gameSocket.onmessage = function(e) {
-        const data = JSON.parse(e.data);
-        const messageType = data.type;
-        const payload = data.payload;
+        const { type: messageType, payload } = GarticProtocol.decode(e.data);
         
         console.log("Received message:", messageType, payload);
 
@@ -110,7 +110,7 @@ document.addEventListener('DOMContentLoaded', function() {
     // 發送訊息到伺服器
     function sendMessage(type, payload = {}) {
         if (gameSocket.readyState === WebSocket.OPEN) {
-            gameSocket.send(JSON.stringify({ type, payload }));
+            GarticProtocol.send(gameSocket, type, payload);
         } else {
             showNotification("無法連接伺服器，請重新整理頁面。", "error");
         }
@@ -134,6 +134,17 @@ document.addEventListener('DOMContentLoaded', function() {
         startGameButton.disabled = playerCount < MIN_PLAYERS_TO_START;
         addBotButton.disabled = playerCount >= MAX_PLAYERS;
         removeBotButton.disabled = botCount <= 0;
+
+        // 更新機器人 AI 模式 (只有房主可以變更)
+        if (botProviderSelect) {
+            const availableProviders = roomState.available_llm_providers || [];
+            Array.from(botProviderSelect.options).forEach(option => {
+                option.disabled = option.value !== 'auto' && !availableProviders.includes(option.value);
+            });
+            botProviderSelect.value = (roomState.llm_providers && roomState.llm_providers.all) || 'auto';
+            const me = players.find(player => player.id === user_id);
+            botProviderSelect.disabled = !(me && me.isHost);
+        }
         
         // 如果有足夠玩家，顯示可以開始的提示
         if (playerCount >= MIN_PLAYERS_TO_START && startGameButton.disabled) {
@@ -233,6 +244,13 @@ document.addEventListener('DOMContentLoaded', function() {
         sendMessage('remove_bot');
     });
 
+    // 變更機器人 AI 模式
+    if (botProviderSelect) {
+        botProviderSelect.addEventListener('change', function() {
+            sendMessage('set_llm_provider', { provider: botProviderSelect.value, call_type: 'all' });
+        });
+    }
+
     // 開始遊戲
     startGameButton.addEventListener('click', function() {
         if (players.length >= MIN_PLAYERS_TO_START) {